@@ -0,0 +1,206 @@
+"""
+Scale benchmarks of DatabaseHandler on deterministic synthetic data.
+
+Measures startup time, ingest throughput per manager, `is_downloaded`/`filter_not_downloaded`
+latency, view query latency and the database file size, writes them to a JSON file and
+compares them with a baseline run using the relative tolerances in `thresholds.json`.
+
+    python benchmarks/run_benchmarks.py --rows 100000 --out benchmarks/results/main.json
+    python benchmarks/run_benchmarks.py --rows 100000 --baseline benchmarks/results/main.json
+
+Exits with status 1 when a metric regressed beyond its tolerance.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import text
+
+from database.database_handler import DatabaseHandler
+from database.util.base import Settings
+from database.util.synthetic import SyntheticData
+
+HERE = Path(__file__).resolve().parent
+
+# Ingest order respects the foreign keys.
+INGEST_TABLES = {
+    "images": "image_manager",
+    "downloads": "download_manager",
+    "detections": "detection_manager",
+    "objects": "object_manager",
+    "ais": "ais_manager",
+}
+
+# detection_summary_by_image is left out: it averages a column detections does not have.
+AGGREGATE_VIEWS = (
+    "image_counts_by_constellation",
+    "download_summary_by_status",
+    "detection_summary_sentinel_1",
+    "object_summary_sentinel_1",
+    "ais_summary_by_image",
+)
+
+
+def _metric(value: float, unit: str, better: str) -> Dict[str, object]:
+    return {"value": value, "unit": unit, "better": better}
+
+
+def _timed(function: Callable[[], object], repeat: int = 1) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(rows: int, workdir: Path, seed: int = 0, chunk_size: int = 50_000, profile: str = "default", samples: int = 1_000) -> dict:
+    """
+    Build a database of `rows` synthetic rows in `workdir` and measure it.
+
+    Returns:
+        dict: `meta` (run settings and environment) and `metrics` (name -> value, unit, better).
+    """
+    db_file = workdir / "benchmark.db"
+    config = Settings(base_path=workdir, sqlite_profile=profile)
+    data = SyntheticData(rows=rows, seed=seed)
+    metrics: Dict[str, Dict[str, object]] = {}
+
+    (created,) = _timed(lambda: DatabaseHandler(db_file=db_file, config=config))
+    metrics["startup_create_s"] = _metric(created, "s", "lower")
+
+    db = DatabaseHandler(db_file=db_file, config=config)
+    for table, manager_name in INGEST_TABLES.items():
+        manager = getattr(db, manager_name)
+        inserted, seconds = 0, 0.0
+        for frame in data.frames(table, chunk_size):
+            started = time.perf_counter()
+            inserted += manager.insert_dataframe(frame, batch_size=chunk_size)
+            seconds += time.perf_counter() - started
+        metrics[f"ingest_{table}_rows_per_s"] = _metric(inserted / seconds if seconds else 0.0, "rows/s", "higher")
+
+    # A warm open is a few milliseconds (mostly SQLite's first connection reading the schema): median of many.
+    metrics["startup_open_s"] = _metric(statistics.median(_timed(lambda: DatabaseHandler(db_file=db_file, config=config), repeat=50)), "s", "lower")
+    read_only_open = statistics.median(_timed(lambda: DatabaseHandler(db_file=db_file, config=config, read_only=True), repeat=50))
+    metrics["startup_open_read_only_s"] = _metric(read_only_open, "s", "lower")
+
+    rng = np.random.default_rng(seed)
+    downloads = data.counts["downloads"]
+    candidates = [f"SYN_PRD_{i:09d}" for i in rng.integers(0, downloads * 2, samples)]  # about half are misses
+    latencies = sorted(_timed(lambda it=iter(candidates): db.is_downloaded(next(it)), repeat=samples))
+    metrics["is_downloaded_p50_ms"] = _metric(latencies[len(latencies) // 2] * 1000, "ms", "lower")
+    metrics["is_downloaded_p95_ms"] = _metric(latencies[int(len(latencies) * 0.95)] * 1000, "ms", "lower")
+    metrics["filter_not_downloaded_ms"] = _metric(min(_timed(lambda: db.filter_not_downloaded(candidates), repeat=3)) * 1000, "ms", "lower")
+
+    with db.read_engine.connect() as conn:
+        for view in AGGREGATE_VIEWS:
+            seconds = min(_timed(lambda: conn.execute(text(f"SELECT * FROM {view}")).fetchall(), repeat=3))
+            metrics[f"view_{view}_ms"] = _metric(seconds * 1000, "ms", "lower")
+        image_ids = [f"SYN_IMG_{i:09d}" for i in rng.integers(0, data.counts["images"], 50)]
+        lookup = text("SELECT * FROM ais_records_with_image_info WHERE image_id = :image_id")
+        seconds = statistics.median(_timed(lambda it=iter(image_ids): conn.execute(lookup, {"image_id": next(it)}).fetchall(), repeat=len(image_ids)))
+        metrics["view_ais_records_with_image_info_by_image_ms"] = _metric(seconds * 1000, "ms", "lower")
+
+    db.engine.dispose()
+    db.read_engine.dispose()
+    metrics["db_size_mb"] = _metric(db_file.stat().st_size / 1024**2, "MB", "lower")
+
+    return {
+        "meta": {
+            "rows": rows,
+            "table_rows": data.counts,
+            "seed": seed,
+            "profile": profile,
+            "commit": _git_commit(),
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+        },
+        "metrics": metrics,
+    }
+
+
+def compare(results: dict, baseline: dict, thresholds: dict) -> List[str]:
+    """
+    Describe every metric that is worse than the baseline by more than its relative tolerance.
+
+    Args:
+        results (dict): Output of `run`.
+        baseline (dict): Output of an earlier `run` with the same `rows`.
+        thresholds (dict): {"default": tolerance, "metrics": {name: tolerance}}.
+
+    Returns:
+        list: One message per regression.
+    """
+    regressions = []
+    for name, metric in results["metrics"].items():
+        reference = baseline["metrics"].get(name)
+        if not reference or not reference["value"]:
+            continue
+        tolerance = thresholds.get("metrics", {}).get(name, thresholds.get("default", 0.25))
+        change = (metric["value"] - reference["value"]) / reference["value"]
+        worse = -change if metric["better"] == "higher" else change
+        if worse > tolerance:
+            regressions.append(f"{name}: {reference['value']:.4g} -> {metric['value']:.4g} {metric['unit']} ({worse:+.0%} worse, tolerance {tolerance:.0%})")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10_000, help="Total synthetic rows (10k to 100M).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--profile", default="default", help="Settings.sqlite_profile to benchmark.")
+    parser.add_argument("--workdir", type=Path, help="Directory of the benchmark database (default: a temporary one).")
+    parser.add_argument("--out", type=Path, help="Write the results JSON here.")
+    parser.add_argument("--baseline", type=Path, help="Results JSON to compare against.")
+    parser.add_argument("--thresholds", type=Path, default=HERE / "thresholds.json")
+    args = parser.parse_args(argv)
+
+    if args.workdir:
+        args.workdir.mkdir(parents=True, exist_ok=True)
+        results = run(args.rows, args.workdir, args.seed, args.chunk_size, args.profile)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = run(args.rows, Path(workdir), args.seed, args.chunk_size, args.profile)
+
+    for name, metric in results["metrics"].items():
+        print(f"{name:50s} {metric['value']:>14.4f} {metric['unit']}")
+    if args.out:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        args.out.write_text(json.dumps(results, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline["meta"]["rows"] != results["meta"]["rows"]:
+            print(f"warning: baseline was run with {baseline['meta']['rows']} rows, this run with {results['meta']['rows']}")
+        regressions = compare(results, baseline, json.loads(args.thresholds.read_text()))
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
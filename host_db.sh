@@ -39,13 +39,16 @@ LOGFILE="/tmp/datasette_host.log"
 
 # === Usage Help ===
 usage() {
-  echo "Usage: $0 --db /full/path/to.db [--port 8000] [--title 'Viewer Title'] [--log-file /path/to/log]"
+  echo "Usage: $0 --db /full/path/to.db [--source /live/downloads.db] [--every 300] [--port 8000] [--title 'Viewer Title'] [--log-file /path/to/log]"
+  echo "  --source  live database; a snapshot of it is published to --db every --every seconds (database.util.snapshot)"
   exit 1
 }
 
 
 # === Parse Arguments ===
 DB_PATH=""
+SOURCE_DB=""
+EVERY=300
 PORT="$DEFAULT_PORT"
 TITLE="$DEFAULT_TITLE"
 
@@ -53,6 +56,10 @@ while [[ $# -gt 0 ]]; do
   case $1 in
     --db)
       DB_PATH="$2"; shift 2 ;;
+    --source)
+      SOURCE_DB="$2"; shift 2 ;;
+    --every)
+      EVERY="$2"; shift 2 ;;
     --port)
       PORT="$2"; shift 2 ;;
     --title)
@@ -64,6 +71,28 @@ while [[ $# -gt 0 ]]; do
   esac
 done
 
+# === Publish a snapshot of the live DB (never serve the file the workers write to) ===
+if [[ -n "$SOURCE_DB" ]]; then
+  if [[ ! -f "$SOURCE_DB" ]]; then
+    echo "Error: source DB file does not exist: $SOURCE_DB"
+    usage
+  fi
+  mkdir -p "$(dirname "$LOGFILE")" "$(dirname "$DB_PATH")"
+  # The publisher's first round publishes right away; wait for it instead of publishing twice.
+  # A snapshot left by an earlier run is not served: the new one arrives with a new inode.
+  PREVIOUS_INODE="$(stat -c %i "$DB_PATH" 2>/dev/null || true)"
+  python3 -m database.util.snapshot "$SOURCE_DB" "$DB_PATH" --every "$EVERY" >> "$LOGFILE" 2>&1 &
+  PUBLISHER_PID=$!
+  trap 'kill "$PUBLISHER_PID" 2>/dev/null' EXIT
+  until [[ -f "$DB_PATH" && "$(stat -c %i "$DB_PATH")" != "$PREVIOUS_INODE" ]]; do
+    if ! kill -0 "$PUBLISHER_PID" 2>/dev/null; then
+      echo "Error: snapshot publisher exited before its first snapshot; see $LOGFILE"
+      exit 1
+    fi
+    sleep 1
+  done
+fi
+
 # === Validate Inputs ===
 if [[ ! -f "$DB_PATH" ]]; then
   echo "Error: DB file does not exist: $DB_PATH"
@@ -130,19 +159,27 @@ while true; do
 
   # Run datasette (read-only, safe options)
 
+  # --immutable is only safe on a snapshot: nothing may write to DB_PATH in place.
+  # The publisher swaps in new snapshots with a rename; restart datasette to pick them up.
+  echo "[$(date)] Starting datasette..." >> "$LOGFILE"
   datasette serve \
     --immutable "$DB_PATH" \
     --host 0.0.0.0 \
     --port "$PORT" \
     --metadata "$METAFILE" \
     --setting allow_download false \
-    --cors >> "$LOGFILE" 2>&1
-
-
-  echo "[$(date)] Starting datasette..." >> "$LOGFILE"
-
-
-  EXIT_CODE=$?
+    --cors >> "$LOGFILE" 2>&1 &
+  DATASETTE_PID=$!
+
+  SERVED_INODE="$(stat -c %i "$DB_PATH")"
+  while kill -0 "$DATASETTE_PID" 2>/dev/null; do
+    sleep 10
+    if [[ -n "$SOURCE_DB" && "$(stat -c %i "$DB_PATH" 2>/dev/null)" != "$SERVED_INODE" ]]; then
+      echo "[$(date)] New snapshot published; restarting datasette." >> "$LOGFILE"
+      kill "$DATASETTE_PID"
+    fi
+  done
+  wait "$DATASETTE_PID" && EXIT_CODE=0 || EXIT_CODE=$?
 
   echo "[$(date)] Datasette exited with code $EXIT_CODE. Restarting in 5 sec..." >> "$LOGFILE"
   sleep 5
@@ -0,0 +1,277 @@
+"""
+Asyncio version of the DatabaseHandler for async downloaders and web services.
+
+Built on SQLAlchemy's async engine over aiosqlite (an optional dependency). The managers
+share their row building and upsert statements with the synchronous managers, so both
+handlers write identical rows and can be used on the same database at the same time.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncGenerator, Dict, Iterable, List, Optional, Sequence
+
+import pandas as pd
+from sqlalchemy import insert, select
+
+from database.util.base import Settings
+from database.util.bulk import chunked
+from database.util.cache import GenerationTracker
+from database.util.chips import ChipStore, pack_path
+from database.util.engine import create_async_engines, resolve_pragmas
+from database.util.managers import AISManager, DetectionManager, DownloadManager, ImageManager, ObjectManager, QueryManager, _ais_coercers
+from database.util.reader import Filters, FrameReader
+from database.util.tables import AISRecord, DetectionRecord, DownloadRecord, ObjectRecord, ProductQueryHistory
+
+
+class AsyncQueryManager:
+    def __init__(self, session_factory, db_handler):
+        self.db_handler = db_handler
+        self.session_factory = session_factory
+
+    async def record_query(self, query_data: Dict[str, Any]) -> str:
+        row = QueryManager.query_row(query_data)
+        async with self.db_handler.session_scope() as session:
+            session.add(ProductQueryHistory(**row))
+        return row["id"]
+
+
+class AsyncDownloadManager:
+    def __init__(self, session_factory, db_handler):
+        self.db_handler = db_handler
+        self.session_factory = session_factory
+        # Row validation, upsert policies and the membership cache of the synchronous manager.
+        self.rows = DownloadManager(None, db_handler)
+
+    async def enable_cache(self):
+        """
+        Load every downloaded product ID into an in-process set, see `DownloadManager.enable_cache`.
+        """
+        async with self.db_handler.read_engine.connect() as conn:
+            self.rows.downloaded_ids = set((await conn.execute(select(DownloadRecord.product_id))).scalars())
+
+    async def filter_not_downloaded(self, product_ids: Iterable[str], chunk_size: int = 500) -> List[str]:
+        """
+        Return the given product IDs that have no download record, in input order.
+        """
+        product_ids = list(product_ids)
+        unknown = self.rows._unknown(product_ids)
+
+        found = set()
+        if unknown:
+            async with self.db_handler.read_engine.connect() as conn:
+                for chunk in chunked(list(unknown), chunk_size):
+                    found.update((await conn.execute(DownloadManager.membership_query(chunk))).scalars())
+            self.rows._remember(found)
+
+        return [pid for pid in product_ids if pid in unknown and pid not in found]
+
+    async def upsert_many(self, rows, policies=None, default_policy=None, batch_size: int = 10_000, **defaults) -> int:
+        """
+        Insert or update download rows, see `FrameInsertMixin.upsert_many`.
+        """
+        frame = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame.from_records(list(rows))
+        plan = self.rows._upsert_plan(frame, policies, default_policy, **defaults)
+        if plan is None:
+            return 0
+        statement, prepared = plan
+        async with self.db_handler.engine.begin() as conn:
+            for start in range(0, len(prepared), batch_size):
+                await conn.execute(statement, prepared.iloc[start : start + batch_size].to_dict("records"))
+        self.rows._after_upsert(frame)
+        return len(prepared)
+
+    async def record_download(self, product_data: Dict[str, Any], status: Optional[str] = None):
+        await self.upsert_many([DownloadManager.download_row(product_data, status)])
+
+
+class AsyncImageManager:
+    def __init__(self, session_factory, db_handler):
+        self.db_handler = db_handler
+        self.session_factory = session_factory
+        self.rows = ImageManager(None, db_handler)
+
+    async def register_image(self, image_data: Dict[str, Any]):
+        # A single INSERT ... ON CONFLICT DO NOTHING: an already registered image is left as is.
+        statement, prepared = self.rows._upsert_plan([ImageManager.image_row(image_data)], default_policy="keep")
+        async with self.db_handler.engine.begin() as conn:
+            await conn.execute(statement, prepared.to_dict("records"))
+
+
+class AsyncDetectionManager:
+    def __init__(self, session_factory, db_handler):
+        self.db_handler = db_handler
+        self.session_factory = session_factory
+
+    async def record_detection(self, detection: Dict[str, Any]):
+        async with self.db_handler.engine.begin() as conn:
+            await conn.execute(insert(DetectionRecord.__table__), [DetectionManager.detection_row(detection)])
+
+
+class AsyncAISManager:
+    def __init__(self, session_factory, db_handler):
+        self.db_handler = db_handler
+        self.session_factory = session_factory
+
+    async def insert_ais_records(self, image_id: str, ais_data: List[Dict[str, Any]]):
+        """
+        Insert AIS records linked to a given image, see `AISManager.insert_ais_records`.
+        """
+        if not ais_data:
+            return
+        if self.db_handler.config.ais_partitioning:
+            # The monthly partition files are written through the synchronous engines.
+            raise ValueError("AIS partitioning is not supported by the async handler; insert AIS records with DatabaseHandler")
+        rows = AISManager._ais_rows(image_id, list(ais_data), _ais_coercers())
+        async with self.db_handler.engine.begin() as conn:
+            await conn.execute(insert(AISRecord.__table__), rows)
+
+
+class AsyncObjectManager:
+    def __init__(self, session_factory, db_handler):
+        self.db_handler = db_handler
+        self.session_factory = session_factory
+        # Chip externalization of the synchronous manager.
+        self.rows = ObjectManager(None, db_handler)
+
+    async def insert_objects(self, image_id: str, object_list: List[Dict[str, Any]]):
+        if not object_list:
+            return
+        rows = [ObjectManager.object_row(image_id, obj) for obj in object_list]
+        async with self.db_handler.engine.begin() as conn:
+            rows = await conn.run_sync(self.rows._before_write, rows)
+            await conn.execute(insert(ObjectRecord.__table__), rows)
+
+
+class AsyncDatabaseHandler:
+    def __init__(
+        self,
+        db_file: Optional[Path] = None,
+        config: Optional[Settings] = None,
+        cache_downloads: bool = False,
+        read_only: bool = False,
+    ):
+        """
+        Async handle on the database; call `await init_db()` (or use `async with`) before use.
+
+        Args:
+            db_file (Path, optional): Database file. Defaults to `config.base_path / "downloads.db"`.
+            config (Settings, optional): Settings; defaults to `Settings()`.
+            cache_downloads (bool): Keep an in-process set of downloaded product IDs.
+            read_only (bool): Open an existing database read-only and run no DDL at all.
+        """
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        self.config = config or Settings()
+        self.db_path = Path(db_file) if db_file else self.config.base_path / "downloads.db"
+        self.read_only = read_only
+        self.cache_downloads = cache_downloads
+
+        # One writer connection: concurrent tasks queue for it on the event loop.
+        if not read_only:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.engine, self.read_engine = create_async_engines(self.db_path, resolve_pragmas(self.config))
+        if read_only:
+            self.engine = self.read_engine
+        self.session_factory = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.chips = ChipStore(self.config.chip_pack_path or pack_path(self.db_path))
+        self.reader = FrameReader(self.read_engine.sync_engine)
+        self.layout: Optional[str] = None
+
+        self.download_manager = AsyncDownloadManager(self.session_factory, self)
+        self.query_manager = AsyncQueryManager(self.session_factory, self)
+        self.image_manager = AsyncImageManager(self.session_factory, self)
+        self.detection_manager = AsyncDetectionManager(self.session_factory, self)
+        self.ais_manager = AsyncAISManager(self.session_factory, self)
+        self.object_manager = AsyncObjectManager(self.session_factory, self)
+        self.generations: Optional[GenerationTracker] = None
+
+    async def init_db(self):
+        """
+        Create or upgrade the schema (unless read-only) and start tracking write generations.
+        """
+        if not self.read_only:
+            # The DDL, migrations and views are the synchronous handler's, run once in a worker thread.
+            await asyncio.to_thread(self._init_schema)
+            self.generations = GenerationTracker(self.engine.sync_engine)
+            async with self.engine.connect() as conn:
+                await conn.run_sync(self.generations.install)
+        if self.cache_downloads:
+            await self.download_manager.enable_cache()
+
+    def _init_schema(self):
+        from database.database_handler import DatabaseHandler
+
+        handler = DatabaseHandler(self.db_path, self.config)
+        self.layout = handler.layout
+        handler.close()  # also stops its write-behind thread and drops its exit hooks
+
+    @asynccontextmanager
+    async def session_scope(self) -> AsyncGenerator[Any, None]:
+        """
+        Provide a transactional scope around a series of operations.
+        """
+        async with self.session_factory() as session:
+            try:
+                yield session
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+
+    async def is_downloaded(self, product_id: str) -> bool:
+        return not await self.download_manager.filter_not_downloaded([product_id])
+
+    async def filter_not_downloaded(self, product_ids: Iterable[str]) -> List[str]:
+        """
+        Keep only the products that have not been downloaded, in input order.
+        """
+        return await self.download_manager.filter_not_downloaded(product_ids)
+
+    async def record_download(self, product_data: Dict[str, Any], status: Optional[str] = None):
+        await self.download_manager.record_download(product_data, status)
+
+    async def record_query(self, query_data: Dict[str, Any]) -> str:
+        return await self.query_manager.record_query(query_data)
+
+    async def register_image(self, image_data: Dict[str, Any]):
+        await self.image_manager.register_image(image_data)
+
+    async def record_detection(self, detection: Dict[str, Any]):
+        await self.detection_manager.record_detection(detection)
+
+    async def insert_ais_records(self, image_id: str, ais_data: List[Dict[str, Any]]):
+        await self.ais_manager.insert_ais_records(image_id, ais_data)
+
+    async def insert_objects(self, image_id: str, object_list: List[Dict[str, Any]]):
+        await self.object_manager.insert_objects(image_id, object_list)
+
+    async def read_frame(
+        self,
+        name: str,
+        columns: Optional[Sequence[str]] = None,
+        filters: Optional[Filters] = None,
+        dtype_backend: Optional[str] = None,
+        json_columns: str = "decode",
+    ) -> pd.DataFrame:
+        """
+        Read a table or view into a typed DataFrame, see `DatabaseHandler.read_frame`.
+
+        The result is read in one piece (no `chunksize`) and not served from the result cache.
+        """
+        async with self.read_engine.connect() as conn:
+            return await conn.run_sync(self.reader.read_on, name, columns=columns, filters=filters, dtype_backend=dtype_backend, json_columns=json_columns)
+
+    async def close(self):
+        await self.engine.dispose()
+        if self.read_engine is not self.engine:
+            await self.read_engine.dispose()
+
+    async def __aenter__(self) -> "AsyncDatabaseHandler":
+        await self.init_db()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
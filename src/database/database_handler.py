@@ -4,19 +4,41 @@ SQLAlchemy Database Models and Handler for Satellite Product Tracking
 
 from __future__ import annotations
 
+import atexit
+import json
 from contextlib import contextmanager
-from typing import Optional, Generator
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Generator, Tuple, Iterable, Iterator, List, Sequence, Union
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from sqlalchemy import create_engine
+from sqlalchemy import select
 from sqlalchemy.orm import sessionmaker, Session, scoped_session
 import pandas as pd
 
 from database.util.base import Settings
 from database.CONFIG import SATELLITE_CONFIG
 from database.util.views import DatabaseViews
+from database.util.spatial import SpatialIndex
+from database.util.summaries import SummaryTables
+from database.util.export import ParquetExporter
+from database.util.reader import FrameReader, Filters
+from database.util.partitions import AISPartitions
+from database.util.instrumentation import Instrumentation
+from database.util.matching import AISMatcher
+from database.util.ingest import DetectionIngestor
+from database.util.snapshot import SnapshotPublisher
+from database.util.compact import COMPACT_LAYOUT, LAYOUT_KEY, CompactConverter
+from database.util.writebehind import WriteBehindQueue
+from database.util.chips import ChipStore, pack_path
+from database.util.footprints import FootprintIndex
+from database.util.searches import SearchCache
+from database.util.bulk import chunked
+from database.util.tables import AISRecord, DownloadRecord, ObjectRecord
+from database.util.serialize import list_rows
+from database.util.cache import GenerationTracker, ResultCache, ensure_database_id
+from database.util.engine import create_reader_engine, create_writer_engine, resolve_pragmas
+from database.util.migrations import FINGERPRINT_KEY, SchemaMigrator, schema_fingerprint, read_metadata, write_fingerprint
 from database.util.base import Base
-from database.util.tables import DownloadRecord
 from database.util.managers import (
     ImageManager,
     DetectionManager,
@@ -28,20 +50,81 @@ from database.util.managers import (
 )
 
 
+MANAGERS = (
+    "image_manager",
+    "detection_manager",
+    "download_manager",
+    "constellation_manager",
+    "query_manager",
+    "ais_manager",
+    "object_manager",
+)
+
+
+@lru_cache(maxsize=None)
+def _fingerprint_for(satellite_config_json: str, summary_tables: bool) -> str:
+    # Computed once per process and configuration; compiling the DDL is the expensive part.
+    satellite_config = json.loads(satellite_config_json)
+    ddl = DatabaseViews(None, satellite_config)._view_statements() + SpatialIndex._all_statements() + FootprintIndex._statements()
+    summaries = SummaryTables(None, satellite_config)
+    ddl += summaries._statements() if summary_tables else summaries._drop_trigger_statements()
+    return schema_fingerprint(satellite_config, ddl)
+
+
 class DatabaseHandler:
-    def __init__(self, db_file: Optional[Path] = None, config: Optional[Settings] = None):
+    def __init__(
+        self,
+        db_file: Optional[Path] = None,
+        config: Optional[Settings] = None,
+        cache_downloads: bool = False,
+        read_only: bool = False,
+    ):
+        """
+        Open (and unless `read_only`, create or upgrade) the database.
+
+        Args:
+            db_file (Path, optional): Database file. Defaults to `config.base_path / "downloads.db"`.
+            config (Settings, optional): Settings; defaults to `Settings()`.
+            cache_downloads (bool): Keep an in-process set of downloaded product IDs.
+            read_only (bool): Open an existing database read-only and run no DDL at all.
+        """
         self.config = config or Settings()
         #  self.db_path = self.config.base_path / "downloads.db"
         self.db_path = Path(db_file) if db_file else self.config.base_path / "downloads.db"
-        self.db_path.parent.mkdir(parents=True, exist_ok=True)  # Ensure parent dir exists
+        self.read_only = read_only
 
         # This points SQLAlchemy to the exact same file every time (unless settings.DOWNLOAD_DIR changes).
         # so if the file exists, it jsut reuse it.
-        # self.engine = create_engine(f"sqlite:///{self.db_path}", pool_pre_ping=True)
-        self.engine = create_engine(f"sqlite:///{self.db_path}", pool_pre_ping=True, connect_args={"timeout": 10})  # wait up to 10 seconds for locks
+        # Writes go through `engine`; reads through `read_engine`, a read-only engine with its own pool.
+        pragmas = resolve_pragmas(self.config)
+        self.read_engine = create_reader_engine(self.db_path, pragmas)
+        if read_only:
+            self.engine = self.read_engine
+        else:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)  # Ensure parent dir exists
+            self.engine = create_writer_engine(self.db_path, pragmas)
 
         self.session_factory = scoped_session(sessionmaker(bind=self.engine))
         self.views = DatabaseViews(self.engine, SATELLITE_CONFIG)  # Initialize DatabaseViews
+        self.spatial = SpatialIndex(self.engine, self.read_engine)
+        self.footprints = FootprintIndex(self.engine, self.read_engine, writable=not read_only)
+        self.search_cache = SearchCache(self, self.config.search_cache_ttl_s)
+        self.migrator = SchemaMigrator(self.engine)
+        self.summaries = SummaryTables(self.engine, SATELLITE_CONFIG)
+        self.chips = ChipStore(self.config.chip_pack_path or pack_path(self.db_path))
+        self.exporter = ParquetExporter(self.engine, self.read_engine, chips=self.chips)
+        self.reader = FrameReader(self.read_engine)
+        self.matcher = AISMatcher(self)
+        self.ingestor = DetectionIngestor(self)
+        self.ais_partitions: Optional[AISPartitions] = None
+        if self.config.ais_partitioning:
+            self.ais_partitions = AISPartitions(
+                self.engine,
+                self.read_engine,
+                self.db_path.parent / "ais_partitions",
+                pragmas,
+                max_attached=self.config.ais_partitions_attached,
+            )
 
         # Initialize managers
         self.image_manager = ImageManager(self.session_factory, self)
@@ -51,12 +134,48 @@ class DatabaseHandler:
         self.query_manager = QueryManager(self.session_factory, self)
         self.ais_manager = AISManager(self.session_factory, self)
         self.object_manager = ObjectManager(self.session_factory, self)
+        self.write_queue: Optional[WriteBehindQueue] = None  # started below with Settings.write_behind
+
+        self.instrumentation: Optional[Instrumentation] = None
+        if self.config.instrumentation:
+            self.instrumentation = Instrumentation(self.config.slow_query_ms, self.config.slow_query_log)
+            self.instrumentation.install({"reader": self.read_engine} if read_only else {"writer": self.engine, "reader": self.read_engine})
+            for name in MANAGERS:
+                self.instrumentation.instrument(getattr(self, name), name)
 
         # Initialize the database
-        self._init_db()
-        self.constellation_manager._populate_constellations(SATELLITE_CONFIG)
+        metadata = read_metadata(self.engine) if read_only else self._init_db()
+        self.layout = metadata.get(LAYOUT_KEY)  # "compact" for converted databases, see database.util.compact
 
-        self.views._create_views()
+        # Write generations are tracked on every writable handle, so caches in other processes see its writes.
+        self.generations: Optional[GenerationTracker] = None
+        if not read_only:
+            self.generations = GenerationTracker(self.engine)
+            self.generations.install()
+
+        if self.ais_partitions is not None:
+            self.ais_partitions.refresh()
+            self.ais_partitions.install()
+            if self.generations is not None:
+                self.ais_partitions.on_write = self.generations.bump
+
+        self.result_cache: Optional[ResultCache] = None
+        if self.config.result_cache_size > 0:
+            self.result_cache = ResultCache(self.read_engine, self.config.result_cache_size, self.config.result_cache_path)
+            if self.config.result_cache_path is not None:
+                atexit.register(self.result_cache.save)
+
+        if self.config.write_behind and not read_only:
+            self.write_queue = WriteBehindQueue(
+                self.engine,
+                flush_interval=self.config.write_behind_interval_ms / 1000,
+                batch_size=self.config.write_behind_batch_size,
+                max_pending=self.config.write_behind_max_pending,
+            ).start()
+            atexit.register(self.write_queue.close)  # queued rows are written on interpreter exit too
+
+        if cache_downloads:
+            self.download_manager.enable_cache()
 
     @contextmanager
     def session_scope(self) -> Generator[Session, None, None]:
@@ -73,28 +192,121 @@ class DatabaseHandler:
         finally:
             session.close()
 
-    def _init_db(self):
+    def _init_db(self, force: bool = False):
         """
         Initialize the database by creating all required tables.
+
+        All DDL is skipped when the fingerprint stored in the database matches the current
+        models, SATELLITE_CONFIG and view definitions. Pass `force=True` to rebuild anyway,
+        e.g. after views were dropped by hand.
+
+        Returns:
+            dict: The `db_metadata` entries, read in the same single query as the fingerprint.
         """
+        fingerprint = _fingerprint_for(json.dumps(SATELLITE_CONFIG, sort_keys=True), self.config.summary_tables)
+        metadata = read_metadata(self.engine)
+        if not force and metadata.get(FINGERPRINT_KEY) == fingerprint:
+            return metadata
+        if FINGERPRINT_KEY in metadata and metadata.get(LAYOUT_KEY) == COMPACT_LAYOUT:
+            raise RuntimeError(
+                f"{self.db_path} uses the compact layout and was built for another schema or configuration; "
+                "convert an up-to-date database again (DatabaseHandler.convert_to_compact)"
+            )
+
         # only creates missing tables; it won’t drop or overwrite existing ones. (Because checkfirst=True by default.)
         Base.metadata.create_all(self.engine)  # registers 'images'
+        self.migrator.migrate()  # brings existing databases up to the current schema
+        self.chips.externalize_existing(self.engine)  # inline chips of databases from before the pack file
+        self.spatial._create_spatial_index()
+        self.footprints._create_footprint_index()
         self.constellation_manager._populate_constellations(SATELLITE_CONFIG)
         self.views._create_views()
+        if self.config.summary_tables:
+            self.summaries._create_summaries()  # replaces the aggregate views
+        else:
+            self.summaries._drop_triggers()
+        ensure_database_id(self.engine)
+        write_fingerprint(self.engine, fingerprint)
+        return read_metadata(self.engine)
 
-    def get_download_history(self, days: int = 7) -> pd.DataFrame:
+    def get_download_history(
+        self, days: int = 7, columns: Optional[Sequence[str]] = None, chunksize: Optional[int] = None, json_columns: str = "decode"
+    ) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
         """
         Retrieve the download history for the past `days` days.
 
         Args:
             days (int): Number of days to look back.
+            columns (sequence, optional): Columns to return. Defaults to all.
+            chunksize (int, optional): Yield DataFrames of this many rows instead of one DataFrame.
+            json_columns (str): "decode" (default) returns `metadata` as dicts; "lazy" defers parsing.
+
+        Returns:
+            pd.DataFrame: A DataFrame containing the download history (or an iterator of them).
+        """
+        # Whole minutes, so repeated calls within a minute can be served from the result cache.
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).replace(second=0, microsecond=0)
+        return self.read_frame("downloads", columns=columns, filters=[("download_time", ">=", cutoff)], chunksize=chunksize, json_columns=json_columns)
+
+    def read_frame(
+        self,
+        name: str,
+        columns: Optional[Sequence[str]] = None,
+        filters: Optional[Filters] = None,
+        chunksize: Optional[int] = None,
+        dtype_backend: Optional[str] = None,
+        json_columns: str = "decode",
+    ) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+        """
+        Read a table or view into typed DataFrames, see `FrameReader.read`.
+
+        Args:
+            name (str): Table or view name.
+            columns (sequence, optional): Columns to select.
+            filters: {column: value} or [(column, operator, value), ...].
+            chunksize (int, optional): Yield DataFrames of at most this many rows.
+            dtype_backend (str, optional): "pyarrow" for Arrow-backed columns.
+            json_columns (str): "decode" (default), "raw" or "lazy", see `FrameReader.read`.
 
         Returns:
-            pd.DataFrame: A DataFrame containing the download history.
+            pd.DataFrame, or an iterator of DataFrames when `chunksize` is given.
         """
-        with self.session_scope() as session:
-            query = session.query(DownloadRecord).filter(DownloadRecord.download_time >= datetime.now(timezone.utc) - timedelta(days=days))
-            return pd.read_sql(query.statement, session.bind)
+        def read():
+            return self.reader.read(name, columns=columns, filters=filters, chunksize=chunksize, dtype_backend=dtype_backend, json_columns=json_columns)
+
+        if self.result_cache is None or chunksize is not None:
+            return read()
+        key = ResultCache.key(name, columns=columns, filters=filters, dtype_backend=dtype_backend, json_columns=json_columns)
+        return self.result_cache.get_or_compute(key, self.result_cache.dependencies(name), read)
+
+    def clear_result_cache(self):
+        """
+        Drop every cached result (requires `Settings.result_cache_size`).
+        """
+        if self.result_cache is None:
+            raise ValueError("The result cache is disabled (Settings.result_cache_size)")
+        self.result_cache.clear()
+
+    def flush_writes(self, timeout: Optional[float] = None):
+        """
+        Wait until every write queued so far by the write-behind queue is committed; a no-op without it.
+        """
+        if self.write_queue is not None:
+            self.write_queue.flush(timeout)
+
+    def close(self):
+        """
+        Write what the write-behind queue still holds and release the connections.
+        """
+        if self.write_queue is not None:
+            self.write_queue.close()
+            atexit.unregister(self.write_queue.close)  # the registration would keep the queue and its engine alive
+        if self.result_cache is not None and self.config.result_cache_path is not None:
+            self.result_cache.save()
+            atexit.unregister(self.result_cache.save)
+        self.session_factory.remove()
+        self.engine.dispose()
+        self.read_engine.dispose()
 
     def is_downloaded(self, product_id: str) -> bool:
         """
@@ -106,5 +318,325 @@ class DatabaseHandler:
         Returns:
             bool: True if the product is downloaded, False otherwise.
         """
-        with self.session_scope() as session:
-            return session.query(DownloadRecord.product_id).filter_by(product_id=product_id).scalar() is not None
+        return not self.download_manager.filter_not_downloaded([product_id])
+
+    def filter_not_downloaded(self, product_ids: Iterable[str]) -> List[str]:
+        """
+        Keep only the products that have not been downloaded, with one set-based query per batch.
+
+        Args:
+            product_ids (iterable): The IDs of the products to check.
+
+        Returns:
+            list: The IDs without a download record, in input order.
+        """
+        return self.download_manager.filter_not_downloaded(product_ids)
+
+    def rebuild_summaries(self):
+        """
+        Recompute the summary tables from the base tables (only used with `Settings.summary_tables`).
+        """
+        self.summaries.rebuild()
+
+    def export_parquet(
+        self, name: str, out_dir: Optional[Path] = None, incremental: bool = False, chunksize: int = 250_000, inline_chips: bool = False
+    ) -> dict:
+        """
+        Stream a table or view to a Parquet dataset partitioned by constellation and acquisition date.
+
+        Args:
+            name (str): Table or view to export, e.g. "ais" or "objects".
+            out_dir (Path, optional): Export root. Defaults to `config.base_path / "exports"`.
+            incremental (bool): Only append rows added since the previous export to `out_dir`.
+            chunksize (int): Rows held in memory at a time.
+            inline_chips (bool): Write the image chips of `objects` into `encoded_image`; otherwise
+                the export only has the chip pack columns (see `database.util.chips`).
+
+        Returns:
+            dict: Rows and files written, and the elapsed seconds.
+        """
+        if name == AISRecord.__tablename__:
+            self._require_unpartitioned_ais("Exporting 'ais' (export 'ais_all' instead)")
+        out_dir = Path(out_dir) if out_dir else self.config.base_path / "exports"
+        return self.exporter.export(name, out_dir, chunksize=chunksize, incremental=incremental, inline_chips=inline_chips)
+
+    def list_objects(
+        self,
+        filters: Optional[Filters] = None,
+        columns: Optional[Sequence[str]] = None,
+        heavy: bool = False,
+        order_by: Optional[str] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        shape: str = "dicts",
+    ):
+        """
+        List `objects` rows without ORM instances, see `database.util.serialize.list_rows`.
+
+        Args:
+            filters: {column: value} or [(column, operator, value), ...].
+            columns (sequence, optional): Columns to return. Defaults to all but `probabilities`
+                and `encoded_image`; chips are read with `get_chips`.
+            heavy (bool): Also return the heavy columns.
+            order_by (str, optional): Column to sort by.
+            limit (int, optional): Most rows returned.
+            offset (int): Rows skipped first.
+            shape (str): "dicts", "tuples" or "records" (numpy record array).
+        """
+        return list_rows(self.read_engine, ObjectRecord, filters, columns, heavy, order_by, limit, offset, shape)
+
+    def list_downloads(
+        self,
+        filters: Optional[Filters] = None,
+        columns: Optional[Sequence[str]] = None,
+        heavy: bool = False,
+        order_by: Optional[str] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        shape: str = "dicts",
+    ):
+        """
+        List `downloads` rows without ORM instances; like `list_objects`, `metadata` is heavy.
+        """
+        return list_rows(self.read_engine, DownloadRecord, filters, columns, heavy, order_by, limit, offset, shape)
+
+    def get_chips(self, object_ids: Iterable[str]) -> Dict[str, memoryview]:
+        """
+        Image chips of objects, read from the memory-mapped chip pack without copying.
+
+        Args:
+            object_ids (iterable): IDs of `objects` rows.
+
+        Returns:
+            dict: Object ID -> chip bytes, for the objects that have a chip. Chips still stored
+            inline in `encoded_image` (not canonical base64) are returned as its UTF-8 bytes.
+        """
+        chips: Dict[str, memoryview] = {}
+        with self.read_engine.connect() as conn:
+            for batch in chunked(list(object_ids), 500):
+                rows = conn.execute(
+                    select(ObjectRecord.id, ObjectRecord.chip_offset, ObjectRecord.chip_length, ObjectRecord.encoded_image).where(ObjectRecord.id.in_(batch))
+                )
+                for object_id, offset, length, inline in rows:
+                    if offset is not None:
+                        chips[object_id] = self.chips.read(offset, length)
+                    elif inline is not None:
+                        chips[object_id] = memoryview(inline.encode())
+        return chips
+
+    def query_bbox(
+        self,
+        table: str,
+        bbox: Tuple[float, float, float, float],
+        time_range: Optional[Tuple[Optional[datetime], Optional[datetime]]] = None,
+    ) -> pd.DataFrame:
+        """
+        Retrieve the rows of a spatial table inside a bounding box, using its R*Tree index.
+
+        Args:
+            table (str): One of "images", "detections", "ais", "objects" or "downloads".
+            bbox (tuple): (min_lon, min_lat, max_lon, max_lat) in degrees.
+            time_range (tuple, optional): (start, end) datetimes; either end may be None.
+
+        Returns:
+            pd.DataFrame: The matching rows.
+        """
+        if table == AISRecord.__tablename__:
+            self._require_unpartitioned_ais("The AIS R*Tree (use query_ais)")
+        return self.spatial.query_bbox(table, bbox, time_range)
+
+    def find_downloads(self, aoi, predicate: str = "intersects") -> pd.DataFrame:
+        """
+        Retrieve the downloads whose footprint (`coordinates`) intersects or covers an AOI.
+
+        Args:
+            aoi: Area of interest as WKT, a coordinate list or a GeoJSON geometry.
+            predicate (str): "intersects", or "covers" for footprints containing the whole AOI.
+
+        Returns:
+            pd.DataFrame: The matching `downloads` rows.
+        """
+        keys = self.footprints.search("download", aoi, predicate)
+        frames = [self.reader.read("downloads", filters=[("product_id", "in", batch)]) for batch in chunked(keys, 500)]
+        return pd.concat(frames, ignore_index=True) if frames else self.reader.read("downloads", filters=[("product_id", "in", [])])
+
+    def find_queries(
+        self,
+        aoi,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        constellation: Optional[str] = None,
+        predicate: str = "intersects",
+    ) -> pd.DataFrame:
+        """
+        Retrieve the catalogue queries already run over an AOI and time window.
+
+        Args:
+            aoi: Area of interest as WKT, a coordinate list or a GeoJSON geometry.
+            start (datetime, optional): Start of the window.
+            end (datetime, optional): End of the window.
+            constellation (str, optional): Only queries of this constellation.
+            predicate (str): "intersects" for queries overlapping the AOI and window, "covers"
+                for queries whose geometry and dates contain all of them.
+
+        Returns:
+            pd.DataFrame: The matching `query_history` rows.
+        """
+        keys = self.footprints.search("query", aoi, predicate)
+        conditions = [("constellation", "==", constellation)] if constellation is not None else []
+        if predicate == "covers":
+            conditions += [("start_date", "<=", start)] if start is not None else []
+            conditions += [("end_date", ">=", end)] if end is not None else []
+        else:
+            conditions += [("end_date", ">=", start)] if start is not None else []
+            conditions += [("start_date", "<=", end)] if end is not None else []
+        frames = [self.reader.read("query_history", filters=[("id", "in", batch)] + conditions) for batch in chunked(keys, 500)]
+        return pd.concat(frames, ignore_index=True) if frames else self.reader.read("query_history", filters=[("id", "in", [])])
+
+    def search_catalogue(self, query_data: Dict, fetch: Callable[[Dict], Sequence[Dict]], refresh: bool = False) -> List[Dict]:
+        """
+        Run a catalogue search through the search-result cache (see `database.util.searches`).
+
+        Repeated searches, and narrower ones (a window or AOI inside an unexpired cached search of
+        the same constellation and parameters), are answered from the database; otherwise
+        `fetch(query_data)` runs and its products are recorded with the query.
+
+        Args:
+            query_data (dict): constellation, geometry_wkt, start_date, end_date and parameters,
+                as for `QueryManager.record_query`.
+            fetch (callable): Queries the remote catalogue; returns a list of product dicts.
+            refresh (bool): Bypass the cache and store a fresh result.
+
+        Returns:
+            list: Product dicts.
+        """
+        return self.search_cache.search(query_data, fetch, refresh=refresh)
+
+    def query_ais(
+        self, start: Optional[datetime] = None, end: Optional[datetime] = None, columns: Optional[Sequence[str]] = None
+    ) -> pd.DataFrame:
+        """
+        Retrieve the AIS records with `start <= timestamp < end`.
+
+        With `Settings.ais_partitioning` only the monthly partitions overlapping the range are read.
+
+        Args:
+            start (datetime, optional): Inclusive lower bound.
+            end (datetime, optional): Exclusive upper bound.
+            columns (sequence, optional): Columns to return. Defaults to all.
+
+        Returns:
+            pd.DataFrame: The matching AIS records.
+        """
+        if self.ais_partitions is not None:
+            return self.ais_partitions.query_range(start, end, columns=columns)
+        filters = [("timestamp", "is not null", None)]
+        if start is not None:
+            filters.append(("timestamp", ">=", start))
+        if end is not None:
+            filters.append(("timestamp", "<", end))
+        return self.read_frame("ais", columns=columns, filters=filters)
+
+    def detach_ais_partition(self, month: Union[datetime, str], archive_dir: Optional[Path] = None, compress: bool = False) -> Path:
+        """
+        Detach a monthly AIS partition and move (optionally gzip) its file into `archive_dir`.
+
+        Args:
+            month: Any datetime in the month, or "YYYY-MM".
+            archive_dir (Path, optional): Defaults to the `archive` folder next to the partition files.
+            compress (bool): Gzip the archived file.
+
+        Returns:
+            Path: The archived file.
+        """
+        if self.ais_partitions is None:
+            raise ValueError("AIS partitioning is disabled (Settings.ais_partitioning)")
+        return self.ais_partitions.detach(month, archive_dir=archive_dir, compress=compress)
+
+    def _require_unpartitioned_ais(self, what: str):
+        # Partitioned AIS rows live in other files, which only the handler's connections attach.
+        if self.ais_partitions is None:
+            return
+        self.ais_partitions.refresh()
+        if not self.ais_partitions.partitions().empty:
+            raise ValueError(f"{what} only covers main.ais, but AIS rows are partitioned by month (Settings.ais_partitioning)")
+
+    def query_metrics(self) -> dict:
+        """
+        Statement, manager-method, transaction and lock-wait timings plus the recent slow queries.
+
+        Requires `Settings.instrumentation`.
+        """
+        return self._require_instrumentation().snapshot()
+
+    def write_metrics(self, path: Path) -> Path:
+        """
+        Write the query metrics as a Prometheus text file (requires `Settings.instrumentation`).
+        """
+        return self._require_instrumentation().write_prometheus(path)
+
+    def _require_instrumentation(self) -> Instrumentation:
+        if self.instrumentation is None:
+            raise ValueError("Query instrumentation is disabled (Settings.instrumentation)")
+        return self.instrumentation
+
+    def match_ais(self, image_ids: Optional[Iterable[str]] = None, workers: Optional[int] = None) -> dict:
+        """
+        Match objects to AIS vessels and label dark ships, see `database.util.matching`.
+
+        Args:
+            image_ids (iterable, optional): Images to process. Defaults to every image with objects.
+            workers (int, optional): Worker processes. Defaults to the CPU count.
+
+        Returns:
+            dict: Processed images and objects, dark objects and the elapsed seconds.
+        """
+        return self.matcher.match_archive(image_ids, workers=workers)
+
+    def ingest_detections(self, directory: Optional[Path] = None, workers: Optional[int] = None) -> dict:
+        """
+        Ingest new and changed detection files, parsing them in a process pool, see `database.util.ingest`.
+
+        Args:
+            directory (Path, optional): Defaults to `config.detections_dir`.
+            workers (int, optional): Parser processes. Defaults to the CPU count.
+
+        Returns:
+            dict: Files ingested and skipped, detections and objects written, per-file errors and the elapsed seconds.
+        """
+        return self.ingestor.run(Path(directory) if directory else self.config.detections_dir, workers=workers)
+
+    def publish_snapshot(self, target: Path, incremental: bool = False, vacuum: bool = False) -> dict:
+        """
+        Publish a consistent, indexed and analysed copy of the database to `target` for serving.
+
+        Uses SQLite's online backup API, so writers are not blocked; `target` is replaced atomically.
+        Not available while AIS rows are partitioned: the partition files would be missing.
+
+        Args:
+            target (Path): The served file, e.g. the path given to datasette.
+            incremental (bool): Copy in steps instead of in one read transaction.
+            vacuum (bool): Also VACUUM the copy.
+
+        Returns:
+            dict: Pages copied, backup restarts, snapshot size and timings.
+        """
+        self._require_unpartitioned_ais("A snapshot")
+        return SnapshotPublisher(self.db_path, target, chip_pack=self.chips.path).publish(incremental=incremental, vacuum=vacuum)
+
+    def convert_to_compact(self, target: Path) -> dict:
+        """
+        Copy the database into the compact layout (integer keys, numeric MMSI/IMO/length, epoch times).
+
+        See `database.util.compact`. The copy has plain aggregate views, so open it with
+        `Settings.summary_tables` disabled.
+
+        Args:
+            target (Path): New database file.
+
+        Returns:
+            dict: Rows copied per table, source and target size in MB and the elapsed seconds.
+        """
+        self._require_unpartitioned_ais("The compact copy")
+        fingerprint = _fingerprint_for(json.dumps(SATELLITE_CONFIG, sort_keys=True), False)
+        return CompactConverter(self.db_path, target, SATELLITE_CONFIG, chip_pack=self.chips.path).convert(fingerprint=fingerprint)
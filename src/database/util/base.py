@@ -1,16 +1,47 @@
 # database/utils/database/base.py
 
-from sqlalchemy.orm import declarative_base, DeclarativeMeta
+from sqlalchemy.orm import declarative_base, DeclarativeMeta, deferred, undefer_group
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy import inspect
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pathlib import Path
+from typing import Dict, Optional, Tuple
 from pydantic import field_validator
 from pydantic import ValidationInfo
 
 
 Base: DeclarativeMeta = declarative_base()
 
+# Large columns (JSON documents, chips) that ORM queries load only when asked, see `undefer_heavy`.
+HEAVY_GROUP = "heavy"
+
+
+def heavy(column):
+    """
+    Mark a model column as heavy: deferred, loaded on first access or with `undefer_heavy()`.
+    """
+    return deferred(column, group=HEAVY_GROUP)
+
+
+def undefer_heavy():
+    """
+    Query option loading the heavy columns with the row, e.g. `query(ObjectRecord).options(undefer_heavy())`.
+    """
+    return undefer_group(HEAVY_GROUP)
+
+
+_COLUMN_KEYS: Dict[type, Tuple[Tuple[str, bool], ...]] = {}
+
+
+def column_keys(cls) -> Tuple[Tuple[str, bool], ...]:
+    """
+    (attribute key, is deferred) of the columns of a model, computed once per class.
+    """
+    keys = _COLUMN_KEYS.get(cls)
+    if keys is None:
+        keys = _COLUMN_KEYS[cls] = tuple((attr.key, bool(attr.deferred)) for attr in inspect(cls).column_attrs)
+    return keys
+
 
 class BaseMixin:
     @declared_attr
@@ -18,7 +49,9 @@ class BaseMixin:
         return cls.__name__.lower()
 
     def as_dict(self):
-        return {c.key: getattr(self, c.key) for c in inspect(self).mapper.column_attrs}
+        # Every column; deferred (heavy) columns not loaded yet are loaded here, one query per
+        # instance. Load them with the rows (`undefer_heavy()`) or use `serialize.as_dicts` for lists.
+        return {key: getattr(self, key) for key, _ in column_keys(type(self))}
 
 
 class Settings(BaseSettings):
@@ -28,6 +61,47 @@ class Settings(BaseSettings):
     detections_dir: Path = Path("detections")
     ais_dir: Path = Path("AIS")
 
+    # SQLite performance profile (see database.util.engine.PERFORMANCE_PROFILES) and per-PRAGMA overrides.
+    sqlite_profile: str = "default"
+    sqlite_journal_mode: Optional[str] = None
+    sqlite_synchronous: Optional[str] = None
+    sqlite_cache_size: Optional[int] = None
+    sqlite_mmap_size: Optional[int] = None
+    sqlite_temp_store: Optional[str] = None
+    sqlite_busy_timeout: Optional[int] = None  # milliseconds
+
+    # Serve the aggregate views from trigger-maintained summary tables (see database.util.summaries).
+    summary_tables: bool = False
+
+    # Route AIS rows into monthly partition files next to the database (see database.util.partitions).
+    # Partitioned rows are only readable through the handler; at most `ais_partitions_attached` months.
+    ais_partitioning: bool = False
+    ais_partitions_attached: int = 8  # SQLite attaches at most 10 databases per connection
+
+    # Query timing and slow-query log (see database.util.instrumentation); off by default.
+    instrumentation: bool = False
+    slow_query_ms: float = 250.0
+    slow_query_log: Optional[Path] = None
+
+    # LRU cache of read_frame/get_download_history results, validated by per-table write
+    # generations (see database.util.cache); 0 disables it. Persisted to the path when set.
+    result_cache_size: int = 0
+    result_cache_path: Optional[Path] = None
+
+    # Pack file of the objects' image chips (see database.util.chips); defaults to <name>.chips next to
+    # the database, i.e. base_path / "downloads.chips" for the default database.
+    chip_pack_path: Optional[Path] = None
+
+    # Queue record_download/record_detection/register_image and commit them in group transactions
+    # on a background thread (see database.util.writebehind); off by default.
+    write_behind: bool = False
+    write_behind_interval_ms: float = 50.0
+    write_behind_batch_size: int = 1000
+    write_behind_max_pending: int = 10_000
+
+    # Seconds a cached catalogue search answers repeated and narrower searches (see database.util.searches).
+    search_cache_ttl_s: float = 86_400.0
+
     model_config = SettingsConfigDict(
         env_file=Path(__file__).resolve().parent.parent / ".env",
         env_file_encoding="utf-8",
@@ -0,0 +1,263 @@
+"""
+Helpers for streaming bulk writes through SQLAlchemy Core.
+"""
+
+from __future__ import annotations
+
+import csv
+import os
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import pandas as pd
+from sqlalchemy import DateTime, Float, String, Table, and_, case, func, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# Column aliases used by the Danish Maritime Authority AIS CSV dumps (and similar exports).
+AIS_CSV_ALIASES = {
+    "# timestamp": "timestamp",
+    "timestamp": "timestamp",
+    "mmsi": "mmsi",
+    "latitude": "latitude",
+    "longitude": "longitude",
+    "sog": "speed",
+    "speed": "speed",
+    "heading": "heading",
+    "name": "name",
+    "imo": "imo",
+    "length": "length",
+    "ship type": "type",
+    "type": "type",
+    "image_id": "image_id",
+}
+
+# Maps the first nibble of the clock_seq field onto the RFC 4122 variant (10xx).
+_UUID_VARIANT = {nibble: "89ab"[int(nibble, 16) & 3] for nibble in "0123456789abcdef"}
+
+# Conflict policies of `upsert_statement`, per column:
+#   "overwrite"        take the incoming value, also when it is NULL
+#   "coalesce"         take the incoming value unless it is NULL
+#   "fill"             keep the stored value unless it is NULL
+#   "keep"             never update
+#   "max" / "min"      keep the larger / smaller value
+#   "newest:<column>"  take the incoming (non-NULL) value when its <column> is at least the stored one
+UPSERT_POLICIES = ("overwrite", "coalesce", "fill", "keep", "max", "min", "newest:<column>")
+
+_DATETIME_FORMATS = ("%d/%m/%Y %H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S")
+
+
+def chunked(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """
+    Yield successive lists of at most `size` items without materialising the input.
+    """
+    if size < 1:
+        raise ValueError("chunk size must be a positive integer")
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def uniform_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    The rows with the union of their keys, missing values as None.
+
+    An executemany is compiled from the keys of its first row: keys only later rows have would
+    be dropped, and keys they lack would fail the statement.
+    """
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    if all(len(row) == len(columns) for row in rows):
+        return rows
+    return [{column: row.get(column) for column in columns} for row in rows]
+
+
+def new_uuids(count: int) -> List[str]:
+    """
+    Generate `count` random (version 4) UUID strings from a single urandom call.
+    """
+    # Formatting the hex digest directly is several times cheaper than building UUID objects.
+    digest = os.urandom(16 * count).hex()
+    return [
+        f"{digest[i:i + 8]}-{digest[i + 8:i + 12]}-4{digest[i + 13:i + 16]}-{_UUID_VARIANT[digest[i + 16]]}{digest[i + 17:i + 20]}-{digest[i + 20:i + 32]}"
+        for i in range(0, 32 * count, 32)
+    ]
+
+
+def parse_datetime(value: Any) -> Optional[datetime]:
+    """
+    Parse a timestamp coming from a CSV cell or a loosely typed dict.
+    """
+    if value is None or isinstance(value, datetime):
+        return value
+    value = str(value).strip()
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for fmt in _DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised timestamp: {value!r}")
+
+
+def parse_float(value: Any) -> Optional[float]:
+    if value is None or isinstance(value, float):
+        return value
+    if isinstance(value, str):
+        value = value.strip()
+        if not value:
+            return None
+    return float(value)
+
+
+def column_coercers(table: Table) -> Dict[str, Any]:
+    """
+    Map column names of `table` to the parser used for loosely typed input (e.g. CSV cells).
+    """
+    coercers = {}
+    for column in table.columns:
+        if isinstance(column.type, DateTime):
+            coercers[column.name] = parse_datetime
+        elif isinstance(column.type, Float):
+            coercers[column.name] = parse_float
+    return coercers
+
+
+def iter_csv_records(path: Path, aliases: Optional[Dict[str, str]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the rows of a CSV file as dicts, renaming headers through `aliases`.
+
+    Headers are matched case-insensitively; columns without an alias are dropped when
+    `aliases` is given. Empty cells are returned as None.
+    """
+    with open(path, newline="", encoding="utf-8") as handle:
+        reader = csv.reader(handle)
+        header = next(reader, None)
+        if header is None:
+            return
+        if aliases is None:
+            names = header
+        else:
+            names = [aliases.get(h.strip().lower()) for h in header]
+        keep = [(idx, name) for idx, name in enumerate(names) if name]
+        for row in reader:
+            yield {name: (row[idx] or None) if idx < len(row) else None for idx, name in keep}
+
+
+def prepare_frame(
+    table: Table,
+    frame: pd.DataFrame,
+    required: Iterable[str] = (),
+    renames: Optional[Dict[str, str]] = None,
+    defaults: Optional[Dict[str, Any]] = None,
+    generate_keys: bool = False,
+) -> pd.DataFrame:
+    """
+    Validate and coerce a DataFrame against `table`, column by column.
+
+    Args:
+        table (Table): Target table.
+        frame (pd.DataFrame): Input rows. Columns may use ORM attribute names listed in `renames`.
+        required (iterable): Columns that must be present (or supplied through `defaults`).
+        renames (dict, optional): Input column name -> table column name.
+        defaults (dict, optional): Values used for missing columns and for nulls in present ones.
+        generate_keys (bool): Fill a missing or null single-column primary key with uuid4 strings.
+
+    Returns:
+        pd.DataFrame: A copy holding only table columns with DB-ready values (None for nulls).
+
+    Raises:
+        ValueError: On unknown or missing columns, null keys, or values that cannot be coerced.
+    """
+    frame = frame.rename(columns=renames or {})
+
+    defaults = {k: v for k, v in (defaults or {}).items() if v is not None}
+    unknown = frame.columns.union(list(defaults)).difference(list(table.columns.keys()))
+    if len(unknown):
+        raise ValueError(f"Unknown columns for table '{table.name}': {sorted(unknown)}")
+
+    missing = set(required) - set(frame.columns) - set(defaults)
+    if missing:
+        raise ValueError(f"Missing required columns for table '{table.name}': {sorted(missing)}")
+
+    frame = frame.copy()
+    for name, value in defaults.items():
+        frame[name] = frame[name].where(frame[name].notna(), value) if name in frame.columns else value
+
+    (key,) = [c.name for c in table.primary_key.columns]
+    if generate_keys:
+        if key not in frame.columns:
+            frame[key] = new_uuids(len(frame))
+        elif frame[key].isna().any():
+            mask = frame[key].isna()
+            frame.loc[mask, key] = new_uuids(int(mask.sum()))
+    if key in frame.columns and frame[key].isna().any():
+        raise ValueError(f"Null primary key values in column '{table.name}.{key}'")
+
+    for name in frame.columns:
+        column_type = table.columns[name].type
+        series = frame[name]
+        if isinstance(column_type, DateTime):
+            frame[name] = pd.to_datetime(series, utc=True).dt.tz_localize(None).astype(object)
+        elif isinstance(column_type, Float):
+            frame[name] = pd.to_numeric(series).astype(float)
+        elif isinstance(column_type, String):
+            frame[name] = series.map(str, na_action="ignore") if series.dtype == object else series.astype(str).where(series.notna(), None)
+
+    return frame.astype(object).where(frame.notna(), None)
+
+
+def _policy_expression(table: Table, excluded, name: str, policy: str):
+    stored, incoming = table.c[name], excluded[name]
+    if policy == "overwrite":
+        return incoming
+    if policy == "coalesce":
+        return func.coalesce(incoming, stored)
+    if policy == "fill":
+        return func.coalesce(stored, incoming)
+    if policy == "keep":
+        return None
+    if policy in ("max", "min"):
+        better = incoming > stored if policy == "max" else incoming < stored
+        return case((stored.is_(None), incoming), (better, incoming), else_=stored)
+    if policy.startswith("newest:") and policy[7:] in table.c:
+        order = policy[7:]
+        newer = or_(table.c[order].is_(None), excluded[order] >= table.c[order])
+        return case((and_(incoming.is_not(None), newer), incoming), else_=stored)
+    raise ValueError(f"Unknown upsert policy '{policy}' for column '{table.name}.{name}'. Choose one of {list(UPSERT_POLICIES)}")
+
+
+def upsert_statement(table: Table, update_columns: Iterable[str], policies: Optional[Dict[str, str]] = None, default_policy: str = "coalesce"):
+    """
+    `INSERT ... ON CONFLICT (<primary key>) DO UPDATE` for executemany, with a policy per column.
+
+    Args:
+        table (Table): Target table.
+        update_columns (iterable): Columns an existing row may be updated from; key columns are skipped.
+        policies (dict, optional): Column -> policy, see UPSERT_POLICIES.
+        default_policy (str): Policy of the columns not in `policies`.
+
+    Returns:
+        The insert statement; `ON CONFLICT DO NOTHING` when no column is updated.
+    """
+    policies = policies or {}
+    unknown = set(policies) - set(table.columns.keys())
+    if unknown:
+        raise ValueError(f"Upsert policies for unknown columns of '{table.name}': {sorted(unknown)}")
+
+    statement = sqlite_insert(table)
+    keys = [c.name for c in table.primary_key.columns]
+    updates = {}
+    for name in update_columns:
+        if name not in keys:
+            expression = _policy_expression(table, statement.excluded, name, policies.get(name, default_policy))
+            if expression is not None:
+                updates[name] = expression
+    if not updates:
+        return statement.on_conflict_do_nothing(index_elements=keys)
+    return statement.on_conflict_do_update(index_elements=keys, set_=updates)
@@ -0,0 +1,271 @@
+"""
+Per-table write generations and a result cache validated against them.
+
+Every committed write transaction on the writer engine bumps the generation of each table it
+wrote, in the same transaction, including the tables maintained by triggers on those tables
+(summary tables, R*Tree indexes). A cached result stores the generations of the tables it read
+and is only served while they are unchanged, so it is never stale, also when another process
+wrote the database.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import event, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import OperationalError
+
+from database.util.tables import DatabaseMetadata
+
+_WRITE_TARGET = re.compile(
+    r"^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)"
+    r"\s+[\"`\[]?(?:\w+[\"`\]]?\.[\"`\[]?)?(\w+)",
+    re.IGNORECASE,
+)
+_TRIGGER_TARGETS = re.compile(r"(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+[\"`\[]?(\w+)", re.IGNORECASE)
+_BUMP = (
+    "INSERT INTO table_generations (table_name, generation) VALUES (?, 1) "
+    "ON CONFLICT (table_name) DO UPDATE SET generation = generation + 1"
+)
+GENERATIONS_TABLE = "table_generations"
+DATABASE_ID_KEY = "database_id"
+
+
+def ensure_database_id(engine):
+    """
+    Give the database a random, permanent ID; persisted caches are only loaded into the same database.
+    """
+    with engine.begin() as conn:
+        conn.execute(insert(DatabaseMetadata.__table__).values(key=DATABASE_ID_KEY, value=uuid.uuid4().hex).on_conflict_do_nothing())
+
+
+def written_table(statement: str) -> Optional[str]:
+    """
+    The table an INSERT/UPDATE/DELETE statement writes, or None for other statements.
+    """
+    match = _WRITE_TARGET.match(statement)
+    return match.group(1) if match else None
+
+
+@lru_cache(maxsize=None)
+def _cascades(triggers: Tuple[Tuple[str, str], ...]) -> Dict[str, Set[str]]:
+    # Parsed once per process and set of triggers: every writable handle reads them on open.
+    direct: Dict[str, Set[str]] = {}
+    for table, sql in triggers:
+        body = sql[sql.upper().find("BEGIN") :]
+        direct.setdefault(table, set()).update(_TRIGGER_TARGETS.findall(body))
+    cascades = {}
+    for table in direct:
+        seen, todo = set(), [table]
+        while todo:
+            for target in direct.get(todo.pop(), ()):
+                if target not in seen:
+                    seen.add(target)
+                    todo.append(target)
+        cascades[table] = seen
+    return cascades
+
+
+class GenerationTracker:
+    def __init__(self, engine):
+        """
+        Bump `table_generations` for every table written by a committed transaction on `engine`.
+
+        Args:
+            engine: Writer engine.
+        """
+        self.engine = engine
+        self.cascades: Dict[str, Set[str]] = {}
+
+    def install(self, conn=None):
+        """
+        Start tracking. `conn` is used to read the triggers, e.g. from `AsyncConnection.run_sync`.
+        """
+        self.cascades = self._trigger_cascades(conn)
+        event.listen(self.engine, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(self.engine, "commit", self._commit)
+        event.listen(self.engine, "rollback", self._rollback)
+
+    def _trigger_cascades(self, conn=None) -> Dict[str, Set[str]]:
+        # table -> tables its triggers write, followed transitively.
+        if conn is None:
+            with self.engine.connect() as conn:
+                return self._trigger_cascades(conn)
+        triggers = conn.exec_driver_sql("SELECT tbl_name, sql FROM sqlite_master WHERE type = 'trigger'").all()
+        return _cascades(tuple(map(tuple, triggers)))
+
+    @staticmethod
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        table = written_table(statement)
+        if table is not None and table != GENERATIONS_TABLE:
+            conn.info.setdefault("written_tables", set()).add(table)
+
+    def _commit(self, conn):
+        tables = conn.info.pop("written_tables", None)
+        if tables:
+            # Runs before the DBAPI commit, so the bump is part of the same transaction.
+            self._execute_bump(conn.connection.dbapi_connection, tables)
+
+    @staticmethod
+    def _rollback(conn):
+        conn.info.pop("written_tables", None)
+
+    def _execute_bump(self, dbapi_connection, tables: Iterable[str]):
+        expanded = set(tables)
+        for table in tables:
+            expanded |= self.cascades.get(table, set())
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.executemany(_BUMP, [(table,) for table in sorted(expanded)])
+        finally:
+            cursor.close()
+
+    def bump(self, tables: Iterable[str]):
+        """
+        Bump tables written outside the writer engine, e.g. AIS partition files.
+        """
+        with self.engine.begin() as conn:
+            self._execute_bump(conn.connection.dbapi_connection, tables)
+
+
+class ResultCache:
+    def __init__(self, read_engine, maxsize: int = 128, path: Optional[Path] = None):
+        """
+        LRU cache of query results, each valid while the generations of the tables it read are unchanged.
+
+        Args:
+            read_engine: Engine used to read `table_generations` and to find the tables a query reads.
+            maxsize (int): Entries kept; the least recently used entry is evicted first.
+            path (Path, optional): Pickle file the cache is loaded from and saved to (see `save`).
+        """
+        self.read_engine = read_engine
+        self.maxsize = maxsize
+        self.path = Path(path) if path else None
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Tuple[Tuple[str, ...], Tuple[int, ...], Any]]" = OrderedDict()
+        self._dependencies: Dict[str, Tuple[str, ...]] = {}
+        self._lock = threading.Lock()
+        self._database_id = self._read_database_id()
+        if self.path is not None and self.path.exists():
+            self.load()
+
+    def _read_database_id(self) -> Optional[str]:
+        try:
+            with self.read_engine.connect() as conn:
+                return conn.execute(text("SELECT value FROM db_metadata WHERE key = :key"), {"key": DATABASE_ID_KEY}).scalar()
+        except OperationalError:  # read-only handle on a database without db_metadata
+            return None
+
+    @staticmethod
+    def key(name: str, **params) -> Tuple[str, str]:
+        return name, json.dumps(params, sort_keys=True, default=str)
+
+    def generations(self, tables: Iterable[str]) -> Tuple[int, ...]:
+        """
+        Current write generation of each table, 0 for tables never written since tracking began.
+        """
+        tables = tuple(tables)
+        if not tables:
+            return ()
+        placeholders = ", ".join("?" * len(tables))
+        with self.read_engine.connect() as conn:
+            rows = dict(conn.exec_driver_sql(f"SELECT table_name, generation FROM {GENERATIONS_TABLE} WHERE table_name IN ({placeholders})", tables).all())
+        return tuple(rows.get(table, 0) for table in tables)
+
+    def dependencies(self, name: str) -> Tuple[str, ...]:
+        """
+        The tables read by `SELECT * FROM <name>`, resolved through views by SQLite's authorizer.
+        """
+        if name not in self._dependencies:
+            tables: Set[str] = set()
+
+            def authorizer(action, arg1, arg2, database, source):
+                if action == sqlite3.SQLITE_READ and arg1 and not arg1.startswith("sqlite_"):
+                    tables.add(arg1)
+                return sqlite3.SQLITE_OK
+
+            with self.read_engine.connect() as conn:
+                dbapi_connection = conn.connection.dbapi_connection
+                dbapi_connection.set_authorizer(authorizer)
+                try:
+                    dbapi_connection.execute(f'EXPLAIN SELECT * FROM "{name}"').fetchall()
+                finally:
+                    dbapi_connection.set_authorizer(None)
+            self._dependencies[name] = tuple(sorted(tables))
+        return self._dependencies[name]
+
+    def get_or_compute(self, key: Hashable, tables: Iterable[str], compute: Callable[[], Any], copy: Callable[[Any], Any] = lambda value: value.copy()) -> Any:
+        """
+        Return the cached result for `key` if the generations of `tables` are unchanged, else compute it.
+
+        Args:
+            key: Query name and parameters, see `ResultCache.key`.
+            tables (iterable): Tables the result is read from.
+            compute (callable): Runs the query.
+            copy (callable): Copies results on the way in and out, so callers cannot change cached data.
+        """
+        tables = tuple(sorted(tables))
+        current = self.generations(tables)  # read before computing: a concurrent write invalidates the result
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == tables and entry[1] == current:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy(entry[2])
+            self.misses += 1
+
+        value = compute()
+        with self._lock:
+            self._entries[key] = (tables, current, copy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "maxsize": self.maxsize}
+
+    def save(self):
+        """
+        Atomically write the cache to `path`. Entries are revalidated against the generations on load.
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            payload = {"database_id": self._database_id, "entries": list(self._entries.items())}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as handle:
+            pickle.dump(payload, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path)
+
+    def load(self):
+        """
+        Load the entries saved for this database; files written for another database are ignored.
+        """
+        try:
+            with open(self.path, "rb") as handle:
+                payload = pickle.load(handle)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return
+        if payload.get("database_id") != self._database_id or self._database_id is None:
+            return
+        with self._lock:
+            for key, entry in payload["entries"][-self.maxsize :]:
+                self._entries[key] = entry
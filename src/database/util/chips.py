@@ -0,0 +1,217 @@
+"""
+Content-addressed, append-only pack file for the image chips of `objects.encoded_image`.
+
+Inline base64 chips make up most of the `objects` table, so every scan of it (the object
+views, summaries, exports) reads payload it never uses. Chips are stored decoded in a pack
+file instead, once per distinct content:
+
+    chips          (hash TEXT PRIMARY KEY, offset, length)  -- sha256 of the chip -> its bytes in the pack
+    objects        chip_hash, chip_offset, chip_length      -- encoded_image is left NULL
+
+Chip bytes are appended and fsynced before the transaction that references them commits; a
+rolled-back transaction leaves unreferenced bytes in the pack, which are never reused. Reads
+are zero-copy `memoryview`s of a memory map of the pack. Strings that are not canonical
+base64 stay inline.
+
+The pack belongs to one database: `<name>.chips` next to `<name>.db` (`pack_path`), so the
+default database keeps it under `Settings.base_path`. Snapshots and compact copies get the pack
+next to them (`publish_pack`). Tools reading the database file alone, e.g. datasette, only see
+the chip columns; `export_parquet(..., inline_chips=True)` writes the chips into the export.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import hashlib
+import mmap
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.sqlite import insert
+
+from database.util.bulk import chunked
+from database.util.tables import ChipBlob
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends from several processes are not serialised
+    fcntl = None
+
+CHIP_COLUMNS = ("chip_hash", "chip_offset", "chip_length")
+
+Chip = Tuple[str, int, int]  # hash, offset, length
+
+
+def pack_path(db_path: Path) -> Path:
+    """
+    Default pack file of a database: `downloads.db` -> `downloads.chips`.
+    """
+    db_path = Path(db_path)
+    return db_path.with_name(f"{db_path.stem}.chips")
+
+
+def publish_pack(source: Path, target: Path):
+    """
+    Put the pack `source` at `target` atomically, as a hard link when possible and a copy otherwise.
+
+    Call after the database copy was taken: the pack only grows, so it then holds every chip
+    the copy references.
+    """
+    source, target = Path(source), Path(target)
+    if not source.exists():
+        return
+    if target.exists() and os.path.samefile(source, target):
+        return
+    staging = target.with_name(f".{target.name}.staging")
+    staging.unlink(missing_ok=True)
+    try:
+        os.link(source, staging)
+    except OSError:  # another file system, or no hard links
+        shutil.copyfile(source, staging)
+    os.replace(staging, target)
+
+
+def _decode(encoded: Any) -> Optional[bytes]:
+    # The chip bytes, or None when `encoded` would not survive a decode/encode round trip.
+    if not isinstance(encoded, str) or not encoded:
+        return None
+    try:
+        data = base64.b64decode(encoded, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return data if base64.b64encode(data).decode("ascii") == encoded else None
+
+
+class ChipStore:
+    def __init__(self, path: Path):
+        """
+        Chip pack file at `path`; created on the first write.
+
+        Args:
+            path (Path): The pack file, see `pack_path`.
+        """
+        self.path = Path(path)
+        self._map: Optional[mmap.mmap] = None
+        self._maps: List[mmap.mmap] = []  # earlier, smaller maps may still back exported memoryviews
+        self._lock = threading.Lock()
+
+    def put_many(self, conn, encoded: Sequence[Any]) -> List[Optional[Chip]]:
+        """
+        Store base64 chips, appending only content the database does not know yet.
+
+        Args:
+            conn: Connection of the transaction that will reference the chips.
+            encoded (sequence): base64 strings (or None).
+
+        Returns:
+            list: (hash, offset, length) per chip, None for chips that stay inline.
+        """
+        decoded = [_decode(value) for value in encoded]
+        hashes = [hashlib.sha256(data).hexdigest() if data is not None else None for data in decoded]
+        table = ChipBlob.__table__
+
+        known: Dict[str, Tuple[int, int]] = {}
+        for batch in chunked(list(dict.fromkeys(h for h in hashes if h is not None)), 500):
+            rows = conn.execute(select(table.c.hash, table.c.offset, table.c.length).where(table.c.hash.in_(batch)))
+            known.update((chip_hash, (offset, length)) for chip_hash, offset, length in rows)
+
+        new: Dict[str, bytes] = {}
+        for chip_hash, data in zip(hashes, decoded):
+            if chip_hash is not None and chip_hash not in known:
+                new.setdefault(chip_hash, data)
+        if new:
+            offset = self._append(b"".join(new.values()))
+            rows = []
+            for chip_hash, data in new.items():
+                known[chip_hash] = (offset, len(data))
+                rows.append({"hash": chip_hash, "offset": offset, "length": len(data)})
+                offset += len(data)
+            # A concurrent writer may have stored the same chip; either copy is valid.
+            conn.execute(insert(table).on_conflict_do_nothing(), rows)
+        return [(chip_hash, *known[chip_hash]) if chip_hash is not None else None for chip_hash in hashes]
+
+    def externalize(self, conn, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Move the `encoded_image` of object rows into the pack, setting the chip columns instead.
+
+        When no row has `encoded_image` the rows are returned unchanged; otherwise every row gets
+        `encoded_image` and all chip columns, as executemany needs the same keys in every row.
+        """
+        if not any("encoded_image" in row for row in rows):
+            return rows
+        chips = self.put_many(conn, [row.get("encoded_image") for row in rows])
+        for row, chip in zip(rows, chips):
+            if chip is None:
+                row.update(dict.fromkeys(CHIP_COLUMNS), encoded_image=row.get("encoded_image"))
+            else:
+                row.update(zip(CHIP_COLUMNS, chip), encoded_image=None)
+        return rows
+
+    def _append(self, data: bytes) -> int:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "ab") as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)  # other processes append to the same pack
+            try:
+                offset = handle.seek(0, os.SEEK_END)
+                handle.write(data)
+                handle.flush()
+                os.fsync(handle.fileno())  # durable before the rows that point at it commit
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+        return offset
+
+    def read(self, offset: int, length: int) -> memoryview:
+        """
+        The chip bytes at `offset`, as a read-only view of the memory-mapped pack (no copy).
+        """
+        end = offset + length
+        with self._lock:
+            if self._map is None or len(self._map) < end:
+                # The pack grew: map it again. Old maps stay open for the views still using them.
+                with open(self.path, "rb") as handle:
+                    self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps.append(self._map)
+                if len(self._map) < end:
+                    raise ValueError(f"Chip at {offset}+{length} is beyond the end of {self.path}")
+            return memoryview(self._map)[offset:end]
+
+    def externalize_existing(self, engine, batch_size: int = 1000) -> int:
+        """
+        Move inline chips of existing `objects` rows into the pack; resumable and idempotent.
+
+        Returns:
+            int: Number of chips moved.
+        """
+        moved, last = 0, 0
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(
+                    text(
+                        "SELECT rowid, encoded_image FROM objects "
+                        "WHERE rowid > :last AND encoded_image IS NOT NULL AND chip_hash IS NULL ORDER BY rowid LIMIT :limit"
+                    ),
+                    {"last": last, "limit": batch_size},
+                ).all()
+                if not rows:
+                    return moved
+                last = rows[-1][0]
+                chips = self.put_many(conn, [row[1] for row in rows])
+                updates = [
+                    {"row": row[0], "chip_hash": chip[0], "chip_offset": chip[1], "chip_length": chip[2]} for row, chip in zip(rows, chips) if chip is not None
+                ]
+                if updates:
+                    conn.execute(
+                        text(
+                            "UPDATE objects SET encoded_image = NULL, chip_hash = :chip_hash, chip_offset = :chip_offset, chip_length = :chip_length "
+                            "WHERE rowid = :row"
+                        ),
+                        updates,
+                    )
+                moved += len(updates)
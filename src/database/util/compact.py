@@ -0,0 +1,306 @@
+"""
+Compact storage layout for the large tables: integer keys, numeric MMSI/IMO/length and epoch times.
+
+`ais`, `objects` and `detections` rows carry uuid4 string keys, product-name `image_id`
+strings and ISO timestamp strings, which make the rows and every index several times larger
+than necessary; random uuids also scatter B-tree inserts. `CompactConverter` copies a
+database into a new file where these tables are stored as
+
+    image_keys       (key INTEGER PRIMARY KEY, id TEXT UNIQUE)  -- one surrogate key per image id
+    <table>_data     (id INTEGER PRIMARY KEY, image_key INTEGER, <time> INTEGER epoch seconds,
+                      mmsi/imo/length as numbers where lossless, ...)
+
+and `ais`, `objects` and `detections` become views with the original columns, so the handler,
+its managers and the analytic views keep working. INSTEAD OF triggers on the views turn
+inserts, updates and deletes into writes on the `_data` tables; the keys of inserted rows are
+assigned by SQLite, so ids passed by the caller are not kept. Views cannot be upserted:
+`upsert_many` on these tables inserts new rows, and existing rows are changed with UPDATE. Timestamps are stored with
+second resolution. All other tables are copied unchanged.
+
+A compact database is not migrated in place: convert again from an up-to-date database when
+the schema changes.
+"""
+
+from __future__ import annotations
+
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+from database.util.cache import DATABASE_ID_KEY
+from database.util.chips import pack_path, publish_pack
+from database.util.footprints import FootprintIndex
+from database.util.migrations import FINGERPRINT_KEY
+from database.util.spatial import SPATIAL_TABLES, SpatialIndex
+from database.util.summaries import SUMMARY_TABLES
+from database.util.views import DatabaseViews
+
+LAYOUT_KEY = "layout"
+COMPACT_LAYOUT = "compact"
+
+# Table -> columns that order the copy, so rows of one image are stored together.
+COMPACT_TABLES: Dict[str, Tuple[str, ...]] = {
+    "detections": ("image_id", "timestamp"),
+    "objects": ("image_id",),
+    "ais": ("image_id", "timestamp"),
+}
+# Text columns stored as numbers where that is lossless: '219000001' becomes an integer, while
+# '002190001' (leading zeros) or '120.50' stay text. The physical columns have no type, as any
+# affinity would convert such text as well.
+INTEGER_COLUMNS = ("mmsi", "imo")
+NUMERIC_COLUMNS = ("length",)
+
+_Column = Tuple[str, str]  # name, declared type
+
+
+def _is_datetime(declared: str) -> bool:
+    return any(word in declared.upper() for word in ("DATETIME", "TIMESTAMP"))
+
+
+def _storage(name: str, declared: str) -> Tuple[str, str]:
+    """
+    (physical column definition, view expression) of a column of a compact table.
+    """
+    if name == "id":
+        return "id INTEGER PRIMARY KEY", "d.id"
+    if name == "image_id":
+        return "image_key INTEGER", "k.id"
+    if _is_datetime(declared):
+        return f"{name} INTEGER", f"datetime(d.{name}, 'unixepoch')"
+    if name in INTEGER_COLUMNS or name in NUMERIC_COLUMNS:
+        return name, f"CAST(d.{name} AS TEXT)"
+    return f"{name} {declared}".strip(), f"d.{name}"
+
+
+def _encode(name: str, declared: str, ref: str) -> Optional[str]:
+    """
+    Expression storing `ref.<name>` in the compact table, None for the assigned key.
+    """
+    if name == "id":
+        return None
+    if name == "image_id":
+        return f"(SELECT key FROM image_keys WHERE id = {ref}.image_id)"
+    if _is_datetime(declared):
+        return f"CAST(strftime('%s', {ref}.{name}) AS INTEGER)"
+    if name in INTEGER_COLUMNS or name in NUMERIC_COLUMNS:
+        kind = "INTEGER" if name in INTEGER_COLUMNS else "NUMERIC"
+        value = f"{ref}.{name}"
+        return f"CASE WHEN CAST(CAST({value} AS {kind}) AS TEXT) = {value} THEN CAST({value} AS {kind}) ELSE {value} END"
+    return f"{ref}.{name}"
+
+
+def compact_statements(table: str, columns: List[_Column]) -> List[str]:
+    """
+    DDL of a compact table: the `_data` table, the compatibility view and its INSTEAD OF triggers.
+
+    Args:
+        table (str): Original table name, e.g. "ais".
+        columns (list): (name, declared type) of the original columns, in order.
+    """
+    data = f"{table}_data"
+    physical, view = zip(*(_storage(name, declared) for name, declared in columns))
+    stored = [(_storage(name, declared)[0].split()[0], _encode(name, declared, "new")) for name, declared in columns]
+    stored = [(name, expression) for name, expression in stored if expression is not None]
+    register_key = "INSERT OR IGNORE INTO image_keys (id) SELECT new.image_id WHERE new.image_id IS NOT NULL;"
+    return [
+        f"CREATE TABLE {data} ({', '.join(physical)})",
+        f"""
+        CREATE VIEW {table} AS
+        SELECT {', '.join(f'{expression} AS {name}' for expression, (name, _) in zip(view, columns))}
+        FROM {data} d LEFT JOIN image_keys k ON k.key = d.image_key
+        """,
+        f"""
+        CREATE TRIGGER {table}_compact_insert INSTEAD OF INSERT ON {table}
+        BEGIN
+            {register_key}
+            INSERT INTO {data} ({', '.join(name for name, _ in stored)})
+            VALUES ({', '.join(expression for _, expression in stored)});
+        END
+        """,
+        f"""
+        CREATE TRIGGER {table}_compact_update INSTEAD OF UPDATE ON {table}
+        BEGIN
+            {register_key}
+            UPDATE {data} SET {', '.join(f'{name} = {expression}' for name, expression in stored)} WHERE id = old.id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER {table}_compact_delete INSTEAD OF DELETE ON {table}
+        BEGIN
+            DELETE FROM {data} WHERE id = old.id;
+        END
+        """,
+    ]
+
+
+def read_layout(engine) -> Optional[str]:
+    """
+    The storage layout recorded in the database, e.g. "compact"; None for the standard layout.
+    """
+    try:
+        with engine.connect() as conn:
+            return conn.exec_driver_sql("SELECT value FROM db_metadata WHERE key = ?", (LAYOUT_KEY,)).scalar()
+    except OperationalError:  # no db_metadata table yet
+        return None
+
+
+class CompactConverter:
+    def __init__(self, source: Path, target: Path, satellite_config: dict, chip_pack: Optional[Path] = None):
+        """
+        Convert a database into the compact layout.
+
+        Args:
+            source (Path): Database in the standard layout; only read.
+            target (Path): New database file; must not exist.
+            satellite_config (dict): SATELLITE_CONFIG, for recreating the analytic views.
+            chip_pack (Path, optional): Chip pack of the source. Defaults to `pack_path(source)`;
+                published to `pack_path(target)`.
+        """
+        self.source = Path(source)
+        self.target = Path(target)
+        self.satellite_config = satellite_config
+        self.chip_pack = Path(chip_pack) if chip_pack else pack_path(self.source)
+
+    def convert(self, fingerprint: Optional[str] = None) -> Dict[str, object]:
+        """
+        Build the compact copy.
+
+        Args:
+            fingerprint (str, optional): Schema fingerprint to record, see `schema_fingerprint`.
+                Defaults to the source's. Opening the copy with a matching fingerprint runs no DDL.
+
+        Returns:
+            dict: `rows` per table, `source_mb`, `target_mb` and `seconds`.
+        """
+        if not self.source.exists():
+            raise FileNotFoundError(self.source)
+        if self.target.exists():
+            raise FileExistsError(self.target)
+        started = time.perf_counter()
+        self.target.parent.mkdir(parents=True, exist_ok=True)
+
+        engine = create_engine(f"sqlite:///{self.target}")
+        rows: Dict[str, int] = {}
+        try:
+            with engine.connect() as conn:
+                conn.exec_driver_sql("PRAGMA cache_size = -262144")
+                conn.exec_driver_sql("ATTACH DATABASE ? AS src", (str(self.source.resolve()),))
+                conn.commit()
+                with conn.begin():
+                    rows = self._copy(conn, fingerprint)
+                conn.exec_driver_sql("DETACH DATABASE src")
+                conn.commit()
+            DatabaseViews(engine, self.satellite_config)._create_views()
+            with engine.begin() as conn:
+                conn.exec_driver_sql("ANALYZE")
+            with engine.connect() as conn:
+                conn.exec_driver_sql("PRAGMA journal_mode = DELETE")  # served read-only/immutable: no -wal/-shm files
+        finally:
+            engine.dispose()
+        publish_pack(self.chip_pack, pack_path(self.target))
+
+        return {
+            "rows": rows,
+            "source_mb": self.source.stat().st_size / 1024**2,
+            "target_mb": self.target.stat().st_size / 1024**2,
+            "seconds": time.perf_counter() - started,
+        }
+
+    def _copy(self, conn, fingerprint: Optional[str]) -> Dict[str, int]:
+        rows: Dict[str, int] = {}
+        tables = self._source_tables(conn)
+        for name, sql in tables.items():
+            if name not in COMPACT_TABLES:
+                conn.exec_driver_sql(sql)
+                rows[name] = conn.exec_driver_sql(f"INSERT INTO main.{name} SELECT * FROM src.{name}").rowcount
+        self._copy_indexes(conn, [name for name in tables if name not in COMPACT_TABLES])
+
+        conn.exec_driver_sql("CREATE TABLE image_keys (key INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE)")
+        sources = " UNION ".join(["SELECT id FROM src.images"] + [f"SELECT image_id FROM src.{name}" for name in COMPACT_TABLES if name in tables])
+        # Keys follow acquisition time, so one key range covers a time range.
+        conn.exec_driver_sql(
+            f"""
+            INSERT INTO image_keys (id)
+            SELECT u.id FROM ({sources}) u LEFT JOIN src.images i ON i.id = u.id
+            WHERE u.id IS NOT NULL ORDER BY i.acquisition_time, u.id
+            """
+        )
+        for name, order in COMPACT_TABLES.items():
+            if name in tables:
+                rows[name] = self._convert_table(conn, name, order)
+        self._create_spatial_index(conn, tables)
+        if "footprints" in tables:
+            for statement in FootprintIndex._statements():
+                conn.exec_driver_sql(statement)
+            FootprintIndex._fill(conn)
+
+        conn.exec_driver_sql("DELETE FROM db_metadata WHERE key IN (?, ?, ?)", (FINGERPRINT_KEY, DATABASE_ID_KEY, LAYOUT_KEY))
+        metadata = {LAYOUT_KEY: COMPACT_LAYOUT, DATABASE_ID_KEY: uuid.uuid4().hex}
+        fingerprint = fingerprint or conn.exec_driver_sql("SELECT value FROM src.db_metadata WHERE key = ?", (FINGERPRINT_KEY,)).scalar()
+        if fingerprint:
+            metadata[FINGERPRINT_KEY] = fingerprint
+        conn.exec_driver_sql("INSERT INTO db_metadata (key, value) VALUES (?, ?)", list(metadata.items()))
+        return rows
+
+    @staticmethod
+    def _source_tables(conn) -> Dict[str, str]:
+        # Base tables only: R*Tree indexes are rebuilt and summary tables are replaced by plain views.
+        skipped = set(SUMMARY_TABLES) | {f"{table}_rtree" for table in SPATIAL_TABLES} | {"footprints_rtree"}
+        tables = {}
+        for name, sql in conn.exec_driver_sql("SELECT name, sql FROM src.sqlite_master WHERE type = 'table' AND sql IS NOT NULL ORDER BY rootpage"):
+            if name.startswith("sqlite_") or name in skipped or any(name.startswith(f"{rtree}_") for rtree in skipped):
+                continue
+            tables[name] = sql
+        return tables
+
+    @staticmethod
+    def _copy_indexes(conn, tables: List[str]):
+        indexes = conn.exec_driver_sql(
+            f"SELECT sql FROM src.sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({', '.join('?' * len(tables))})", tuple(tables)
+        ).scalars()
+        for sql in list(indexes):
+            conn.exec_driver_sql(sql)
+
+    @staticmethod
+    def _convert_table(conn, name: str, order: Tuple[str, ...]) -> int:
+        columns = [(row[1], row[2] or "") for row in conn.exec_driver_sql(f"PRAGMA src.table_info({name})")]
+        for statement in compact_statements(name, columns):
+            conn.exec_driver_sql(statement)
+        stored = [(_storage(column, declared)[0].split()[0], _encode(column, declared, "s")) for column, declared in columns]
+        stored = [(column, expression) for column, expression in stored if expression is not None]
+        select = ", ".join("k.key" if column == "image_key" else expression for column, expression in stored)
+        inserted = conn.exec_driver_sql(
+            f"""
+            INSERT INTO {name}_data ({', '.join(column for column, _ in stored)})
+            SELECT {select} FROM src.{name} s LEFT JOIN image_keys k ON k.id = s.image_id
+            ORDER BY {', '.join(f's.{column}' for column in order)}
+            """
+        ).rowcount
+
+        # Secondary indexes of the source on the physical columns (image_id -> image_key), built after the copy.
+        indexes = conn.exec_driver_sql("SELECT name FROM src.sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (name,)).scalars().all()
+        keyed = False
+        for index in indexes:
+            index_columns = [row[2] for row in conn.exec_driver_sql(f"PRAGMA src.index_info({index})")]
+            physical = ["image_key" if column == "image_id" else column for column in index_columns if column != "id"]
+            if physical:
+                index_name = index.replace(name, f"{name}_data", 1).replace("image_id", "image_key")
+                conn.exec_driver_sql(f"CREATE INDEX {index_name} ON {name}_data ({', '.join(physical)})")
+                keyed = keyed or physical[0] == "image_key"
+        if not keyed:
+            conn.exec_driver_sql(f"CREATE INDEX ix_{name}_data_image_key ON {name}_data (image_key)")
+        return inserted
+
+    @staticmethod
+    def _create_spatial_index(conn, tables: Dict[str, str]):
+        for table in SPATIAL_TABLES:
+            if table not in tables:
+                continue
+            source = f"{table}_data" if table in COMPACT_TABLES else table
+            for statement in SpatialIndex._statements(table, source=source):
+                conn.exec_driver_sql(statement)
+            SpatialIndex._fill(conn, table, source=source)
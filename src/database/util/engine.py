@@ -0,0 +1,141 @@
+"""
+SQLite engine construction with per-connection performance PRAGMAs.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Dict
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+# PRAGMA values per profile. "default" keeps SQLite's rollback journal (what the handler always
+# used, and what `datasette --immutable` expects); the others switch the file to WAL so readers
+# never block the writer. cache_size is negative, i.e. KiB rather than pages.
+PERFORMANCE_PROFILES: Dict[str, Dict[str, Any]] = {
+    "default": {
+        "journal_mode": None,
+        "synchronous": None,
+        "cache_size": None,
+        "mmap_size": None,
+        "temp_store": None,
+        "busy_timeout": 10_000,
+    },
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -16_000,
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+        "busy_timeout": 30_000,
+    },
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64_000,
+        "mmap_size": 256 * 1024**2,
+        "temp_store": "MEMORY",
+        "busy_timeout": 10_000,
+    },
+    "throughput": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -256_000,
+        "mmap_size": 1024**3,
+        "temp_store": "MEMORY",
+        "busy_timeout": 60_000,
+    },
+}
+
+# journal_mode is a property of the database file and is only changed by the writer.
+_WRITER_ONLY_PRAGMAS = ("journal_mode",)
+
+
+def resolve_pragmas(settings) -> Dict[str, Any]:
+    """
+    Combine the profile named by `settings.sqlite_profile` with the per-PRAGMA overrides.
+
+    Args:
+        settings (Settings): Settings with `sqlite_profile` and `sqlite_<pragma>` fields.
+
+    Returns:
+        dict: PRAGMA name -> value; None means "leave SQLite's default".
+    """
+    try:
+        pragmas = dict(PERFORMANCE_PROFILES[settings.sqlite_profile])
+    except KeyError:
+        raise ValueError(f"Unknown sqlite_profile '{settings.sqlite_profile}'. Choose one of {list(PERFORMANCE_PROFILES)}") from None
+    for name in pragmas:
+        override = getattr(settings, f"sqlite_{name}", None)
+        if override is not None:
+            pragmas[name] = override
+    return pragmas
+
+
+def _apply_pragmas(engine: Engine, pragmas: Dict[str, Any]):
+    statements = [f"PRAGMA {name} = {value}" for name, value in pragmas.items() if value is not None]
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+
+def create_writer_engine(db_path: Path, pragmas: Dict[str, Any]) -> Engine:
+    """
+    Engine for all writes. SQLite serialises writers anyway, so the pool stays small.
+    """
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        pool_pre_ping=True,
+        pool_size=1,
+        max_overflow=8,
+        connect_args={"timeout": pragmas["busy_timeout"] / 1000 if pragmas.get("busy_timeout") else 10},
+    )
+    _apply_pragmas(engine, pragmas)
+    return engine
+
+
+def create_reader_engine(db_path: Path, pragmas: Dict[str, Any]) -> Engine:
+    """
+    Read-only engine (`mode=ro` plus `query_only`) with a larger pool for concurrent readers.
+    """
+    engine = create_engine(
+        f"sqlite:///file:{Path(db_path).resolve()}?mode=ro&uri=true",
+        pool_pre_ping=True,
+        pool_size=8,
+        max_overflow=16,
+        connect_args={"timeout": pragmas["busy_timeout"] / 1000 if pragmas.get("busy_timeout") else 10},
+    )
+    reader_pragmas = {name: value for name, value in pragmas.items() if name not in _WRITER_ONLY_PRAGMAS}
+    _apply_pragmas(engine, {**reader_pragmas, "query_only": 1})
+    return engine
+
+
+def create_async_engines(db_path: Path, pragmas: Dict[str, Any]):
+    """
+    (writer, reader) `AsyncEngine`s over aiosqlite with the same PRAGMAs as the sync engines.
+
+    The writer has a single connection: concurrent writers wait for it on the event loop
+    instead of contending for SQLite's write lock. Requires the optional `aiosqlite` package.
+    """
+    try:
+        import aiosqlite  # noqa: F401
+    except ImportError as error:
+        raise ImportError("The async handler requires aiosqlite (pip install aiosqlite)") from error
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    timeout = pragmas["busy_timeout"] / 1000 if pragmas.get("busy_timeout") else 10
+    writer = create_async_engine(f"sqlite+aiosqlite:///{db_path}", pool_size=1, max_overflow=0, pool_timeout=3600, connect_args={"timeout": timeout})
+    _apply_pragmas(writer.sync_engine, pragmas)
+    reader = create_async_engine(
+        f"sqlite+aiosqlite:///file:{Path(db_path).resolve()}?mode=ro&uri=true", pool_size=8, max_overflow=16, connect_args={"timeout": timeout}
+    )
+    reader_pragmas = {name: value for name, value in pragmas.items() if name not in _WRITER_ONLY_PRAGMAS}
+    _apply_pragmas(reader.sync_engine, {**reader_pragmas, "query_only": 1})
+    return writer, reader
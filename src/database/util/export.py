@@ -0,0 +1,241 @@
+"""
+Streaming, Hive-partitioned Parquet export of tables and views.
+
+Requires the optional `pyarrow` dependency. Object image chips live in the chip pack (see
+database.util.chips), so `objects` exports carry the chip columns and a NULL `encoded_image`
+unless the chips are inlined with `inline_chips=True`.
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+from uuid import uuid4
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert
+
+from database.util.tables import DatabaseMetadata
+
+PARTITION_COLUMNS = ("constellation", "acquisition_date")
+
+# SELECT/FROM clauses per table that add the partition columns. Tables without a constellation
+# or acquisition time of their own take them from their image.
+_SOURCES = {
+    "images": ("t.*, DATE(t.acquisition_time) AS acquisition_date", "images t"),
+    "downloads": ("t.*, DATE(t.acqusition_time) AS acquisition_date", "downloads t"),
+    "detections": ("t.*, DATE(i.acquisition_time) AS acquisition_date", "detections t LEFT JOIN images i ON i.id = t.image_id"),
+    "ais": ("t.*, i.constellation, DATE(i.acquisition_time) AS acquisition_date", "ais t LEFT JOIN images i ON i.id = t.image_id"),
+    "objects": ("t.*, i.constellation, DATE(i.acquisition_time) AS acquisition_date", "objects t LEFT JOIN images i ON i.id = t.image_id"),
+}
+
+
+def _arrow_type(declared: str):
+    import pyarrow as pa
+
+    declared = declared.upper()
+    if "INT" in declared or declared == "BOOLEAN":
+        return pa.int64()
+    if any(name in declared for name in ("FLOAT", "REAL", "DOUBLE", "NUMERIC")):
+        return pa.float64()
+    if "DATETIME" in declared or "TIMESTAMP" in declared:
+        return pa.timestamp("us")
+    if declared:  # VARCHAR, TEXT, JSON (exported as its JSON text)
+        return pa.string()
+    return None  # expression columns of views: inferred per chunk
+
+
+class ParquetExporter:
+    def __init__(self, engine, read_engine=None, chips=None):
+        """
+        Export tables and views to Parquet in bounded-memory chunks.
+
+        Args:
+            engine: SQLAlchemy engine, used to store incremental export watermarks.
+            read_engine: Engine used to read the exported rows; defaults to `engine`.
+            chips (ChipStore, optional): Chip pack read by `inline_chips`.
+        """
+        self.engine = engine
+        self.read_engine = read_engine or engine
+        self.chips = chips
+
+    def _inline_chips(self, chunk: pd.DataFrame) -> pd.Series:
+        # base64 `encoded_image` from the pack for rows whose chip was moved there.
+        encoded = chunk["encoded_image"].astype(object)
+        located = chunk["chip_offset"].notna()
+        encoded[located] = [
+            base64.b64encode(self.chips.read(int(offset), int(length))).decode("ascii")
+            for offset, length in zip(chunk.loc[located, "chip_offset"], chunk.loc[located, "chip_length"])
+        ]
+        return encoded
+
+    def _columns(self, conn, name: str) -> Dict[str, str]:
+        columns = {row[1]: row[2] for row in conn.execute(text(f"PRAGMA table_info({name})"))}
+        if not columns:
+            raise ValueError(f"No table or view named '{name}'")
+        return columns
+
+    def _watermark_key(self, name: str, out_dir: Path) -> str:
+        return f"parquet_export:{name}:{out_dir.resolve()}"
+
+    def _read_watermark(self, key: str) -> Tuple[int, Optional[list]]:
+        # (last exported rowid, primary key of that row); watermarks of older versions are a bare rowid.
+        with self.engine.connect() as conn:
+            value = conn.execute(text("SELECT value FROM db_metadata WHERE key = :key"), {"key": key}).scalar()
+        if value is None:
+            return 0, None
+        if value.lstrip("-").isdigit():
+            return int(value), None
+        watermark = json.loads(value)
+        return watermark["rowid"], watermark["key"]
+
+    def _write_watermark(self, key: str, rowid: int, row_key: Optional[list]):
+        with self.engine.begin() as conn:
+            value = json.dumps({"rowid": rowid, "key": row_key}, default=str)
+            statement = insert(DatabaseMetadata.__table__).values(key=key, value=value)
+            conn.execute(statement.on_conflict_do_update(index_elements=["key"], set_={"value": statement.excluded.value}))
+
+    @staticmethod
+    def _primary_key(conn, name: str) -> List[str]:
+        rows = sorted((row[5], row[1]) for row in conn.execute(text(f"PRAGMA table_info({name})")) if row[5])
+        return [column for _, column in rows]
+
+    def _watermark_holds(self, conn, name: str, rowid: int, row_key: Optional[list]) -> bool:
+        # VACUUM may renumber the rowids of tables without an INTEGER PRIMARY KEY: the watermark is
+        # only trusted while the same row still has its rowid.
+        if rowid == 0 or row_key is None:
+            return True
+        primary_key = self._primary_key(conn, name)
+        if not primary_key:
+            return True
+        found = conn.execute(text(f"SELECT {', '.join(primary_key)} FROM {name} WHERE rowid = :rowid"), {"rowid": rowid}).first()
+        return found is not None and json.loads(json.dumps(list(found), default=str)) == row_key
+
+    def export(
+        self,
+        name: str,
+        out_dir: Path,
+        chunksize: int = 250_000,
+        incremental: bool = False,
+        partition_by: Optional[Sequence[str]] = PARTITION_COLUMNS,
+        inline_chips: bool = False,
+    ) -> Dict[str, float]:
+        """
+        Stream a table or view into `<out_dir>/<name>/` as a Hive-partitioned Parquet dataset.
+
+        A full export is written next to `<out_dir>/<name>/` and replaces it once complete, so a
+        failed export leaves the previous dataset in place. An incremental export (tables only)
+        appends the rows whose rowid is above the watermark stored by the previous run for the
+        same output directory. Rows are detected by rowid, so rows updated in place are not
+        re-exported. VACUUM may renumber rowids; when the watermark row no longer has its rowid,
+        the export falls back to a full one (`full` in the result).
+
+        Args:
+            name (str): Table or view name.
+            out_dir (Path): Root directory of the exports.
+            chunksize (int): Rows read, converted and written at a time.
+            incremental (bool): Only export rows added since the last export to `out_dir`.
+            partition_by (sequence, optional): Partition columns; those the source lacks are skipped.
+            inline_chips (bool): Fill `encoded_image` from the chip pack (sources with chip columns).
+
+        Returns:
+            dict: `rows`, `files`, `full` and `seconds` of this run.
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet export requires pyarrow (pip install pyarrow)") from e
+        if inline_chips and self.chips is None:
+            raise ValueError("inline_chips needs the chip store (ParquetExporter(..., chips=...))")
+
+        started = time.perf_counter()
+        out_dir = Path(out_dir)
+        target = out_dir / name
+        key = self._watermark_key(name, out_dir)
+
+        with self.read_engine.connect() as conn:
+            is_table = conn.execute(text("SELECT type FROM sqlite_master WHERE name = :name"), {"name": name}).scalar() == "table"
+            if incremental and not is_table:
+                raise ValueError("Incremental export needs a table (rowid); views can only be exported in full")
+
+            columns = self._columns(conn, name)
+            select_clause, from_clause = _SOURCES.get(name, ("t.*", f"{name} t"))
+            if name in _SOURCES:
+                columns.setdefault("constellation", "VARCHAR")
+                columns["acquisition_date"] = "VARCHAR"
+            partitions = [c for c in (partition_by or ()) if c in columns]
+
+            sql = f"SELECT {select_clause}{', t.rowid AS _export_rowid' if is_table else ''} FROM {from_clause}"
+            last_rowid, last_key = self._read_watermark(key) if incremental else (0, None)
+            if incremental and not self._watermark_holds(conn, name, last_rowid, last_key):
+                incremental, last_rowid = False, 0
+            if is_table:
+                sql += " WHERE t.rowid > :last_rowid ORDER BY t.rowid"
+            primary_key = self._primary_key(conn, name) if is_table else []
+
+            fields = [(column, _arrow_type(declared)) for column, declared in columns.items()]
+            run_id = uuid4().hex[:12]
+            # A full export is built beside the dataset and swapped in when complete.
+            root = target if incremental else out_dir / f".{name}.staging-{run_id}"
+            stats = {"rows": 0, "files": 0, "full": not incremental, "seconds": 0.0}
+            max_rowid, max_key = last_rowid, last_key
+            written: List[str] = []
+
+            try:
+                for idx, chunk in enumerate(pd.read_sql(text(sql), conn, params={"last_rowid": last_rowid}, chunksize=chunksize)):
+                    if chunk.empty:  # pandas yields one empty frame when nothing matches
+                        continue
+                    if is_table:
+                        max_rowid = int(chunk.pop("_export_rowid").iloc[-1])
+                        max_key = json.loads(json.dumps(chunk[primary_key].iloc[-1].tolist(), default=str)) if primary_key else None
+                    if inline_chips and "chip_offset" in chunk.columns:
+                        chunk["encoded_image"] = self._inline_chips(chunk)
+                    for column, arrow_type in fields:
+                        if arrow_type is not None and pa.types.is_timestamp(arrow_type):
+                            chunk[column] = pd.to_datetime(chunk[column], format="ISO8601")
+                    schema = pa.schema([(c, t if t is not None else pa.Array.from_pandas(chunk[c]).type) for c, t in fields])
+                    table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+
+                    files = []
+                    pq.write_to_dataset(
+                        table,
+                        root_path=root,
+                        partition_cols=partitions or None,
+                        basename_template=f"part-{run_id}-{idx:05d}-{{i}}.parquet",
+                        existing_data_behavior="overwrite_or_ignore",
+                        file_visitor=lambda written_file: files.append(written_file.path),
+                    )
+                    written += files
+                    stats["rows"] += len(chunk)
+                    stats["files"] += len(files)
+            except BaseException:
+                if incremental:  # the watermark was not advanced: drop this run's files, the next run rewrites them
+                    for path in written:
+                        Path(path).unlink(missing_ok=True)
+                else:
+                    shutil.rmtree(root, ignore_errors=True)
+                raise
+
+        if not incremental:
+            self._swap(root, target)
+        if is_table and (not incremental or max_rowid > last_rowid):
+            self._write_watermark(key, max_rowid, max_key)
+        stats["seconds"] = time.perf_counter() - started
+        return stats
+
+    @staticmethod
+    def _swap(staging: Path, target: Path):
+        # Two renames; the previous dataset is only removed once the new one is in place.
+        staging.mkdir(parents=True, exist_ok=True)  # an empty export still replaces the dataset
+        previous = staging.with_name(staging.name.replace(".staging-", ".previous-"))
+        if target.exists():
+            os.replace(target, previous)
+        os.replace(staging, target)
+        shutil.rmtree(previous, ignore_errors=True)
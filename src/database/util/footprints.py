@@ -0,0 +1,559 @@
+"""
+Footprint index over `query_history.geometry_wkt` and `downloads.coordinates`.
+
+Both columns hold footprints as text: WKT, or a stringified coordinate list / GeoJSON
+geometry. Triggers on the two tables mark a row of `footprints` as pending whenever the text
+changes, so every writer (also ones outside the handler) keeps the index consistent without
+parsing anything in SQL. `FootprintIndex.refresh` parses the pending footprints once, stores
+their geometry (JSON) and bounding box, and keeps an R*Tree over the boxes. Coverage queries
+read candidates from the R*Tree and run the exact polygon test only on those.
+
+Coordinates are (lon, lat) degrees as in WKT and GeoJSON. An edge is taken the short way
+round, so a footprint with an edge jumping more than 180 degrees of longitude crosses the
+antimeridian: it is split into parts on either side of ±180, whose box spans all longitudes
+(the footprint is a candidate of more queries, the exact test is not affected). Rings around a
+pole are not split and keep the long way round.
+"""
+
+from __future__ import annotations
+
+import ast
+import json
+import math
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import text
+
+Point = Tuple[float, float]
+# A geometry is a list of parts: ("polygon", [outer ring, *holes]), ("line", [points]) or ("point", [[point]]).
+Part = Tuple[str, List[List[Point]]]
+Geometry = List[Part]
+
+# Footprint source -> (table, key column, footprint column).
+FOOTPRINT_SOURCES: Dict[str, Tuple[str, str, str]] = {
+    "query": ("query_history", "id", "geometry_wkt"),
+    "download": ("downloads", "product_id", "coordinates"),
+}
+PREDICATES = ("intersects", "covers")
+
+_TOKEN = re.compile(r"\s*(?:(?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|(?P<word>[A-Za-z]+)|(?P<symbol>[(),;=]))")
+
+
+class _WKTParser:
+    def __init__(self, wkt: str):
+        self.tokens: List[Tuple[str, str]] = []
+        position, wkt = 0, wkt.rstrip()
+        while position < len(wkt):
+            match = _TOKEN.match(wkt, position)
+            if match is None or match.end() == position:
+                raise ValueError(f"Invalid WKT near {wkt[position:position + 20]!r}")
+            self.tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            position = match.end()
+        self.position = 0
+
+    def _peek(self) -> Tuple[Optional[str], Optional[str]]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def _take(self, kind: str, value: Optional[str] = None) -> str:
+        token_kind, token = self._peek()
+        if token_kind != kind or (value is not None and token.upper() != value):
+            raise ValueError(f"Invalid WKT: expected {value or kind}, got {token!r}")
+        self.position += 1
+        return token
+
+    def parse(self) -> Geometry:
+        geometry = self._geometry()
+        if self.position != len(self.tokens):
+            raise ValueError("Invalid WKT: trailing text")
+        return geometry
+
+    def _geometry(self) -> Geometry:
+        kind = self._take("word").upper()
+        if kind == "SRID":  # EWKT: SRID=4326;POLYGON (...)
+            self._take("symbol", "=")
+            self._take("number")
+            self._take("symbol", ";")
+            kind = self._take("word").upper()
+        if self._peek()[0] == "word" and self._peek()[1].upper() in ("Z", "M", "ZM"):
+            self.position += 1
+        if self._peek()[0] == "word" and self._peek()[1].upper() == "EMPTY":
+            self.position += 1
+            return []
+        if kind == "GEOMETRYCOLLECTION":
+            self._take("symbol", "(")
+            parts = self._geometry()
+            while self._peek()[1] == ",":
+                self.position += 1
+                parts += self._geometry()
+            self._take("symbol", ")")
+            return parts
+        return _parts(kind, self._nested())
+
+    def _nested(self):
+        if self._peek()[1] == "(":
+            self.position += 1
+            items = [self._nested()]
+            while self._peek()[1] == ",":
+                self.position += 1
+                items.append(self._nested())
+            self._take("symbol", ")")
+            return items
+        values = []
+        while self._peek()[0] == "number":
+            values.append(float(self._take("number")))
+        if len(values) < 2:
+            raise ValueError("Invalid WKT: a coordinate needs at least two numbers")
+        return (values[0], values[1])  # Z and M are dropped
+
+
+def _points(items) -> List[Point]:
+    # MULTIPOINT allows both "(1 2, 3 4)" and "((1 2), (3 4))".
+    return [item if isinstance(item, tuple) else item[0] for item in items]
+
+
+def _closed(ring: List[Point]) -> List[Point]:
+    return ring if ring[0] == ring[-1] else ring + [ring[0]]
+
+
+def _parts(kind: str, nested) -> Geometry:
+    if kind == "POINT":
+        return [("point", [_points(nested)])]
+    if kind == "LINESTRING":
+        return [("line", [_points(nested)])]
+    if kind == "POLYGON":
+        return [("polygon", [_closed(_points(ring)) for ring in nested])]
+    if kind == "MULTIPOINT":
+        return [("point", [[point]]) for point in _points(nested)]
+    if kind == "MULTILINESTRING":
+        return [("line", [_points(line)]) for line in nested]
+    if kind == "MULTIPOLYGON":
+        return [("polygon", [_closed(_points(ring)) for ring in polygon]) for polygon in nested]
+    raise ValueError(f"Unsupported WKT geometry type {kind}")
+
+
+def parse_wkt(wkt: str) -> Geometry:
+    """
+    Parse (E)WKT POINT, LINESTRING, POLYGON, their MULTI variants and GEOMETRYCOLLECTION.
+
+    Raises:
+        ValueError: When `wkt` is not valid WKT.
+    """
+    return _WKTParser(wkt).parse()
+
+
+def _depth(value) -> int:
+    depth = 0
+    while isinstance(value, (list, tuple)) and value:
+        value, depth = value[0], depth + 1
+    return depth
+
+
+def _as_points(items) -> List[Point]:
+    return [(float(item[0]), float(item[1])) for item in items]
+
+
+def _from_coordinates(value, kind: Optional[str] = None) -> Geometry:
+    # GeoJSON-style nested lists; without a type the nesting depth decides.
+    kind = kind or {1: "Point", 2: "Ring", 3: "Polygon", 4: "MultiPolygon"}.get(_depth(value))
+    if kind == "Point":
+        return [("point", [[(float(value[0]), float(value[1]))]])]
+    if kind == "Ring":  # a bare list of corners: a polygon when it can enclose anything
+        points = _as_points(value)
+        return [("polygon", [_closed(points)])] if len(points) >= 3 else [("line" if len(points) == 2 else "point", [points])]
+    if kind == "LineString":
+        return [("line", [_as_points(value)])]
+    if kind == "MultiPoint":
+        return [("point", [[point]]) for point in _as_points(value)]
+    if kind == "MultiLineString":
+        return [("line", [_as_points(line)]) for line in value]
+    if kind == "Polygon":
+        return [("polygon", [_closed(_as_points(ring)) for ring in value])]
+    if kind == "MultiPolygon":
+        return [("polygon", [_closed(_as_points(ring)) for ring in polygon]) for polygon in value]
+    raise ValueError(f"Unsupported coordinates of type {kind}")
+
+
+def _unwrapped(points: List[Point]) -> List[Point]:
+    # Shift longitudes by multiples of 360 so that no edge is longer than 180 degrees.
+    result = [points[0]]
+    for lon, lat in points[1:]:
+        result.append((lon + 360 * round((result[-1][0] - lon) / 360), lat))
+    return result
+
+
+def _windows(points: List[Point]) -> range:
+    # k of every [-180 + 360k, 180 + 360k] window the points reach into.
+    lons = [point[0] for point in points]
+    return range(math.floor((min(lons) + 180) / 360), math.ceil((max(lons) - 180) / 360) + 1)
+
+
+def _at_lon(a: Point, b: Point, lon: float) -> Point:
+    return lon, a[1] + (lon - a[0]) * (b[1] - a[1]) / (b[0] - a[0])
+
+
+def _clip_ring(ring: List[Point], left: float, right: float) -> List[Point]:
+    # Sutherland-Hodgman against the band left <= lon <= right; a concave ring leaving the band
+    # more than once stays one ring, joined along the band's edge.
+    for edge, inside in ((left, lambda p: p[0] >= left), (right, lambda p: p[0] <= right)):
+        clipped: List[Point] = []
+        for a, b in zip(ring, ring[1:]):
+            if inside(a):
+                clipped.append(a)
+            if inside(a) != inside(b):
+                clipped.append(_at_lon(a, b, edge))
+        if len(set(clipped)) < 3:
+            return []
+        ring = _closed(clipped)
+    return ring
+
+
+def _clip_line(line: List[Point], left: float, right: float) -> List[List[Point]]:
+    # The pieces of a line inside the band left <= lon <= right.
+    pieces: List[List[Point]] = []
+    current: List[Point] = []
+    for a, b in zip(line, line[1:]):
+        lo, hi = min(a[0], b[0]), max(a[0], b[0])
+        if hi < left or lo > right:
+            current = []
+            continue
+        start = a if left <= a[0] <= right else _at_lon(a, b, left if a[0] < left else right)
+        end = b if left <= b[0] <= right else _at_lon(a, b, left if b[0] < left else right)
+        if not current:
+            current = [start]
+            pieces.append(current)
+        current.append(end)
+        if end != b:
+            current = []
+    return pieces
+
+
+def _shifted(points: List[Point], offset: float) -> List[Point]:
+    return [(lon + offset, lat) for lon, lat in points]
+
+
+def _split_part(part: Part) -> Geometry:
+    # A part with an edge crossing the antimeridian, as parts within -180..180.
+    kind, rings = part
+    if kind == "point" or all(abs(b[0] - a[0]) <= 180 for ring in rings for a, b in zip(ring, ring[1:])):
+        return [part]
+    if kind == "line":
+        line = _unwrapped(rings[0])
+        return [("line", [_shifted(piece, -360 * k)]) for k in _windows(line) for piece in _clip_line(line, 360.0 * k - 180, 360.0 * k + 180)]
+    unwrapped = [_unwrapped(ring) for ring in rings]
+    if unwrapped[0][0] != unwrapped[0][-1]:  # around a pole: no side of the antimeridian to split into
+        return [part]
+    split = []
+    for k in _windows(unwrapped[0]):
+        left, right = 360.0 * k - 180, 360.0 * k + 180
+        outer = _clip_ring(unwrapped[0], left, right)
+        if outer:
+            holes = [_clip_ring(hole, left, right) for hole in unwrapped[1:] if hole[0] == hole[-1]]
+            split.append(("polygon", [_shifted(ring, -360 * k) for ring in [outer, *holes] if ring]))
+    return split
+
+
+def _split_antimeridian(geometry: Geometry) -> Geometry:
+    return [piece for part in geometry for piece in _split_part(part)]
+
+
+def parse_footprint(value: Any) -> Optional[Geometry]:
+    """
+    Parse a footprint: WKT, a (stringified) coordinate list, or a GeoJSON geometry.
+
+    Returns:
+        list: The geometry, or None for empty, missing or unparseable footprints.
+    """
+    if value is None:
+        return None
+    try:
+        if isinstance(value, str):
+            stripped = value.strip()
+            if not stripped or stripped in ("None", "null"):
+                return None
+            if stripped[0].isalpha():
+                return _split_antimeridian(parse_wkt(stripped)) or None
+            try:
+                value = json.loads(stripped)  # str() of a list of numbers is JSON, and much faster to parse
+            except ValueError:
+                value = ast.literal_eval(stripped)  # str() of a dict or of tuples
+        if isinstance(value, dict):
+            if value.get("type") == "Feature":
+                value = value.get("geometry") or {}
+            if value.get("type") == "GeometryCollection":
+                parts = [part for member in value.get("geometries", []) for part in parse_footprint(member) or []]
+                return parts or None
+            return _split_antimeridian(_from_coordinates(value["coordinates"], value["type"])) or None
+        return _split_antimeridian(_from_coordinates(value)) or None
+    except (ValueError, TypeError, KeyError, IndexError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+
+def bounds(geometry: Geometry) -> Tuple[float, float, float, float]:
+    """
+    (min_lon, min_lat, max_lon, max_lat) of a geometry.
+    """
+    lons = [point[0] for _, rings in geometry for ring in rings for point in ring]
+    lats = [point[1] for _, rings in geometry for ring in rings for point in ring]
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def _segments(geometry: Geometry) -> Iterator[Tuple[Point, Point]]:
+    for _, rings in geometry:
+        for ring in rings:
+            if len(ring) == 1:
+                yield ring[0], ring[0]
+            yield from zip(ring, ring[1:])
+
+
+def _orientation(a: Point, b: Point, c: Point) -> float:
+    return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+
+def _within_box(a: Point, b: Point, p: Point) -> bool:
+    return min(a[0], b[0]) <= p[0] <= max(a[0], b[0]) and min(a[1], b[1]) <= p[1] <= max(a[1], b[1])
+
+
+def _segments_intersect(p1: Point, p2: Point, q1: Point, q2: Point) -> bool:
+    d1, d2 = _orientation(q1, q2, p1), _orientation(q1, q2, p2)
+    d3, d4 = _orientation(p1, p2, q1), _orientation(p1, p2, q2)
+    if ((d1 > 0 > d2) or (d1 < 0 < d2)) and ((d3 > 0 > d4) or (d3 < 0 < d4)):
+        return True
+    return (
+        (d1 == 0 and _within_box(q1, q2, p1))
+        or (d2 == 0 and _within_box(q1, q2, p2))
+        or (d3 == 0 and _within_box(p1, p2, q1))
+        or (d4 == 0 and _within_box(p1, p2, q2))
+    )
+
+
+def _segments_cross(p1: Point, p2: Point, q1: Point, q2: Point) -> bool:
+    # A proper crossing: the segments meet in one point interior to both.
+    d1, d2 = _orientation(q1, q2, p1), _orientation(q1, q2, p2)
+    d3, d4 = _orientation(p1, p2, q1), _orientation(p1, p2, q2)
+    return ((d1 > 0 > d2) or (d1 < 0 < d2)) and ((d3 > 0 > d4) or (d3 < 0 < d4))
+
+
+def _on_ring(point: Point, ring: List[Point]) -> bool:
+    return any(_orientation(a, b, point) == 0 and _within_box(a, b, point) for a, b in zip(ring, ring[1:]))
+
+
+def _inside_ring(point: Point, ring: List[Point]) -> bool:
+    # Ray casting; points on the boundary are handled by the callers.
+    x, y = point
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+
+def _in_polygon(point: Point, rings: List[List[Point]]) -> bool:
+    # Inside or on the boundary of the outer ring, and not strictly inside a hole.
+    outer, holes = rings[0], rings[1:]
+    if not (_on_ring(point, outer) or _inside_ring(point, outer)):
+        return False
+    return not any(_inside_ring(point, hole) and not _on_ring(point, hole) for hole in holes)
+
+
+def _in_geometry(point: Point, geometry: Geometry) -> bool:
+    return any(_in_polygon(point, rings) for kind, rings in geometry if kind == "polygon")
+
+
+def _vertices(geometry: Geometry) -> Iterator[Point]:
+    for _, rings in geometry:
+        for ring in rings:
+            yield from ring
+
+
+def _boxes_overlap(a: Tuple[float, ...], b: Tuple[float, ...]) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def intersects(a: Geometry, b: Geometry) -> bool:
+    """
+    Whether two geometries share at least one point (boundaries included).
+    """
+    if not a or not b or not _boxes_overlap(bounds(a), bounds(b)):
+        return False
+    segments_b = list(_segments(b))
+    if any(_segments_intersect(p1, p2, q1, q2) for p1, p2 in _segments(a) for q1, q2 in segments_b):
+        return True
+    # No boundaries meet: one geometry is inside the other, or they are disjoint.
+    return any(_in_geometry(point, b) for point in _vertices(a)) or any(_in_geometry(point, a) for point in _vertices(b))
+
+
+def covers(a: Geometry, b: Geometry) -> bool:
+    """
+    Whether `a` covers `b`: no point of `b` lies outside `a`'s polygons.
+    """
+    if not a or not b:
+        return False
+    box_a, box_b = bounds(a), bounds(b)
+    if not (box_a[0] <= box_b[0] and box_a[1] <= box_b[1] and box_a[2] >= box_b[2] and box_a[3] >= box_b[3]):
+        return False
+    if not all(_in_geometry(point, a) for point in _vertices(b)):
+        return False
+    segments_a = list(_segments(a))
+    if any(_segments_cross(p1, p2, q1, q2) for p1, p2 in _segments(b) for q1, q2 in segments_a):
+        return False
+    # A hole of `a` inside `b`'s polygons leaves part of `b` uncovered.
+    holes = [hole for kind, rings in a if kind == "polygon" for hole in rings[1:]]
+    return not any(_in_geometry(point, b) and not any(_on_ring(point, ring) for _, rings in b for ring in rings) for hole in holes for point in hole)
+
+
+def _as_json(geometry: Geometry) -> str:
+    return json.dumps([[kind, [[list(point) for point in ring] for ring in rings]] for kind, rings in geometry], separators=(",", ":"))
+
+
+def _from_json(raw: str) -> Geometry:
+    return [(kind, [[tuple(point) for point in ring] for ring in rings]) for kind, rings in json.loads(raw)]
+
+
+class FootprintIndex:
+    def __init__(self, engine, read_engine=None, writable: bool = True):
+        """
+        Keep the footprints of queries and downloads indexed, and answer coverage queries.
+
+        Args:
+            engine: Writer engine.
+            read_engine: Engine used for queries; defaults to `engine`.
+            writable (bool): Parse pending footprints before each query. Read-only handles
+                only see footprints a writer has already parsed.
+        """
+        self.engine = engine
+        self.read_engine = read_engine or engine
+        self.writable = writable
+
+    @staticmethod
+    def _statements() -> List[str]:
+        statements = [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS footprints_rtree USING rtree(id, min_lon, max_lon, min_lat, max_lat)",
+            # Only the pending footprints, so the refresh before each query does not scan the table.
+            "CREATE INDEX IF NOT EXISTS ix_footprints_pending ON footprints (source) WHERE geometry IS NULL",
+        ]
+        for source, (table, key, column) in FOOTPRINT_SOURCES.items():
+            mark = (
+                f"INSERT INTO footprints (source, key) VALUES ('{source}', new.{key}) "
+                f"ON CONFLICT (source, key) DO UPDATE SET geometry = NULL;"
+            )
+            remove = (
+                f"DELETE FROM footprints_rtree WHERE id IN (SELECT id FROM footprints WHERE source = '{source}' AND key = old.{key}); "
+                f"DELETE FROM footprints WHERE source = '{source}' AND key = old.{key};"
+            )
+            statements += [
+                f"""
+                CREATE TRIGGER IF NOT EXISTS footprints_{source}_insert AFTER INSERT ON {table}
+                WHEN new.{column} IS NOT NULL AND new.{column} NOT IN ('', 'None')
+                BEGIN {mark} END
+                """,
+                # Upserts list the column in every DO UPDATE SET; only a changed footprint is parsed again.
+                f"DROP TRIGGER IF EXISTS footprints_{source}_update",
+                f"""
+                CREATE TRIGGER footprints_{source}_update AFTER UPDATE OF {column} ON {table}
+                WHEN new.{column} IS NOT old.{column} AND new.{column} NOT IN ('', 'None')
+                BEGIN {mark} END
+                """,
+                f"""
+                CREATE TRIGGER IF NOT EXISTS footprints_{source}_clear AFTER UPDATE OF {column} ON {table}
+                WHEN new.{column} IS NOT old.{column} AND (new.{column} IS NULL OR new.{column} IN ('', 'None'))
+                BEGIN {remove} END
+                """,
+                f"CREATE TRIGGER IF NOT EXISTS footprints_{source}_delete AFTER DELETE ON {table} BEGIN {remove} END",
+            ]
+        return statements
+
+    def _create_footprint_index(self):
+        with self.engine.begin() as conn:
+            existing = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'footprints_rtree'")).scalar()
+            for statement in self._statements():
+                conn.execute(text(statement))
+            if not existing:
+                # Footprints written before the index existed are parsed by the next refresh.
+                for source, (table, key, column) in FOOTPRINT_SOURCES.items():
+                    conn.execute(
+                        text(
+                            f"INSERT OR IGNORE INTO footprints (source, key) SELECT '{source}', {key} FROM {table} "
+                            f"WHERE {column} IS NOT NULL AND {column} NOT IN ('', 'None')"
+                        )
+                    )
+
+    @staticmethod
+    def _fill(conn):
+        conn.execute(
+            text("INSERT INTO footprints_rtree SELECT id, min_lon, max_lon, min_lat, max_lat FROM footprints WHERE min_lon IS NOT NULL")
+        )
+
+    def refresh(self, batch_size: int = 5000) -> int:
+        """
+        Parse the pending footprints and index their bounding boxes.
+
+        Returns:
+            int: Number of footprints parsed.
+        """
+        parsed = 0
+        for source, (table, key, column) in FOOTPRINT_SOURCES.items():
+            while True:
+                with self.engine.begin() as conn:
+                    rows = conn.execute(
+                        text(
+                            f"SELECT f.id, s.{column} FROM footprints f LEFT JOIN {table} s ON s.{key} = f.key "
+                            "WHERE f.source = :source AND f.geometry IS NULL LIMIT :limit"
+                        ),
+                        {"source": source, "limit": batch_size},
+                    ).all()
+                    if not rows:
+                        break
+                    updates, boxes = [], []
+                    for footprint_id, value in rows:
+                        geometry = parse_footprint(value)
+                        box = bounds(geometry) if geometry else (None, None, None, None)
+                        updates.append({"id": footprint_id, "geometry": _as_json(geometry) if geometry else "[]", **dict(zip(("a", "b", "c", "d"), box))})
+                        if geometry:
+                            boxes.append({"id": footprint_id, "a": box[0], "b": box[1], "c": box[2], "d": box[3]})
+                    # '[]' marks footprints that could not be parsed, so they are not retried.
+                    conn.execute(
+                        text("UPDATE footprints SET geometry = :geometry, min_lon = :a, min_lat = :b, max_lon = :c, max_lat = :d WHERE id = :id"),
+                        updates,
+                    )
+                    conn.execute(text("DELETE FROM footprints_rtree WHERE id = :id"), [{"id": row[0]} for row in rows])
+                    if boxes:
+                        conn.execute(text("INSERT INTO footprints_rtree VALUES (:id, :a, :c, :b, :d)"), boxes)
+                    parsed += len(rows)
+        return parsed
+
+    def search(self, source: str, geometry: Any, predicate: str = "intersects") -> List[str]:
+        """
+        Keys of the rows of `source` whose footprint intersects or covers `geometry`.
+
+        Args:
+            source (str): "query" (query_history ids) or "download" (product ids).
+            geometry: AOI as WKT, coordinates or GeoJSON, see `parse_footprint`.
+            predicate (str): "intersects", or "covers" for footprints containing the whole AOI.
+
+        Returns:
+            list: Matching keys.
+        """
+        if source not in FOOTPRINT_SOURCES:
+            raise ValueError(f"Unknown footprint source '{source}'. Choose one of {list(FOOTPRINT_SOURCES)}")
+        if predicate not in PREDICATES:
+            raise ValueError(f"Unknown predicate '{predicate}'. Choose one of {list(PREDICATES)}")
+        aoi = geometry if isinstance(geometry, list) else parse_footprint(geometry)
+        if not aoi:
+            raise ValueError(f"Could not parse the footprint {geometry!r}")
+        if self.writable:
+            self.refresh()
+
+        min_lon, min_lat, max_lon, max_lat = bounds(aoi)
+        if predicate == "covers":  # the R*Tree boxes are rounded outwards, so this never misses a match
+            box = "r.min_lon <= :min_lon AND r.max_lon >= :max_lon AND r.min_lat <= :min_lat AND r.max_lat >= :max_lat"
+        else:
+            box = "r.max_lon >= :min_lon AND r.min_lon <= :max_lon AND r.max_lat >= :min_lat AND r.min_lat <= :max_lat"
+        # CROSS JOIN keeps the R*Tree as the outer loop; otherwise SQLite scans footprints by source.
+        statement = text(f"SELECT f.key, f.geometry FROM footprints_rtree r CROSS JOIN footprints f ON f.id = r.id WHERE {box} AND f.source = :source")
+        with self.read_engine.connect() as conn:
+            candidates = conn.execute(
+                statement, {"min_lon": min_lon, "min_lat": min_lat, "max_lon": max_lon, "max_lat": max_lat, "source": source}
+            ).all()
+        test = covers if predicate == "covers" else intersects
+        return [key for key, raw in candidates if (test(_from_json(raw), aoi) if predicate == "covers" else test(aoi, _from_json(raw)))]
@@ -0,0 +1,259 @@
+"""
+Parallel ingestion of per-scene detection files.
+
+Files under `Settings.detections_dir` are parsed and validated in a process pool, and this
+process writes the results: detections and objects of many scenes per transaction. The
+`ingested_files` table remembers each file's mtime and size, so re-runs skip unchanged
+files and replace the rows of files that changed.
+
+A detection file is one JSON object per scene:
+
+    {
+        "image_id": "S1A_...",          # defaults to the file name without extension
+        "constellation": "SENTINEL-1",
+        "latitude": 55.1, "longitude": 10.2,
+        "num_ship_detections": 12,       # defaults to the number of objects
+        "num_dark_ship_detections": 3,
+        "objects": [{"obj_class": "ship", "latitude": ..., "longitude": ..., ...}, ...]
+    }
+
+Object keys are `objects` table columns; list-valued `probabilities` are JSON-encoded.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from uuid import uuid4
+
+import pandas as pd
+from sqlalchemy import delete, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database.util.bulk import chunked, prepare_frame, uniform_rows
+from database.util.tables import DetectionRecord, IngestedFile, ObjectRecord
+
+DETECTION_FIELDS = ("num_ship_detections", "num_dark_ship_detections", "latitude", "longitude")
+OBJECT_REQUIRED = ("image_id", "obj_class", "latitude", "longitude")
+
+FileStat = Tuple[str, int, int]  # path, mtime_ns, size
+
+
+def _read_scene(path: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    with open(path, encoding="utf-8") as handle:
+        scene = json.load(handle)
+    if not isinstance(scene, dict):
+        raise ValueError("expected a JSON object per scene")
+    if not scene.get("constellation"):
+        raise ValueError("missing 'constellation'")
+    objects = scene.get("objects") or []
+    detection = {
+        "id": str(uuid4()),
+        "constellation": str(scene["constellation"]),
+        "image_id": str(scene.get("image_id") or Path(path).stem),
+        "detection_file": str(path),
+        "timestamp": datetime.utcnow(),
+    }
+    for field in DETECTION_FIELDS:
+        value = scene.get(field)
+        detection[field] = None if value is None else float(value)
+    if detection["num_ship_detections"] is None:
+        detection["num_ship_detections"] = float(len(objects))
+    return detection, objects
+
+
+def _prepare_objects(objects: List[Dict[str, Any]], image_ids: List[str]) -> List[Dict[str, Any]]:
+    frame = pd.DataFrame.from_records(objects)
+    frame["image_id"] = frame["image_id"].where(frame["image_id"].notna(), pd.Series(image_ids)) if "image_id" in frame.columns else image_ids
+    if "probabilities" in frame.columns:
+        frame["probabilities"] = frame["probabilities"].map(lambda v: v if v is None or isinstance(v, str) else json.dumps(v))
+    return prepare_frame(ObjectRecord.__table__, frame, required=OBJECT_REQUIRED, generate_keys=True).to_dict("records")
+
+
+def parse_detection_files(stats: Sequence[FileStat]) -> List[Tuple[FileStat, Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    Read and validate detection files into DB-ready rows.
+
+    The objects of all files are validated as one DataFrame; the per-frame overhead would
+    otherwise dominate for typical scenes. Only when that fails are the files validated one
+    by one, to find the bad ones.
+
+    Returns:
+        list: (stat, {"detection": row, "objects": [rows]} or None, error message or None) per file.
+    """
+    results: List[Tuple[FileStat, Optional[Dict[str, Any]], Optional[str]]] = []
+    scenes = []
+    for stat in stats:
+        try:
+            scenes.append((stat, *_read_scene(stat[0])))
+        except (OSError, ValueError, TypeError) as error:  # one bad file must not stop the backlog
+            results.append((stat, None, f"{type(error).__name__}: {error}"))
+
+    objects = [obj for _, _, scene_objects in scenes for obj in scene_objects]
+    image_ids = [detection["image_id"] for _, detection, scene_objects in scenes for _ in scene_objects]
+    try:
+        records = _prepare_objects(objects, image_ids) if objects else []
+    except (ValueError, TypeError):
+        records = None
+    offset = 0
+    for stat, detection, scene_objects in scenes:
+        if records is not None:
+            rows, offset = records[offset : offset + len(scene_objects)], offset + len(scene_objects)
+        else:
+            try:
+                rows = _prepare_objects(scene_objects, [detection["image_id"]] * len(scene_objects)) if scene_objects else []
+            except (ValueError, TypeError) as error:
+                results.append((stat, None, f"{type(error).__name__}: {error}"))
+                continue
+        results.append((stat, {"detection": detection, "objects": rows}, None))
+    return results
+
+
+def parse_detection_file(path: str) -> Dict[str, Any]:
+    """
+    Read and validate one detection file.
+
+    Returns:
+        dict: `detection` (one detections row) and `objects` (list of objects rows).
+
+    Raises:
+        ValueError: When the file is not a valid detection file.
+    """
+    ((_, parsed, error),) = parse_detection_files([(str(path), 0, 0)])
+    if error is not None:
+        raise ValueError(f"{path}: {error}")
+    return parsed
+
+
+class DetectionIngestor:
+    def __init__(self, db_handler, batch_files: int = 500, parse_chunk: int = 100):
+        """
+        Ingest detection files with a process pool for parsing and a single writer.
+
+        Args:
+            db_handler: The DatabaseHandler to write to.
+            batch_files (int): Files whose rows are written per transaction.
+            parse_chunk (int): Most files a parser validates together.
+        """
+        self.db_handler = db_handler
+        self.batch_files = batch_files
+        self.parse_chunk = parse_chunk
+
+    def scan(self, directory: Path, pattern: str = "**/*.json") -> Tuple[List[FileStat], int]:
+        """
+        Files under `directory` that are new or changed since they were last ingested.
+
+        Returns:
+            tuple: ([(path, mtime_ns, size), ...], number of unchanged files skipped).
+        """
+        found = []
+        for path in sorted(Path(directory).glob(pattern)):
+            if path.is_file():
+                stat = path.stat()
+                found.append((str(path), stat.st_mtime_ns, stat.st_size))
+
+        table = IngestedFile.__table__
+        known: Dict[str, Tuple[int, int]] = {}
+        with self.db_handler.read_engine.connect() as conn:
+            for batch in chunked([path for path, _, _ in found], 500):
+                rows = conn.execute(select(table.c.path, table.c.mtime_ns, table.c.size).where(table.c.path.in_(batch)))
+                known.update((path, (mtime_ns, size)) for path, mtime_ns, size in rows)
+        todo = [stat for stat in found if known.get(stat[0]) != (stat[1], stat[2])]
+        return todo, len(found) - len(todo)
+
+    def run(self, directory: Path, workers: Optional[int] = None, pattern: str = "**/*.json") -> Dict[str, Any]:
+        """
+        Ingest every new or changed detection file under `directory`.
+
+        Args:
+            directory (Path): Root of the detection files.
+            workers (int, optional): Parser processes. Defaults to the CPU count; 1 parses in-process.
+            pattern (str): Glob of the detection files below `directory`.
+
+        Returns:
+            dict: `files`, `skipped`, `detections`, `objects`, `errors` ({path: message}) and `seconds`.
+        """
+        started = time.perf_counter()
+        todo, skipped = self.scan(directory, pattern)
+        workers = workers or os.cpu_count() or 1
+
+        stats: Dict[str, Any] = {"files": 0, "skipped": skipped, "detections": 0, "objects": 0, "errors": {}, "seconds": 0.0}
+        pending: List[Tuple[FileStat, Dict[str, Any]]] = []
+
+        def collect(stat: FileStat, parsed: Optional[Dict[str, Any]], error: Optional[str]):
+            if error is not None:
+                stats["errors"][stat[0]] = error
+                return
+            pending.append((stat, parsed))
+            stats["files"] += 1
+            stats["detections"] += 1
+            stats["objects"] += len(parsed["objects"])
+            if len(pending) >= self.batch_files:
+                self.write(pending)
+                pending.clear()
+
+        # Files are handed to the parsers in chunks, at least four per worker to balance the load.
+        chunks = list(chunked(todo, max(1, min(self.parse_chunk, -(-len(todo) // (workers * 4))))))
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(chunks) > 1 else None
+        try:
+            for result in (pool.map if pool else map)(parse_detection_files, chunks):
+                for item in result:
+                    collect(*item)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        if pending:
+            self.write(pending)
+
+        stats["seconds"] = time.perf_counter() - started
+        return stats
+
+    def write(self, parsed: Sequence[Tuple[FileStat, Dict[str, Any]]]):
+        """
+        Write the rows of parsed files in one transaction, replacing earlier versions of the same files.
+        """
+        files = IngestedFile.__table__
+        detections = [result["detection"] for _, result in parsed]
+        # Rows of different parse chunks carry different optional columns.
+        objects = uniform_rows([row for _, result in parsed for row in result["objects"]])
+        with self.db_handler.engine.begin() as conn:
+            previous = []
+            for batch in chunked([stat[0] for stat, _ in parsed], 500):
+                previous += conn.execute(select(files.c.path, files.c.image_id).where(files.c.path.in_(batch))).all()
+            if previous:
+                # A changed file replaces its scene: one detection file per image. Matched by image and
+                # file rather than by the stored detection_id, which a compact database does not keep.
+                table = DetectionRecord.__table__
+                for batch in chunked(previous, 500):
+                    images = [i for _, i in batch]
+                    conn.execute(delete(table).where(table.c.image_id.in_(images), table.c.detection_file.in_([p for p, _ in batch])))
+                    conn.execute(delete(ObjectRecord.__table__).where(ObjectRecord.__table__.c.image_id.in_(images)))
+
+            conn.execute(insert(DetectionRecord.__table__), detections)
+            if objects:
+                conn.execute(insert(ObjectRecord.__table__), self.db_handler.object_manager._before_write(conn, objects))
+
+            statement = sqlite_insert(files)
+            conn.execute(
+                statement.on_conflict_do_update(
+                    index_elements=["path"],
+                    set_={name: statement.excluded[name] for name in ("mtime_ns", "size", "image_id", "detection_id", "num_objects", "ingested_at")},
+                ),
+                [
+                    {
+                        "path": stat[0],
+                        "mtime_ns": stat[1],
+                        "size": stat[2],
+                        "image_id": result["detection"]["image_id"],
+                        "detection_id": result["detection"]["id"],
+                        "num_objects": len(result["objects"]),
+                        "ingested_at": datetime.utcnow(),
+                    }
+                    for stat, result in parsed
+                ],
+            )
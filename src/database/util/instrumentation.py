@@ -0,0 +1,312 @@
+"""
+Opt-in query instrumentation: latency histograms, row counts, transaction and lock-wait times,
+and a slow-query log with EXPLAIN QUERY PLAN output.
+
+Nothing is registered unless `Instrumentation.install` is called, so a handler without
+instrumentation runs exactly the code it did before.
+"""
+
+from __future__ import annotations
+
+import inspect
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import wraps
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+
+# Upper bounds (seconds) of the histogram buckets; the last bucket is +Inf.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_WRITE_VERBS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+_PARAMETER_LISTS = re.compile(r"\(\?(?:,\s*\?)+\)")
+_WHITESPACE = re.compile(r"\s+")
+
+# The manager method a statement runs in, e.g. "download_manager.record_download".
+_operation: ContextVar[Optional[str]] = ContextVar("database_operation", default=None)
+
+
+def normalize_sql(statement: str) -> str:
+    """
+    Collapse whitespace and expanded `IN (?, ?, ...)` lists so repeated statements share a key.
+    """
+    return _PARAMETER_LISTS.sub("(?, ...)", _WHITESPACE.sub(" ", statement).strip())
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-quantile (the maximum for the +Inf bucket).
+        """
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS + (self.max,), self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "sum_s": self.total,
+            "mean_s": self.total / self.count if self.count else 0.0,
+            "p50_s": self.quantile(0.5),
+            "p95_s": self.quantile(0.95),
+            "p99_s": self.quantile(0.99),
+            "max_s": self.max,
+        }
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", " ").replace('"', '\\"')
+
+
+class Instrumentation:
+    def __init__(self, slow_query_ms: float = 250.0, slow_query_log: Optional[Path] = None, slow_query_history: int = 200):
+        """
+        Collect per-statement and per-operation timings from SQLAlchemy engine events.
+
+        Args:
+            slow_query_ms (float): Statements at least this slow go to the slow-query log.
+            slow_query_log (Path, optional): JSON-lines file the slow queries are appended to.
+            slow_query_history (int): Slow queries kept in memory, see `slow_queries`.
+        """
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.slow_query_log = Path(slow_query_log) if slow_query_log else None
+        self.statements: Dict[Tuple[str, str, str], Histogram] = {}  # (engine, operation, sql)
+        self.rows: Dict[Tuple[str, str, str], int] = {}
+        self.operations: Dict[str, Histogram] = {}
+        self.transactions: Dict[str, Histogram] = {}
+        self.lock_waits: Dict[str, Histogram] = {}
+        self.slow_queries: Deque[Dict[str, Any]] = deque(maxlen=slow_query_history)
+        self.slow_query_count = 0
+        self._lock = threading.Lock()
+
+    # Engine events --------------------------------------------------------------------
+
+    def install(self, engines: Dict[str, Any]):
+        """
+        Listen to the statement and transaction events of the given engines.
+
+        Args:
+            engines (dict): Label -> engine, e.g. {"writer": engine, "reader": read_engine}.
+        """
+        for label, engine in engines.items():
+            event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self._after_cursor_execute(label))
+            event.listen(engine, "handle_error", self._handle_error)
+            event.listen(engine, "begin", self._begin)
+            event.listen(engine, "commit", self._end_transaction(label))
+            event.listen(engine, "rollback", self._end_transaction(label))
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, label: str):
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info["query_started"].pop()
+            operation = _operation.get() or ""
+            sql = normalize_sql(statement)
+            rowcount = cursor.rowcount if cursor.rowcount and cursor.rowcount > 0 else 0
+            key = (label, operation, sql)
+            first_write = sql[:7].upper().startswith(_WRITE_VERBS) and not conn.info.get("has_write_lock")
+            with self._lock:
+                self.statements.setdefault(key, Histogram()).observe(elapsed)
+                self.rows[key] = self.rows.get(key, 0) + rowcount
+                if first_write:
+                    # SQLite takes the write lock in the first write of a transaction, waiting up to
+                    # busy_timeout; pysqlite exposes no busy handler, so that statement's time is the
+                    # (upper bound of the) lock wait.
+                    self.lock_waits.setdefault(label, Histogram()).observe(elapsed)
+            if first_write:
+                conn.info["has_write_lock"] = True
+            if elapsed >= self.slow_query_seconds:
+                self._log_slow_query(cursor, statement, parameters, executemany, label, operation, elapsed, rowcount)
+
+        return after_cursor_execute
+
+    @staticmethod
+    def _handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+    @staticmethod
+    def _begin(conn):
+        conn.info["transaction_started"] = time.perf_counter()
+
+    def _end_transaction(self, label: str):
+        def end_transaction(conn):
+            started = conn.info.pop("transaction_started", None)
+            conn.info.pop("has_write_lock", None)
+            if started is not None:
+                with self._lock:
+                    self.transactions.setdefault(label, Histogram()).observe(time.perf_counter() - started)
+
+        return end_transaction
+
+    def _log_slow_query(self, cursor, statement, parameters, executemany, label, operation, elapsed, rowcount):
+        plan: List[str] = []
+        if not statement.lstrip()[:6].upper().startswith(("BEGIN", "COMMIT", "PRAGMA", "EXPLAI")):
+            try:
+                plan_cursor = cursor.connection.cursor()
+                try:
+                    params = parameters[0] if executemany and parameters else parameters
+                    plan = [row[-1] for row in plan_cursor.execute(f"EXPLAIN QUERY PLAN {statement}", params or ())]
+                finally:
+                    plan_cursor.close()
+            except Exception:  # DDL and a few other statements cannot be explained
+                plan = []
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "engine": label,
+            "operation": operation or None,
+            "duration_ms": round(elapsed * 1000, 3),
+            "rows": rowcount,
+            "executemany": executemany,
+            "sql": normalize_sql(statement),
+            "plan": plan,
+        }
+        with self._lock:
+            self.slow_query_count += 1
+            self.slow_queries.append(entry)
+            if self.slow_query_log is not None:
+                self.slow_query_log.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.slow_query_log, "a") as log:
+                    log.write(json.dumps(entry, default=str) + "\n")
+
+    # Manager methods --------------------------------------------------------------------
+
+    def instrument(self, obj, name: str, methods: Optional[Iterable[str]] = None):
+        """
+        Time the public methods of `obj` (e.g. a manager) and label their statements `<name>.<method>`.
+
+        The wrappers are set on the instance, so other instances and the class are untouched. Only
+        bound methods are wrapped by default; attributes that merely are callable (`model`,
+        `session_factory`) stay as they are.
+        """
+        methods = methods or [m for m in dir(obj) if not m.startswith("_") and inspect.ismethod(getattr(obj, m))]
+        for method in methods:
+            setattr(obj, method, self._timed(getattr(obj, method), f"{name}.{method}"))
+
+    def _timed(self, function, operation: str):
+        @wraps(function)
+        def timed(*args, **kwargs):
+            token = _operation.set(operation)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                _operation.reset(token)
+                with self._lock:
+                    self.operations.setdefault(operation, Histogram()).observe(elapsed)
+
+        return timed
+
+    # Reporting --------------------------------------------------------------------------
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        The collected metrics as plain data, slowest statements (by total time) first.
+        """
+        with self._lock:
+            statements = [
+                {"engine": label, "operation": operation or None, "sql": sql, "rows": self.rows.get((label, operation, sql), 0), **histogram.as_dict()}
+                for (label, operation, sql), histogram in self.statements.items()
+            ]
+            return {
+                "statements": sorted(statements, key=lambda s: s["sum_s"], reverse=True),
+                "operations": {name: histogram.as_dict() for name, histogram in sorted(self.operations.items())},
+                "transactions": {label: histogram.as_dict() for label, histogram in self.transactions.items()},
+                "lock_waits": {label: histogram.as_dict() for label, histogram in self.lock_waits.items()},
+                "slow_query_count": self.slow_query_count,
+                "slow_queries": list(self.slow_queries),
+            }
+
+    def reset(self):
+        with self._lock:
+            for collection in (self.statements, self.rows, self.operations, self.transactions, self.lock_waits, self.slow_queries):
+                collection.clear()
+            self.slow_query_count = 0
+
+    @staticmethod
+    def _histogram_lines(name: str, labels: str, histogram: Histogram) -> List[str]:
+        lines, cumulative = [], 0
+        for bound, count in zip(BUCKETS + (float("inf"),), histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+        braces = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{braces} {histogram.total}")
+        lines.append(f"{name}_count{braces} {histogram.count}")
+        return lines
+
+    def to_prometheus(self, prefix: str = "satdb") -> str:
+        """
+        The metrics in the Prometheus text exposition format.
+        """
+        families = {
+            f"{prefix}_statement_duration_seconds": ("Statement latency.", "histogram", []),
+            f"{prefix}_statement_rows_total": ("Rows written by statements.", "counter", []),
+            f"{prefix}_operation_duration_seconds": ("Manager method latency.", "histogram", []),
+            f"{prefix}_transaction_duration_seconds": ("Transaction duration.", "histogram", []),
+            f"{prefix}_lock_wait_seconds": ("Upper bound of the write-lock wait per transaction.", "histogram", []),
+            f"{prefix}_slow_queries_total": ("Statements slower than the slow-query threshold.", "counter", []),
+        }
+        with self._lock:
+            for (label, operation, sql), histogram in self.statements.items():
+                labels = f'engine="{label}",operation="{_label(operation)}",sql="{_label(sql[:200])}"'
+                families[f"{prefix}_statement_duration_seconds"][2].extend(self._histogram_lines(f"{prefix}_statement_duration_seconds", labels, histogram))
+                families[f"{prefix}_statement_rows_total"][2].append(f"{prefix}_statement_rows_total{{{labels}}} {self.rows.get((label, operation, sql), 0)}")
+            for operation, histogram in self.operations.items():
+                families[f"{prefix}_operation_duration_seconds"][2].extend(
+                    self._histogram_lines(f"{prefix}_operation_duration_seconds", f'operation="{_label(operation)}"', histogram)
+                )
+            for label, histogram in self.transactions.items():
+                families[f"{prefix}_transaction_duration_seconds"][2].extend(
+                    self._histogram_lines(f"{prefix}_transaction_duration_seconds", f'engine="{label}"', histogram)
+                )
+            for label, histogram in self.lock_waits.items():
+                families[f"{prefix}_lock_wait_seconds"][2].extend(self._histogram_lines(f"{prefix}_lock_wait_seconds", f'engine="{label}"', histogram))
+            families[f"{prefix}_slow_queries_total"][2].append(f"{prefix}_slow_queries_total {self.slow_query_count}")
+
+        lines = []
+        for name, (help_text, kind, samples) in families.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *samples]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: Path, prefix: str = "satdb") -> Path:
+        """
+        Atomically (re)write a Prometheus text file, e.g. for the node_exporter textfile collector.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(self.to_prometheus(prefix))
+        os.replace(tmp, path)
+        return path
@@ -1,15 +1,195 @@
 from __future__ import annotations
-from typing import Dict, Any, Optional, List, Union
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Union, Iterable, Callable
 from uuid import uuid4
+import numpy as np
+import pandas as pd
+from sqlalchemy import insert, select
+from database.util.bulk import AIS_CSV_ALIASES, chunked, column_coercers, iter_csv_records, new_uuids, prepare_frame, upsert_statement
+from database.util.chips import CHIP_COLUMNS
+from database.util.compact import COMPACT_LAYOUT, COMPACT_TABLES
 from database.util.tables import Constellation, ProductQueryHistory, DownloadRecord, ImageRecord, DetectionRecord, AISRecord, ObjectRecord
 from datetime import datetime, timezone
 
+AIS_FIELDS = ("mmsi", "timestamp", "latitude", "longitude", "speed", "heading", "name", "imo", "length", "type")
+
+
+def _ais_coercers() -> Dict[str, Any]:
+    return {field: coerce for field, coerce in column_coercers(AISRecord.__table__).items() if field in AIS_FIELDS}
+
+
+def _text(value: Any) -> Optional[str]:
+    # str() of a value, keeping None as NULL so a partial record never overwrites stored text.
+    return str(value) if value is not None else None
+
+
+class FrameInsertMixin:
+    """
+    Vectorized DataFrame/Arrow ingestion shared by the managers.
+
+    Subclasses set `model`, the columns a row must provide (`frame_required`), input column
+    renames (`frame_renames`), whether uuid4 keys are generated (`frame_generate_keys`) and
+    the conflict policies of `upsert_many` (`upsert_policies`, `upsert_default_policy`).
+    """
+
+    model = None
+    frame_required: tuple = ()
+    frame_renames: Dict[str, str] = {}
+    frame_generate_keys: bool = False
+    upsert_policies: Dict[str, str] = {}
+    upsert_default_policy: str = "coalesce"
+    # Column -> columns `_before_write` fills from it, updated together with it by `upsert_many`.
+    derived_columns: Dict[str, tuple] = {}
+
+    def _frame_defaults(self) -> Dict[str, Any]:
+        return {}
+
+    def insert_dataframe(self, frame: pd.DataFrame, batch_size: int = 10_000, **defaults) -> int:
+        """
+        Insert the rows of a DataFrame with one Core executemany per batch.
+
+        Args:
+            frame (pd.DataFrame): Rows to insert; columns are the table columns.
+            batch_size (int): Rows per executemany.
+            **defaults: Values for columns missing from `frame` (or null in it), e.g. `image_id`.
+
+        Returns:
+            int: Number of inserted rows.
+        """
+        if frame.empty:
+            return 0
+
+        table = self.model.__table__
+        prepared = prepare_frame(
+            table,
+            frame,
+            required=self.frame_required,
+            renames=self.frame_renames,
+            defaults={**self._frame_defaults(), **defaults},
+            generate_keys=self.frame_generate_keys,
+        )
+        self._write_frame(prepared, batch_size)
+        return len(prepared)
+
+    def upsert_many(
+        self,
+        rows: Union[pd.DataFrame, Iterable[Dict[str, Any]]],
+        policies: Optional[Dict[str, str]] = None,
+        default_policy: Optional[str] = None,
+        batch_size: int = 10_000,
+        **defaults,
+    ) -> int:
+        """
+        Insert rows, or update the existing rows with the same primary key, in batched executemany.
+
+        Only the columns present in `rows` (or passed as `defaults`) are ever updated; how an
+        existing value is updated is set per column, see `database.util.bulk.UPSERT_POLICIES`.
+
+        Args:
+            rows: DataFrame or iterable of dicts with table columns.
+            policies (dict, optional): Column -> policy, on top of the manager's `upsert_policies`.
+            default_policy (str, optional): Policy of the other columns. Defaults to `upsert_default_policy`.
+            batch_size (int): Rows per executemany.
+            **defaults: Values for columns missing from `rows` (or null in them).
+
+        Returns:
+            int: Number of rows inserted or updated.
+        """
+        plan = self._upsert_plan(rows, policies, default_policy, **defaults)
+        if plan is None:
+            return 0
+        statement, prepared = plan
+        with self.db_handler.engine.begin() as conn:
+            for start in range(0, len(prepared), batch_size):
+                conn.execute(statement, self._before_write(conn, prepared.iloc[start : start + batch_size].to_dict("records")))
+        return len(prepared)
+
+    def _upsert_plan(self, rows, policies: Optional[Dict[str, str]] = None, default_policy: Optional[str] = None, **defaults):
+        # The statement and validated rows of `upsert_many`, None when there are no rows. Shared with the async managers.
+        frame = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame.from_records(list(rows))
+        if frame.empty:
+            return None
+
+        table = self.model.__table__
+        provided = [self.frame_renames.get(name, name) for name in frame.columns] + list(defaults)
+        prepared = prepare_frame(
+            table,
+            frame,
+            required=self.frame_required,
+            renames=self.frame_renames,
+            defaults={**self._frame_defaults(), **defaults},
+            generate_keys=self.frame_generate_keys,
+        )
+        if getattr(self.db_handler, "layout", None) == COMPACT_LAYOUT and table.name in COMPACT_TABLES:
+            # A view with SQLite-assigned keys (see database.util.compact): nothing to conflict with.
+            if "id" in frame and any(isinstance(key, (int, np.integer)) for key in frame["id"]):
+                raise RuntimeError(f"'{table.name}' uses the compact layout: update existing rows with UPDATE, not upsert_many")
+            return insert(table), prepared
+        columns = [name for name in prepared.columns if name in provided]
+        statement = upsert_statement(
+            table,
+            columns + [derived for name in columns for derived in self.derived_columns.get(name, ())],
+            policies={**self.upsert_policies, **(policies or {})},
+            default_policy=default_policy or self.upsert_default_policy,
+        )
+        return statement, prepared
+
+    def _before_write(self, conn, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Last change to validated rows, inside the writing transaction `conn`.
+        return rows
+
+    def _after_upsert(self, frame: pd.DataFrame):
+        # Called with the rows of every committed upsert, also those written by the write-behind queue.
+        pass
+
+    def _write_frame(self, prepared: pd.DataFrame, batch_size: int):
+        statement = insert(self.model.__table__)
+        with self.db_handler.engine.begin() as conn:
+            for start in range(0, len(prepared), batch_size):
+                conn.execute(statement, self._before_write(conn, prepared.iloc[start : start + batch_size].to_dict("records")))
+
+    def insert_arrow(self, data, batch_size: int = 10_000, **defaults) -> int:
+        """
+        Insert a `pyarrow.Table` or `RecordBatch`, converting one batch at a time.
+
+        Args:
+            data: Arrow table or record batch with table columns.
+            batch_size (int): Rows converted and written per executemany.
+            **defaults: See `insert_dataframe`.
+
+        Returns:
+            int: Number of inserted rows.
+        """
+        batches = data.to_batches(max_chunksize=batch_size) if hasattr(data, "to_batches") else [data]
+        return sum(self.insert_dataframe(batch.to_pandas(), batch_size=batch_size, **defaults) for batch in batches)
+
+
+class AISManager(FrameInsertMixin):
+    model = AISRecord
+    frame_required = ("image_id",)
+    frame_generate_keys = True
 
-class AISManager:
     def __init__(self, session_factory, db_handler):
         self.session_factory = session_factory
         self.db_handler = db_handler
 
+    @staticmethod
+    def _ais_rows(image_id: Optional[str], entries: List[Dict[str, Any]], coercers: Dict[str, Any]) -> List[Dict[str, Any]]:
+        rows = []
+        for key, entry in zip(new_uuids(len(entries)), entries):
+            row = {field: entry.get(field) for field in AIS_FIELDS}
+            for field, coerce in coercers.items():
+                if row.get(field) is not None:
+                    row[field] = coerce(row[field])
+            row["id"] = key
+            row["image_id"] = entry.get("image_id") or image_id
+            if row["image_id"] is None:
+                raise ValueError("AIS records need an image_id, either per entry or as argument")
+            rows.append(row)
+        return rows
+
     def insert_ais_records(self, image_id: str, ais_data: Union[List[Dict[str, Any]], list[Dict[str, Any]]]):
         """
         Insert AIS records linked to a given image.
@@ -21,45 +201,89 @@ class AISManager:
         if not ais_data:
             return
 
-        with self.db_handler.session_scope() as session:
-            records = [
-                AISRecord(
-                    id=str(uuid4()),
-                    image_id=image_id,
-                    mmsi=entry.get("mmsi"),
-                    timestamp=entry.get("timestamp"),
-                    latitude=entry.get("latitude"),
-                    longitude=entry.get("longitude"),
-                    speed=entry.get("speed"),
-                    heading=entry.get("heading"),
-                    name=entry.get("name"),
-                    imo=entry.get("imo"),
-                    length=entry.get("length"),
-                    type=entry.get("type"),
-                )
-                for entry in ais_data
-            ]
-            session.add_all(records)
+        self._write_rows(self._ais_rows(image_id, list(ais_data), _ais_coercers()))
+
+    def _write_rows(self, rows: List[Dict[str, Any]]):
+        # With Settings.ais_partitioning, rows go to the partition file of their month.
+        partitions = self.db_handler.ais_partitions
+        if partitions is not None:
+            partitions.write(rows)
+            return
+        with self.db_handler.engine.begin() as conn:
+            conn.execute(insert(AISRecord.__table__), rows)
+
+    def _write_frame(self, prepared: pd.DataFrame, batch_size: int):
+        if self.db_handler.ais_partitions is None:
+            return super()._write_frame(prepared, batch_size)
+        for start in range(0, len(prepared), batch_size):
+            self._write_rows(prepared.iloc[start : start + batch_size].to_dict("records"))
+
+    def stream_ais_records(
+        self,
+        source: Union[Iterable[Dict[str, Any]], str, Path],
+        image_id: Optional[str] = None,
+        chunk_size: int = 50_000,
+        progress: Optional[Callable[[Dict[str, float]], None]] = None,
+    ) -> Dict[str, float]:
+        """
+        Stream AIS records into the database in fixed-size chunks.
+
+        Memory use is bounded by `chunk_size` regardless of the size of `source`. Each chunk is
+        written with a single Core executemany and committed on its own, so an interrupted ingest
+        keeps every chunk written before the failure.
+
+        Args:
+            source: Iterable/generator of AIS dicts, or a path to an AIS CSV file.
+            image_id (str, optional): ImageRecord ID used for entries without their own `image_id`.
+            chunk_size (int): Number of rows per executemany/commit.
+            progress (callable, optional): Called with the running stats after every chunk.
+
+        Returns:
+            dict: `rows`, `chunks`, `seconds` and `rows_per_second` of the ingest.
+        """
+        if isinstance(source, (str, Path)):
+            source = iter_csv_records(Path(source), AIS_CSV_ALIASES)
+
+        coercers = _ais_coercers()
+        stats = {"rows": 0, "chunks": 0, "seconds": 0.0, "rows_per_second": 0.0}
+        started = time.perf_counter()
 
+        for chunk in chunked(source, chunk_size):
+            rows = self._ais_rows(image_id, chunk, coercers)
+            self._write_rows(rows)
+
+            stats["rows"] += len(rows)
+            stats["chunks"] += 1
+            stats["seconds"] = time.perf_counter() - started
+            stats["rows_per_second"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+            if progress is not None:
+                progress(dict(stats))
+
+        return stats
+
+
+class ConstellationManager(FrameInsertMixin):
+    model = Constellation
+    frame_required = ("name",)
+    upsert_default_policy = "keep"  # the configured constellations never overwrite edited rows
 
-class ConstellationManager:
     def __init__(self, session_factory, db_handler):
         self.db_handler = db_handler
         self.session_factory = session_factory
 
     def _populate_constellations(self, satellite_config: dict):
-        with self.db_handler.session_scope() as session:
-            for name, config in satellite_config.items():
-                if not session.query(Constellation).filter_by(name=name).first():
-                    session.add(
-                        Constellation(
-                            name=name,
-                            description=f"{name} satellite constellation",
-                            available_product_types=config.get("product_types", []),
-                            available_processing_levels=config.get("processing_levels", []),
-                            available_sensor_modes=config.get("sensor_modes", []),
-                        )
-                    )
+        self.upsert_many(
+            [
+                {
+                    "name": name,
+                    "description": f"{name} satellite constellation",
+                    "available_product_types": config.get("product_types", []),
+                    "available_processing_levels": config.get("processing_levels", []),
+                    "available_sensor_modes": config.get("sensor_modes", []),
+                }
+                for name, config in satellite_config.items()
+            ]
+        )
 
 
 class QueryManager:
@@ -67,97 +291,202 @@ class QueryManager:
         self.db_handler = db_handler
         self.session_factory = session_factory
 
+    @staticmethod
+    def query_row(query_data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": str(uuid4()),
+            "constellation": query_data["constellation"],
+            "geometry_wkt": query_data["geometry_wkt"],
+            "start_date": query_data["start_date"],
+            "end_date": query_data["end_date"],
+            "parameters": query_data.get("parameters", {}),
+        }
+
     def record_query(self, query_data: Dict[str, Any]) -> str:
+        row = self.query_row(query_data)
         with self.db_handler.session_scope() as session:
-            query_id = str(uuid4())
-            session.add(
-                ProductQueryHistory(
-                    id=query_id,
-                    constellation=query_data["constellation"],
-                    geometry_wkt=query_data["geometry_wkt"],
-                    start_date=query_data["start_date"],
-                    end_date=query_data["end_date"],
-                    parameters=query_data.get("parameters", {}),
-                )
-            )
-            return query_id
-
-
-class DownloadManager:
+            session.add(ProductQueryHistory(**row))
+        return row["id"]
+
+
+class DownloadManager(FrameInsertMixin):
+    model = DownloadRecord
+    frame_required = ("product_id",)
+    frame_renames = {"product_metadata": "metadata"}
+    # A replayed batch never erases what is known, and the most recently ingested status wins.
+    upsert_policies = {"status": "newest:ingestion_time", "ingestion_time": "max"}
+
     def __init__(self, session_factory, db_handler):
         self.db_handler = db_handler
         self.session_factory = session_factory
+        self.downloaded_ids: Optional[set] = None  # in-process membership cache, see enable_cache()
+
+    def _frame_defaults(self) -> Dict[str, Any]:
+        return {"status": "unknown", "ingestion_time": datetime.now(timezone.utc)}
+
+    def enable_cache(self):
+        """
+        Load every downloaded product ID into an in-process set.
+
+        The set only ever grows: it is updated by this manager's writes and by database hits
+        for IDs it did not know, so downloads recorded by other processes are still found.
+        """
+        with self.db_handler.read_engine.connect() as conn:
+            self.downloaded_ids = set(conn.execute(select(DownloadRecord.product_id)).scalars())
+
+    def _remember(self, product_ids: Iterable[str]):
+        if self.downloaded_ids is not None:
+            self.downloaded_ids.update(product_ids)
+
+    def filter_not_downloaded(self, product_ids: Iterable[str], chunk_size: int = 500) -> List[str]:
+        """
+        Return the given product IDs that have no download record, in input order.
+
+        Args:
+            product_ids (iterable): Candidate product IDs, e.g. one page of catalogue hits.
+            chunk_size (int): IDs per `IN (...)` query, kept below SQLite's variable limit.
+
+        Returns:
+            list: The IDs that are not downloaded.
+        """
+        product_ids = list(product_ids)
+        unknown = self._unknown(product_ids)
+
+        found = set()
+        if unknown:
+            with self.db_handler.read_engine.connect() as conn:
+                for chunk in chunked(list(unknown), chunk_size):
+                    found.update(conn.execute(self.membership_query(chunk)).scalars())
+            self._remember(found)
+
+        return [pid for pid in product_ids if pid in unknown and pid not in found]
+
+    def _unknown(self, product_ids: List[str]) -> Dict[str, None]:
+        # Distinct IDs not in the membership cache, as an ordered dict for fast lookups.
+        cached = self.downloaded_ids if self.downloaded_ids is not None else set()
+        return dict.fromkeys(pid for pid in product_ids if pid not in cached)
+
+    @staticmethod
+    def membership_query(product_ids: List[str]):
+        return select(DownloadRecord.product_id).where(DownloadRecord.product_id.in_(product_ids))
+
+    def insert_dataframe(self, frame: pd.DataFrame, batch_size: int = 10_000, **defaults) -> int:
+        inserted = super().insert_dataframe(frame, batch_size=batch_size, **defaults)
+        if inserted:
+            self._remember(frame["product_id"])
+        return inserted
+
+    def upsert_many(self, rows, policies=None, default_policy=None, batch_size: int = 10_000, **defaults) -> int:
+        frame = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame.from_records(list(rows))
+        upserted = super().upsert_many(frame, policies=policies, default_policy=default_policy, batch_size=batch_size, **defaults)
+        if upserted:
+            self._after_upsert(frame)
+        return upserted
+
+    def _after_upsert(self, frame: pd.DataFrame):
+        self._remember(frame["product_id"])
+
+    def record_download(self, product_data: Dict[str, Any], status: Optional[str] = None) -> Optional[Future]:
+        """
+        Record a download; recording the same product again updates its row (see `upsert_policies`).
+
+        Returns:
+            Future: With `Settings.write_behind`, resolves once the row is committed; otherwise None.
+        """
+        row = self.download_row(product_data, status)
+        if self.db_handler.write_queue is not None:
+            return self.db_handler.write_queue.submit(self, row)
+        self.upsert_many([row])
+
+    @staticmethod
+    def download_row(product_data: Dict[str, Any], status: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            "product_id": product_data.get("product_id"),
+            "query_id": product_data.get("query_id"),
+            "constellation": product_data.get("constellation"),
+            "sensor_mode": product_data.get("sensor_mode"),
+            "product_type": product_data.get("product_type"),
+            "processing_level": product_data.get("processing_level"),
+            "status": status or product_data.get("status", "unknown"),
+            "acqusition_time": product_data.get("acqusition_time"),
+            "publication_time": product_data.get("publication_time"),
+            "latency": product_data.get("latency"),
+            "coordinates": _text(product_data.get("coordinates")),
+            "latitude": product_data.get("latitude"),
+            "longitude": product_data.get("longitude"),
+            "name": product_data.get("name"),
+            "quicklook": product_data.get("quicklook"),
+            "file_path": _text(product_data.get("file_path")),
+            "file_size_mb": product_data.get("file_size_mb"),
+            "checksum": product_data.get("checksum"),
+            "product_metadata": product_data.get("metadata"),
+            "ingestion_time": product_data.get("ingestion_time", datetime.now(timezone.utc)),
+        }
+
+
+class DetectionManager(FrameInsertMixin):
+    model = DetectionRecord
+    frame_required = ("constellation", "image_id", "detection_file")
+    frame_generate_keys = True
 
-    def record_download(self, product_data: Dict[str, Any], status: Optional[str] = None):
-        with self.db_handler.session_scope() as session:
-            session.add(
-                DownloadRecord(
-                    product_id=product_data.get("product_id"),
-                    query_id=product_data.get("query_id"),
-                    constellation=product_data.get("constellation"),
-                    sensor_mode=product_data.get("sensor_mode"),
-                    product_type=product_data.get("product_type"),
-                    processing_level=product_data.get("processing_level"),
-                    status=status or product_data.get("status", "unknown"),
-                    acqusition_time=product_data.get("acqusition_time"),
-                    publication_time=product_data.get("publication_time"),
-                    latency=product_data.get("latency"),
-                    coordinates=str(product_data.get("coordinates")),
-                    latitude=product_data.get("latitude"),
-                    longitude=product_data.get("longitude"),
-                    name=product_data.get("name"),
-                    quicklook=product_data.get("quicklook"),
-                    file_path=str(product_data.get("file_path")),
-                    file_size_mb=product_data.get("file_size_mb"),
-                    checksum=product_data.get("checksum"),
-                    product_metadata=product_data.get("metadata"),
-                    ingestion_time=product_data.get("ingestion_time", datetime.now(timezone.utc)),
-                )
-            )
-
-
-class DetectionManager:
     def __init__(self, session_factory, db_handler):
         self.db_handler = db_handler
         self.session_factory = session_factory
 
-    def record_detection(self, detection: Dict[str, Any]):
+    def record_detection(self, detection: Dict[str, Any]) -> Optional[Future]:
+        row = self.detection_row(detection)
+        if self.db_handler.write_queue is not None:
+            return self.db_handler.write_queue.submit(self, row)
         with self.db_handler.session_scope() as session:
-            session.add(
-                DetectionRecord(
-                    id=str(uuid4()),
-                    constellation=detection["constellation"],
-                    image_id=detection["image_id"],
-                    detection_file=str(detection["detection_file"]),
-                    num_ship_detections=detection.get("num_ship_detections"),
-                    num_dark_ship_detections=detection.get("num_dark_ship_detections"),
-                    latitude=detection.get("latitude"),
-                    longitude=detection.get("longitude"),
-                )
-            )
-
-
-class ImageManager:
+            session.add(DetectionRecord(**row))
+
+    @staticmethod
+    def detection_row(detection: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": str(uuid4()),
+            "constellation": detection["constellation"],
+            "image_id": detection["image_id"],
+            "detection_file": str(detection["detection_file"]),
+            "num_ship_detections": detection.get("num_ship_detections"),
+            "num_dark_ship_detections": detection.get("num_dark_ship_detections"),
+            "latitude": detection.get("latitude"),
+            "longitude": detection.get("longitude"),
+        }
+
+
+class ImageManager(FrameInsertMixin):
+    model = ImageRecord
+    frame_required = ("id", "constellation", "file_path")
+
     def __init__(self, session_factory, db_handler):
         self.db_handler = db_handler
         self.session_factory = session_factory
 
-    def register_image(self, image_data: Dict[str, Any]):
-        with self.db_handler.session_scope() as session:
-            if not session.query(ImageRecord).filter_by(id=image_data["id"]).first():
-                session.add(
-                    ImageRecord(
-                        id=image_data["id"],
-                        constellation=image_data["constellation"],
-                        acquisition_time=image_data.get("acquisition_time"),
-                        file_path=str(image_data["file_path"]),
-                        latitude=image_data.get("latitude"),
-                        longitude=image_data.get("longitude"),
-                    )
-                )
-
-
-class ObjectManager:
+    def register_image(self, image_data: Dict[str, Any]) -> Optional[Future]:
+        # A single INSERT ... ON CONFLICT DO NOTHING: an already registered image is left as is.
+        row = self.image_row(image_data)
+        if self.db_handler.write_queue is not None:
+            return self.db_handler.write_queue.submit(self, row, default_policy="keep")
+        self.upsert_many([row], default_policy="keep")
+
+    @staticmethod
+    def image_row(image_data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": image_data["id"],
+            "constellation": image_data["constellation"],
+            "acquisition_time": image_data.get("acquisition_time"),
+            "file_path": str(image_data["file_path"]),
+            "latitude": image_data.get("latitude"),
+            "longitude": image_data.get("longitude"),
+        }
+
+
+class ObjectManager(FrameInsertMixin):
+    model = ObjectRecord
+    frame_required = ("image_id", "obj_class", "latitude", "longitude")
+    frame_generate_keys = True
+    derived_columns = {"encoded_image": CHIP_COLUMNS}
+
     def __init__(self, session_factory, db_handler):
         self.session_factory = session_factory
         self.db_handler = db_handler
@@ -167,31 +496,36 @@ class ObjectManager:
             return
 
         with self.db_handler.session_scope() as session:
-            records = [
-                ObjectRecord(
-                    id=str(uuid4()),
-                    image_id=image_id,
-                    obj_class=obj["obj_class"],
-                    latitude=obj["latitude"],
-                    longitude=obj["longitude"],
-                    distance_to_shore=obj["distance_to_shore"],
-                    class_index=obj["class_index"],
-                    probability=obj["probability"],
-                    probabilities=obj["probabilities"],
-                    length_min=obj["length_min"],
-                    length_max=obj["length_max"],
-                    breadth_min=obj["breadth_min"],
-                    breadth_max=obj["breadth_max"],
-                    orientation_min=obj["orientation_min"],
-                    orientation_max=obj["orientation_max"],
-                    speed_min=obj["speed_min"],
-                    speed_max=obj["speed_max"],
-                    bbox_width=obj["bbox_width"],
-                    bbox_height=obj["bbox_height"],
-                    bbox_x=obj["bbox_x"],
-                    bbox_y=obj["bbox_y"],
-                    encoded_image=obj["encoded_image"],
-                )
-                for obj in object_list
-            ]
-            session.add_all(records)
+            rows = [self.object_row(image_id, obj) for obj in object_list]
+            session.add_all(ObjectRecord(**row) for row in self._before_write(session.connection(), rows))
+
+    @staticmethod
+    def object_row(image_id: str, obj: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": str(uuid4()),
+            "image_id": image_id,
+            "obj_class": obj["obj_class"],
+            "latitude": obj["latitude"],
+            "longitude": obj["longitude"],
+            "distance_to_shore": obj["distance_to_shore"],
+            "class_index": obj["class_index"],
+            "probability": obj["probability"],
+            "probabilities": obj["probabilities"],
+            "length_min": obj["length_min"],
+            "length_max": obj["length_max"],
+            "breadth_min": obj["breadth_min"],
+            "breadth_max": obj["breadth_max"],
+            "orientation_min": obj["orientation_min"],
+            "orientation_max": obj["orientation_max"],
+            "speed_min": obj["speed_min"],
+            "speed_max": obj["speed_max"],
+            "bbox_width": obj["bbox_width"],
+            "bbox_height": obj["bbox_height"],
+            "bbox_x": obj["bbox_x"],
+            "bbox_y": obj["bbox_y"],
+            "encoded_image": obj["encoded_image"],
+        }
+
+    def _before_write(self, conn, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Image chips go to the pack file (see database.util.chips); the rows keep their hash and offset.
+        return self.db_handler.chips.externalize(conn, rows)
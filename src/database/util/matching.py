@@ -0,0 +1,389 @@
+"""
+Vectorized matching of detected objects to AIS vessels, and dark-ship labelling.
+
+Per image, every MMSI track is interpolated to the acquisition time. Objects are then matched
+one-to-one to the nearest interpolated vessel within `max_distance_m`, using a uniform grid
+over local metric coordinates. Unmatched objects are dark. The results are written back in
+bulk to `objects.matched_mmsi`, `objects.match_distance_m`, `objects.is_dark` and
+`detections.num_dark_ship_detections`.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing.util import Finalize
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+EARTH_RADIUS_M = 6_371_000.0
+KNOT_M_S = 0.514444
+
+_OBJECT_SQL = "SELECT id, obj_class, latitude, longitude FROM objects WHERE image_id = ? AND latitude IS NOT NULL AND longitude IS NOT NULL"
+_AIS_SQL = """
+    SELECT mmsi, timestamp, latitude, longitude, speed, heading FROM ais
+    WHERE image_id = ? AND mmsi IS NOT NULL AND timestamp IS NOT NULL AND latitude IS NOT NULL AND longitude IS NOT NULL
+"""
+
+
+def interpolate_tracks(
+    mmsi: np.ndarray,
+    times: np.ndarray,
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    speed: np.ndarray,
+    heading: np.ndarray,
+    at: np.datetime64,
+    max_gap_s: float = 600.0,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Position of every vessel at time `at`.
+
+    Tracks with messages on both sides of `at` are interpolated linearly. A track with
+    messages on one side only is dead-reckoned from its nearest message with speed (knots)
+    and heading (degrees) when they are known, or kept at that position otherwise. Vessels
+    whose nearest message is more than `max_gap_s` away from `at` are dropped.
+
+    Returns:
+        tuple: (mmsi, latitude, longitude) arrays with one entry per kept vessel.
+    """
+    if len(mmsi) == 0:
+        empty = np.array([], dtype=float)
+        return np.array([], dtype=object), empty, empty
+
+    dt = (times - at) / np.timedelta64(1, "s")  # seconds relative to `at`
+    vessels, group = np.unique(mmsi, return_inverse=True)
+    order = np.lexsort((dt, group))
+    group, dt, latitude, longitude = group[order], dt[order], latitude[order], longitude[order]
+    speed, heading = speed[order], heading[order]
+
+    starts = np.searchsorted(group, np.arange(len(vessels)), side="left")
+    ends = np.searchsorted(group, np.arange(len(vessels)), side="right")
+    # First message at or after `at` per track: search a key that sorts by (group, dt).
+    span = 2.0 * (np.abs(dt).max() + 1.0)
+    key = group * span + dt
+    after = np.searchsorted(key, np.arange(len(vessels)) * span, side="left")
+    before = after - 1
+    has_before = before >= starts
+    has_after = after < ends
+    before = np.where(has_before, before, starts)
+    after = np.where(has_after, after, ends - 1)
+
+    gap_before = np.where(has_before, -dt[before], np.inf)
+    gap_after = np.where(has_after, dt[after], np.inf)
+    keep = np.minimum(gap_before, gap_after) <= max_gap_s
+
+    both = has_before & has_after
+    span_t = dt[after] - dt[before]
+    fraction = np.where(both & (span_t > 0), -dt[before] / np.where(span_t > 0, span_t, 1.0), 0.0)
+    lat = latitude[before] + fraction * (latitude[after] - latitude[before])
+    lon = longitude[before] + fraction * (longitude[after] - longitude[before])
+
+    # One-sided tracks: dead-reckon from the nearest message.
+    nearest = np.where(has_before, before, after)
+    elapsed = np.where(has_before, gap_before, -gap_after)
+    one_sided = ~both
+    moving = one_sided & ~np.isnan(speed[nearest]) & ~np.isnan(heading[nearest])
+    distance = np.where(moving, speed[nearest] * KNOT_M_S * elapsed, 0.0)
+    bearing = np.radians(np.where(moving, heading[nearest], 0.0))
+    base_lat = np.where(one_sided, latitude[nearest], lat)
+    base_lon = np.where(one_sided, longitude[nearest], lon)
+    lat = base_lat + np.degrees(distance * np.cos(bearing) / EARTH_RADIUS_M)
+    lon = base_lon + np.degrees(distance * np.sin(bearing) / (EARTH_RADIUS_M * np.cos(np.radians(base_lat))))
+
+    return vessels[keep], lat[keep], lon[keep]
+
+
+def match_positions(
+    object_lat: np.ndarray,
+    object_lon: np.ndarray,
+    vessel_lat: np.ndarray,
+    vessel_lon: np.ndarray,
+    max_distance_m: float = 500.0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Match objects to vessels one-to-one, nearest pairs first, within `max_distance_m`.
+
+    Candidate pairs come from a uniform grid with `max_distance_m` cells over an equirectangular
+    projection around the scene, so only the 3x3 neighbouring cells of each object are compared.
+
+    Returns:
+        tuple: (vessel index per object or -1, distance in metres per object or NaN).
+    """
+    matched = np.full(len(object_lat), -1, dtype=np.int64)
+    distance = np.full(len(object_lat), np.nan)
+    if len(object_lat) == 0 or len(vessel_lat) == 0:
+        return matched, distance
+
+    scale_x = EARTH_RADIUS_M * np.cos(np.radians(np.concatenate([object_lat, vessel_lat]).mean()))
+    ox, oy = np.radians(object_lon) * scale_x, np.radians(object_lat) * EARTH_RADIUS_M
+    vx, vy = np.radians(vessel_lon) * scale_x, np.radians(vessel_lat) * EARTH_RADIUS_M
+    origin_x, origin_y = min(ox.min(), vx.min()), min(oy.min(), vy.min())
+    ocx, ocy = ((ox - origin_x) // max_distance_m).astype(np.int64), ((oy - origin_y) // max_distance_m).astype(np.int64)
+    vcx, vcy = ((vx - origin_x) // max_distance_m).astype(np.int64), ((vy - origin_y) // max_distance_m).astype(np.int64)
+    width = int(max(ocy.max(), vcy.max())) + 3
+
+    vessel_cells = vcx * width + vcy
+    vessel_order = np.argsort(vessel_cells, kind="stable")
+    sorted_cells = vessel_cells[vessel_order]
+
+    object_index, vessel_index = [], []
+    for shift_x in (-1, 0, 1):
+        for shift_y in (-1, 0, 1):
+            cells = (ocx + shift_x) * width + (ocy + shift_y)
+            lo = np.searchsorted(sorted_cells, cells, side="left")
+            hi = np.searchsorted(sorted_cells, cells, side="right")
+            counts = hi - lo
+            if not counts.any():
+                continue
+            objects = np.repeat(np.arange(len(ox)), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            object_index.append(objects)
+            vessel_index.append(vessel_order[np.repeat(lo, counts) + offsets])
+    if not object_index:
+        return matched, distance
+
+    pair_objects, pair_vessels = np.concatenate(object_index), np.concatenate(vessel_index)
+    pair_distance = np.hypot(ox[pair_objects] - vx[pair_vessels], oy[pair_objects] - vy[pair_vessels])
+    close = pair_distance <= max_distance_m
+    pair_objects, pair_vessels, pair_distance = pair_objects[close], pair_vessels[close], pair_distance[close]
+
+    # Greedy one-to-one assignment, nearest pairs first.
+    taken = np.zeros(len(vx), dtype=bool)
+    for pair in np.argsort(pair_distance, kind="stable"):
+        obj, vessel = pair_objects[pair], pair_vessels[pair]
+        if matched[obj] < 0 and not taken[vessel]:
+            matched[obj] = vessel
+            distance[obj] = pair_distance[pair]
+            taken[vessel] = True
+    return matched, distance
+
+
+def match_image(
+    objects: pd.DataFrame,
+    ais: pd.DataFrame,
+    acquisition_time: datetime,
+    max_distance_m: float = 500.0,
+    max_gap_s: float = 600.0,
+    vessel_classes: Optional[Sequence[str]] = None,
+) -> pd.DataFrame:
+    """
+    Match the objects of one image to its AIS messages.
+
+    Args:
+        objects (pd.DataFrame): `id`, `obj_class`, `latitude`, `longitude`.
+        ais (pd.DataFrame): `mmsi`, `timestamp`, `latitude`, `longitude`, `speed`, `heading`.
+        acquisition_time (datetime): Time the vessel positions are interpolated to.
+        max_distance_m (float): Largest object-vessel distance that counts as a match.
+        max_gap_s (float): Largest time between the acquisition and a vessel's nearest message.
+        vessel_classes (sequence, optional): Object classes that can be dark ships. Defaults to all.
+
+    Returns:
+        pd.DataFrame: `id`, `matched_mmsi`, `match_distance_m` and `is_dark` per object.
+    """
+    at = np.datetime64(pd.Timestamp(acquisition_time).tz_localize(None), "us")
+    mmsi, vessel_lat, vessel_lon = interpolate_tracks(
+        ais["mmsi"].to_numpy(dtype=object),
+        pd.to_datetime(ais["timestamp"], format="ISO8601").to_numpy(dtype="datetime64[us]"),
+        ais["latitude"].to_numpy(dtype=float),
+        ais["longitude"].to_numpy(dtype=float),
+        pd.to_numeric(ais["speed"]).to_numpy(dtype=float),
+        pd.to_numeric(ais["heading"]).to_numpy(dtype=float),
+        at,
+        max_gap_s=max_gap_s,
+    )
+    vessels = objects if vessel_classes is None else objects[objects["obj_class"].isin(vessel_classes)]
+    matched, distance = match_positions(
+        vessels["latitude"].to_numpy(dtype=float), vessels["longitude"].to_numpy(dtype=float), vessel_lat, vessel_lon, max_distance_m
+    )
+
+    result = pd.DataFrame({"id": objects["id"].to_numpy(), "matched_mmsi": None, "match_distance_m": np.nan, "is_dark": None})
+    positions = np.flatnonzero(objects["id"].isin(vessels["id"]).to_numpy())
+    result.loc[positions, "matched_mmsi"] = np.where(matched >= 0, mmsi[np.maximum(matched, 0)] if len(mmsi) else None, None)
+    result.loc[positions, "match_distance_m"] = distance
+    result.loc[positions, "is_dark"] = (matched < 0).tolist()
+    return result
+
+
+def _read(conn: sqlite3.Connection, sql: str, params: tuple, columns: Sequence[str]) -> pd.DataFrame:
+    return pd.DataFrame.from_records(conn.execute(sql, params).fetchall(), columns=columns)
+
+
+class _Connections(dict):
+    # Read-only connections per database file, opened on first use.
+    def __missing__(self, path: str) -> sqlite3.Connection:
+        conn = self[path] = sqlite3.connect(f"file:{Path(path).resolve()}?mode=ro", uri=True, timeout=30)
+        return conn
+
+    def close(self):
+        for conn in self.values():
+            conn.close()
+        self.clear()
+
+
+_worker_connections: Optional[_Connections] = None
+
+
+def _init_worker():
+    # Pool initializer: each worker keeps its connections for all its images and closes them on exit.
+    global _worker_connections
+    _worker_connections = _Connections()
+    Finalize(None, _worker_connections.close, exitpriority=10)
+
+
+def load_image(
+    db_path: str, ais_paths: Sequence[str], image_id: str, connections: Optional[_Connections] = None
+) -> Tuple[Optional[datetime], pd.DataFrame, pd.DataFrame]:
+    """
+    Acquisition time, objects and AIS messages of one image, read with plain read-only connections.
+
+    Args:
+        db_path (str): Main database file.
+        ais_paths (sequence): Database files with an `ais` table to read messages from (main and partitions).
+        image_id (str): Image to load.
+        connections (optional): Open connections to reuse; otherwise they are opened and closed here.
+    """
+    owned = connections is None
+    connections = _Connections() if owned else connections
+    try:
+        conn = connections[db_path]
+        row = conn.execute("SELECT acquisition_time FROM images WHERE id = ?", (image_id,)).fetchone()
+        acquisition_time = pd.Timestamp(row[0]).to_pydatetime() if row and row[0] else None
+        objects = _read(conn, _OBJECT_SQL, (image_id,), ["id", "obj_class", "latitude", "longitude"])
+        columns = ["mmsi", "timestamp", "latitude", "longitude", "speed", "heading"]
+        ais = pd.concat([_read(connections[path], _AIS_SQL, (image_id,), columns) for path in ais_paths], ignore_index=True)
+    finally:
+        if owned:
+            connections.close()
+    return acquisition_time, objects, ais
+
+
+def _match_worker(
+    db_path: str, ais_paths: Sequence[str], image_id: str, options: Dict[str, Any], connections: Optional[_Connections] = None
+) -> Tuple[str, Optional[pd.DataFrame]]:
+    connections = _worker_connections if connections is None else connections
+    acquisition_time, objects, ais = load_image(db_path, ais_paths, image_id, connections)
+    if acquisition_time is None or objects.empty:
+        return image_id, None
+    return image_id, match_image(objects, ais, acquisition_time, **options)
+
+
+class AISMatcher:
+    def __init__(self, db_handler, max_distance_m: float = 500.0, max_gap_s: float = 600.0, vessel_classes: Optional[Sequence[str]] = None):
+        """
+        Match objects to AIS vessels per image and store the labels.
+
+        Args:
+            db_handler (DatabaseHandler): Handler of the database (its writer engine stores the results).
+            max_distance_m (float): Largest object-vessel distance that counts as a match.
+            max_gap_s (float): Largest time between the acquisition and a vessel's nearest AIS message.
+            vessel_classes (sequence, optional): Object classes that can be dark ships. Defaults to all.
+        """
+        self.db_handler = db_handler
+        self.options = {"max_distance_m": max_distance_m, "max_gap_s": max_gap_s, "vessel_classes": vessel_classes}
+
+    def _ais_paths(self) -> List[str]:
+        paths = [str(self.db_handler.db_path)]
+        partitions = self.db_handler.ais_partitions
+        if partitions is not None:
+            partitions.refresh()
+            paths += [path for _, _, path in partitions._registry.values()]
+        return paths
+
+    def match(self, image_id: str, write: bool = True) -> pd.DataFrame:
+        """
+        Match the objects of one image.
+
+        Args:
+            image_id (str): Image to process.
+            write (bool): Store the labels in `objects` and the dark count in `detections`.
+
+        Returns:
+            pd.DataFrame: `id`, `matched_mmsi`, `match_distance_m` and `is_dark` per object.
+        """
+        _, result = _match_worker(str(self.db_handler.db_path), self._ais_paths(), image_id, self.options)
+        if result is None:
+            return pd.DataFrame(columns=["id", "matched_mmsi", "match_distance_m", "is_dark"])
+        if write:
+            self.write({image_id: result})
+        return result
+
+    def match_archive(self, image_ids: Optional[Iterable[str]] = None, workers: Optional[int] = None, batch_size: int = 64) -> Dict[str, float]:
+        """
+        Match every image (or `image_ids`) across a process pool; results are written by this process.
+
+        Args:
+            image_ids (iterable, optional): Images to process. Defaults to every image with objects.
+            workers (int, optional): Worker processes. Defaults to the CPU count; 1 runs in-process.
+            batch_size (int): Images whose results are written per transaction.
+
+        Returns:
+            dict: `images`, `objects`, `dark` and `seconds`.
+        """
+        started = time.perf_counter()
+        if image_ids is None:
+            with self.db_handler.read_engine.connect() as conn:
+                image_ids = conn.execute(text("SELECT DISTINCT image_id FROM objects WHERE image_id IS NOT NULL")).scalars().all()
+        image_ids = list(image_ids)
+        db_path, ais_paths = str(self.db_handler.db_path), self._ais_paths()
+        workers = workers or os.cpu_count() or 1
+
+        stats = {"images": 0, "objects": 0, "dark": 0, "seconds": 0.0}
+        pending: Dict[str, pd.DataFrame] = {}
+
+        def collect(image_id: str, result: Optional[pd.DataFrame]):
+            if result is None:
+                return
+            pending[image_id] = result
+            stats["images"] += 1
+            stats["objects"] += len(result)
+            stats["dark"] += int((result["is_dark"] == True).sum())  # noqa: E712 - object column with None
+            if len(pending) >= batch_size:
+                self.write(pending)
+                pending.clear()
+
+        if workers == 1:
+            connections = _Connections()
+            try:
+                for image_id in image_ids:
+                    collect(*_match_worker(db_path, ais_paths, image_id, self.options, connections))
+            finally:
+                connections.close()
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                count = len(image_ids)
+                results = pool.map(
+                    _match_worker, [db_path] * count, [ais_paths] * count, image_ids, [self.options] * count, chunksize=max(1, count // (workers * 4))
+                )
+                for image_id, result in results:
+                    collect(image_id, result)
+        if pending:
+            self.write(pending)
+
+        stats["seconds"] = time.perf_counter() - started
+        return stats
+
+    def write(self, results: Dict[str, pd.DataFrame]):
+        """
+        Store per-object labels and per-image dark counts in one transaction.
+        """
+        objects, detections = [], []
+        for image_id, result in results.items():
+            records = result.astype(object).where(result.notna(), None)
+            objects += records.rename(columns={"id": "object_id"}).to_dict("records")
+            detections.append({"image_id": image_id, "dark": int((result["is_dark"] == True).sum())})  # noqa: E712
+        with self.db_handler.engine.begin() as conn:
+            if objects:
+                conn.execute(
+                    text("UPDATE objects SET matched_mmsi = :matched_mmsi, match_distance_m = :match_distance_m, is_dark = :is_dark WHERE id = :object_id"),
+                    objects,
+                )
+            if detections:
+                conn.execute(text("UPDATE detections SET num_dark_ship_detections = :dark WHERE image_id = :image_id"), detections)
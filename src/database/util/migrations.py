@@ -0,0 +1,171 @@
+"""
+Versioned, in-place schema migrations.
+
+`Base.metadata.create_all` only creates missing tables, so changes to existing tables
+(new indexes, new columns) are shipped as ordered migration steps. Each step runs once per
+database and is recorded in the `schema_version` table. Steps must be idempotent: a fresh
+database already has the latest schema from `create_all` and still runs every step once.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from database.util.base import Base
+from database.util.tables import DatabaseMetadata, SchemaVersion
+
+FINGERPRINT_KEY = "schema_fingerprint"
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def _create_declared_indexes(conn: Connection):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def add_column(conn: Connection, table: str, column_ddl: str):
+    """
+    Add a column to an existing table unless it is already there.
+
+    Args:
+        conn (Connection): Open connection.
+        table (str): Table name.
+        column_ddl (str): Column definition, e.g. "is_dark BOOLEAN".
+    """
+    name = column_ddl.split()[0]
+    existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+    if name not in existing:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column_ddl}"))
+
+
+def _add_object_match_columns(conn: Connection):
+    for column_ddl in ("matched_mmsi VARCHAR(50)", "match_distance_m FLOAT", "is_dark BOOLEAN"):
+        add_column(conn, "objects", column_ddl)
+
+
+def _add_object_chip_columns(conn: Connection):
+    for column_ddl in ("chip_hash VARCHAR(64)", "chip_offset INTEGER", "chip_length INTEGER"):
+        add_column(conn, "objects", column_ddl)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Secondary indexes on the common filter columns", _create_declared_indexes),
+    Migration(2, "AIS match columns on objects", _add_object_match_columns),
+    Migration(3, "Chip pack columns on objects", _add_object_chip_columns),
+]
+
+
+class SchemaMigrator:
+    def __init__(self, engine, migrations: List[Migration] = MIGRATIONS):
+        """
+        Apply pending migrations to the database behind `engine`.
+
+        Args:
+            engine: SQLAlchemy engine for database connection.
+            migrations (list): Migration steps; versions must be unique.
+        """
+        self.engine = engine
+        self.migrations = sorted(migrations, key=lambda m: m.version)
+
+    @property
+    def latest_version(self) -> int:
+        return self.migrations[-1].version if self.migrations else 0
+
+    def applied_versions(self) -> set:
+        with self.engine.connect() as conn:
+            return set(conn.execute(select(SchemaVersion.version)).scalars())
+
+    def migrate(self) -> List[int]:
+        """
+        Run every migration that is not recorded in `schema_version`, in version order.
+
+        Returns:
+            list: The versions applied by this call.
+        """
+        applied = self.applied_versions()
+        newly_applied = []
+        for migration in self.migrations:
+            if migration.version in applied:
+                continue
+            with self.engine.begin() as conn:
+                migration.upgrade(conn)
+                # Concurrent processes may race on the same step; the steps are idempotent.
+                conn.execute(
+                    insert(SchemaVersion.__table__)
+                    .values(version=migration.version, description=migration.description, applied_at=datetime.utcnow())
+                    .on_conflict_do_nothing()
+                )
+            newly_applied.append(migration.version)
+        return newly_applied
+
+
+def schema_fingerprint(satellite_config: dict, extra_statements: Iterable[str] = ()) -> str:
+    """
+    Hash everything the handler's DDL depends on.
+
+    Covers the compiled table and index DDL of the models, the migration versions, the
+    satellite configuration and any further DDL (views, triggers) passed in.
+
+    Args:
+        satellite_config (dict): SATELLITE_CONFIG used for constellations and views.
+        extra_statements (iterable): Further DDL statements, in execution order.
+
+    Returns:
+        str: Hex digest identifying this schema.
+    """
+    digest = hashlib.sha256()
+    dialect = sqlite.dialect()
+    for table in Base.metadata.sorted_tables:
+        digest.update(str(CreateTable(table).compile(dialect=dialect)).encode())
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            digest.update(str(CreateIndex(index).compile(dialect=dialect)).encode())
+    digest.update(json.dumps([m.version for m in MIGRATIONS]).encode())
+    digest.update(json.dumps(satellite_config, sort_keys=True).encode())
+    for statement in extra_statements:
+        digest.update(statement.encode())
+    return digest.hexdigest()
+
+
+def read_fingerprint(engine) -> Optional[str]:
+    """
+    Return the fingerprint stored in the database, or None for new/unversioned databases.
+    """
+    try:
+        with engine.connect() as conn:
+            # Plain SQL: compiling a Core statement on a fresh engine costs more than the query.
+            return conn.exec_driver_sql("SELECT value FROM db_metadata WHERE key = ?", (FINGERPRINT_KEY,)).scalar()
+    except OperationalError:  # no db_metadata table yet
+        return None
+
+
+def read_metadata(engine) -> Dict[str, str]:
+    """
+    Every `db_metadata` entry (fingerprint, layout, database id, ...) in one query; empty for new databases.
+    """
+    try:
+        with engine.connect() as conn:
+            return dict(conn.exec_driver_sql("SELECT key, value FROM db_metadata").all())
+    except OperationalError:  # no db_metadata table yet
+        return {}
+
+
+def write_fingerprint(engine, fingerprint: str):
+    with engine.begin() as conn:
+        statement = insert(DatabaseMetadata.__table__).values(key=FINGERPRINT_KEY, value=fingerprint)
+        conn.execute(statement.on_conflict_do_update(index_elements=["key"], set_={"value": statement.excluded.value}))
@@ -0,0 +1,345 @@
+"""
+Monthly AIS partitions: the `ais` rows of each month in their own SQLite file.
+
+Partition files are registered in the `ais_partitions` table and ATTACHed to every pooled
+connection of the handler under their schema name (e.g. `ais_2024_05`). Each connection also
+gets TEMP views: `ais_all`, the UNION ALL of `main.ais` and the partitions, and versions of
+`ais_records_with_image_info` and `ais_summary_by_image` that read from it and shadow the
+persistent (main.ais only) views of the same name. Every partition branch of `ais_all` carries
+the month bounds as constant predicates, so a time filter turns the branches of other months
+into empty index range scans.
+
+Partitioned rows are only readable through the handler: SQLite views in the database file
+cannot reference other files, so anything opening the file itself (datasette, sqlite3, snapshots
+and compact copies) sees `main.ais` only, as do the `ais_rtree` index and the summary tables.
+The handler refuses the operations that would silently miss partitioned rows (see
+`DatabaseHandler._require_unpartitioned_ais`); export `ais_all` instead of `ais`.
+
+SQLite attaches at most 10 databases per connection (SQLITE_LIMIT_ATTACHED), so every partition
+must fit in `max_attached`: a write that needs another month, or a registry holding more months,
+raises instead of leaving months out of `ais_all`. Archive old months with `detach`.
+"""
+
+from __future__ import annotations
+
+import gzip
+import shutil
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+from sqlalchemy import Column, Index, MetaData, Table, event, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database.util.engine import create_writer_engine
+from database.util.reader import FrameReader
+from database.util.tables import AISPartition, AISRecord
+from database.util.views import DatabaseViews
+
+PARTITION_VIEW = "ais_all"
+
+# The `ais` table of a partition file: the columns and indexes of `AISRecord`, without the
+# foreign key to `images`, which lives in the main database.
+PARTITION_TABLE = Table(
+    "ais",
+    MetaData(),
+    *(Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable) for c in AISRecord.__table__.columns),
+)
+for _index in AISRecord.__table__.indexes:
+    Index(_index.name, *(PARTITION_TABLE.c[c.name] for c in _index.columns))
+
+
+def month_bounds(value: Union[datetime, str]) -> Tuple[datetime, datetime]:
+    """
+    Start (inclusive) and end (exclusive) of the month of `value`, a datetime or "YYYY-MM".
+    """
+    if isinstance(value, str):
+        value = datetime.strptime(value[:7], "%Y-%m")
+    start = datetime(value.year, value.month, 1)
+    end = datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+    return start, end
+
+
+def partition_name(value: Union[datetime, str]) -> str:
+    start, _ = month_bounds(value)
+    return f"ais_{start.year:04d}_{start.month:02d}"
+
+
+class AISPartitions:
+    def __init__(self, engine, read_engine, partition_dir: Path, pragmas: Dict[str, Any], max_attached: int = 8):
+        """
+        Route AIS rows into monthly partition files and attach those files to the main engines.
+
+        Args:
+            engine: Writer engine of the main database (holds the `ais_partitions` registry).
+            read_engine: Read-only engine of the main database.
+            partition_dir (Path): Directory of the `ais_YYYY_MM.db` files.
+            pragmas (dict): PRAGMAs for the partition writer engines, see `resolve_pragmas`.
+            max_attached (int): Newest partitions attached per connection (SQLite allows 10 in total).
+        """
+        self.engine = engine
+        self.read_engine = read_engine
+        self.partition_dir = Path(partition_dir)
+        self.pragmas = pragmas
+        self.max_attached = max_attached
+        self.generation = 0  # bumped whenever the registry changes; connections re-sync on checkout
+        self._registry: Dict[str, Tuple[datetime, datetime, str]] = {}
+        self._engines: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._installed = False
+        self.on_write: Optional[Callable[[Sequence[str]], None]] = None  # called after partition writes, e.g. to bump generations
+
+    def install(self):
+        """
+        Attach the partitions and create the TEMP views on every connection of both engines.
+        """
+        if self._installed:
+            return
+        engines = {self.read_engine: True}
+        engines.setdefault(self.engine, False)
+        for engine, read_only in engines.items():
+            event.listen(engine, "checkout", self._checkout_listener(read_only))
+        self._installed = True
+
+    def refresh(self, strict: bool = True):
+        """
+        Reload the registry, e.g. to see partitions created by another process.
+
+        Args:
+            strict (bool): Raise when the registry holds more partitions than can be attached.
+
+        Raises:
+            ValueError: With `strict`, when there are more than `max_attached` partitions.
+        """
+        with self.read_engine.connect() as conn:
+            if conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'ais_partitions'").scalar() is None:
+                rows = []  # no registry yet, e.g. a read-only handler on an old database
+            else:
+                rows = conn.execute(select(AISPartition.schema_name, AISPartition.month_start, AISPartition.month_end, AISPartition.path)).all()
+        registry = {name: (start, end, path) for name, start, end, path in rows}
+        if strict:
+            self._check_capacity(registry)
+        with self._lock:
+            if registry != self._registry:
+                self._registry = registry
+                self.generation += 1
+
+    def partitions(self) -> pd.DataFrame:
+        """
+        The registered partitions, newest first, with a flag for those attached to each connection.
+        """
+        attached = set(self.attached())
+        return pd.DataFrame(
+            [
+                {"schema_name": name, "month_start": start, "month_end": end, "path": path, "attached": name in attached}
+                for name, (start, end, path) in sorted(self._registry.items(), reverse=True)
+            ],
+            columns=["schema_name", "month_start", "month_end", "path", "attached"],
+        )
+
+    def attached(self) -> List[str]:
+        """
+        Schema names of the partitions attached to each connection: the newest `max_attached`.
+
+        Only while `detach` brings an oversized registry back under the limit are these not all of them.
+        """
+        return sorted(self._registry, reverse=True)[: self.max_attached]
+
+    def _check_capacity(self, names):
+        if len(names) > self.max_attached:
+            raise ValueError(
+                f"{len(names)} AIS partitions, but only {self.max_attached} can be attached and read through `{PARTITION_VIEW}`: "
+                "archive old months (detach_ais_partition) or raise Settings.ais_partitions_attached (SQLite allows 10)"
+            )
+
+    def _checkout_listener(self, read_only: bool):
+        def sync_partitions(dbapi_connection, connection_record, connection_proxy):
+            generation = self.generation
+            if connection_record.info.get("ais_partitions") != generation:
+                self._sync(dbapi_connection, read_only)
+                connection_record.info["ais_partitions"] = generation
+
+        return sync_partitions
+
+    def _sync(self, dbapi_connection, read_only: bool):
+        with self._lock:
+            registry = dict(self._registry)
+            hot = self.attached()
+        cursor = dbapi_connection.cursor()
+        try:
+            current = {row[1] for row in cursor.execute("PRAGMA database_list")} - {"main", "temp"}
+            for name in current - set(hot):
+                cursor.execute(f"DETACH DATABASE {name}")
+            for name in set(hot) - current:
+                path = Path(registry[name][2]).resolve()
+                cursor.execute(f"ATTACH DATABASE ? AS {name}", (f"file:{path}?mode=ro" if read_only else str(path),))
+            if read_only:  # query_only also refuses TEMP objects; the main file stays read-only via mode=ro
+                cursor.execute("PRAGMA query_only = 0")
+            for statement in self._view_statements({name: registry[name] for name in hot}):
+                cursor.execute(statement)
+            if read_only:
+                cursor.execute("PRAGMA query_only = 1")
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _view_statements(partitions: Dict[str, Tuple[datetime, datetime, str]]) -> List[str]:
+        columns = ", ".join(c.name for c in PARTITION_TABLE.columns)
+        branches = [f"SELECT {columns} FROM main.ais"]
+        for name, (start, end, _) in sorted(partitions.items()):
+            branches.append(f"SELECT {columns} FROM {name}.ais WHERE timestamp >= '{start:%Y-%m-%d}' AND timestamp < '{end:%Y-%m-%d}'")
+        statements = [
+            "DROP VIEW IF EXISTS temp.ais_records_with_image_info",
+            "DROP VIEW IF EXISTS temp.ais_summary_by_image",
+            f"DROP VIEW IF EXISTS temp.{PARTITION_VIEW}",
+            f"CREATE TEMP VIEW {PARTITION_VIEW} AS " + " UNION ALL ".join(branches),
+        ]
+        return statements + DatabaseViews.ais_view_statements(PARTITION_VIEW, temp=True)
+
+    def _engine_for(self, name: str):
+        with self._lock:
+            if name not in self._engines:
+                self._engines[name] = create_writer_engine(Path(self._registry[name][2]), self.pragmas)
+            return self._engines[name]
+
+    def ensure(self, month: Union[datetime, str]) -> str:
+        """
+        Create (or find) the partition of a month.
+
+        Args:
+            month: Any datetime in the month, or "YYYY-MM".
+
+        Returns:
+            str: Schema name of the partition.
+        """
+        name = partition_name(month)
+        if name in self._registry:
+            return name
+        self.refresh()  # another process may have created it
+        if name in self._registry:
+            return name
+
+        start, end = month_bounds(month)
+        self.partition_dir.mkdir(parents=True, exist_ok=True)
+        path = self.partition_dir / f"{name}.db"
+        engine = create_writer_engine(path, self.pragmas)
+        PARTITION_TABLE.metadata.create_all(engine)
+        engine.dispose()
+        with self.engine.begin() as conn:
+            statement = sqlite_insert(AISPartition.__table__).values(
+                schema_name=name, month_start=start, month_end=end, path=str(path), created_at=datetime.utcnow()
+            )
+            conn.execute(statement.on_conflict_do_nothing(index_elements=["schema_name"]))
+        self.refresh()
+        return name
+
+    def route(self, rows: Sequence[Dict[str, Any]]) -> Dict[Optional[str], List[Dict[str, Any]]]:
+        """
+        Group rows by partition; rows without a timestamp map to None, i.e. `main.ais`.
+
+        Raises:
+            ValueError: When the months of `rows` would exceed `max_attached` partitions; nothing is created then.
+        """
+        months = {partition_name(row["timestamp"]) for row in rows if row.get("timestamp") is not None}
+        if not months <= set(self._registry):
+            self.refresh()
+            self._check_capacity(set(self._registry) | months)
+
+        groups: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        names: Dict[Tuple[int, int], str] = {}
+        for row in rows:
+            timestamp = row.get("timestamp")
+            if timestamp is None:
+                name = None
+            else:
+                month = (timestamp.year, timestamp.month)
+                if month not in names:
+                    names[month] = self.ensure(timestamp)
+                name = names[month]
+            groups.setdefault(name, []).append(row)
+        return groups
+
+    def write(self, rows: Sequence[Dict[str, Any]]):
+        """
+        Insert AIS rows into their monthly partitions, one transaction per partition.
+        """
+        for name, group in self.route(rows).items():
+            if name is None:
+                with self.engine.begin() as conn:
+                    conn.execute(insert(AISRecord.__table__), group)
+            else:
+                with self._engine_for(name).begin() as conn:
+                    conn.execute(insert(PARTITION_TABLE), group)
+                if self.on_write is not None:
+                    self.on_write([AISRecord.__tablename__])
+
+    def query_range(
+        self, start: Optional[datetime] = None, end: Optional[datetime] = None, columns: Optional[Sequence[str]] = None
+    ) -> pd.DataFrame:
+        """
+        AIS rows with `start <= timestamp < end`, reading only `main.ais` and the overlapping partitions.
+
+        Args:
+            start (datetime, optional): Inclusive lower bound; None for no bound.
+            end (datetime, optional): Exclusive upper bound; None for no bound.
+            columns (sequence, optional): Columns to return. Defaults to all.
+
+        Returns:
+            pd.DataFrame: The matching rows, main table first, then the partitions by month.
+        """
+        self.refresh()
+        filters = [("timestamp", "is not null", None)]
+        if start is not None:
+            filters.append(("timestamp", ">=", start))
+        if end is not None:
+            filters.append(("timestamp", "<", end))
+
+        engines = [self.read_engine]
+        for name, (month_start, month_end, _) in sorted(self._registry.items()):
+            if (end is None or month_start < end) and (start is None or month_end > start):
+                engines.append(self._engine_for(name))
+        frames = [FrameReader(engine).read("ais", columns=columns, filters=filters) for engine in engines]
+        return pd.concat(frames, ignore_index=True)
+
+    def detach(self, month: Union[datetime, str], archive_dir: Optional[Path] = None, compress: bool = False) -> Path:
+        """
+        Unregister a partition and move its file out of the way; the main database is not touched.
+
+        Args:
+            month: Any datetime in the month, or "YYYY-MM".
+            archive_dir (Path, optional): Destination directory. Defaults to `<partition_dir>/archive`.
+            compress (bool): Gzip the archived file.
+
+        Returns:
+            Path: Location of the archived file.
+        """
+        name = partition_name(month)
+        self.refresh(strict=False)
+        if name not in self._registry:
+            raise ValueError(f"No AIS partition for {name[4:].replace('_', '-')}")
+        path = Path(self._registry[name][2])
+
+        with self.engine.begin() as conn:
+            conn.execute(AISPartition.__table__.delete().where(AISPartition.schema_name == name))
+        self.refresh(strict=False)
+        with self._lock:
+            engine = self._engines.pop(name, None)
+        if engine is not None:
+            engine.dispose()
+        # Idle pooled connections still hold the file; reopen them. Checked-out ones detach on their next checkout.
+        self.engine.dispose()
+        self.read_engine.dispose()
+
+        archive_dir = Path(archive_dir) if archive_dir else self.partition_dir / "archive"
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        if compress:
+            target = archive_dir / f"{path.name}.gz"
+            with open(path, "rb") as source, gzip.open(target, "wb") as sink:
+                shutil.copyfileobj(source, sink)
+            path.unlink()
+        else:
+            target = archive_dir / path.name
+            shutil.move(str(path), target)
+        return target
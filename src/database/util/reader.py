@@ -0,0 +1,220 @@
+"""
+Typed, projected and optionally chunked DataFrame reads of tables and views.
+"""
+
+from __future__ import annotations
+
+import json
+from contextlib import nullcontext
+from functools import partial
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+from sqlalchemy import JSON, DateTime, Float, Integer, String, Text, column, select, table, type_coerce
+
+from database.util.base import Base
+
+# Low-cardinality text columns returned as pandas categoricals.
+CATEGORICAL_COLUMNS = {"constellation", "status", "sensor_mode", "product_type", "processing_level", "obj_class", "type"}
+
+_OPERATORS = {
+    "==": lambda c, v: c == v,
+    "!=": lambda c, v: c != v,
+    "<": lambda c, v: c < v,
+    "<=": lambda c, v: c <= v,
+    ">": lambda c, v: c > v,
+    ">=": lambda c, v: c >= v,
+    "in": lambda c, v: c.in_(list(v)),
+    "not in": lambda c, v: c.not_in(list(v)),
+    "between": lambda c, v: c.between(*v),
+    "like": lambda c, v: c.like(v),
+    "is null": lambda c, v: c.is_(None),
+    "is not null": lambda c, v: c.is_not(None),
+}
+
+Filters = Union[Dict[str, Any], Sequence[Tuple[str, str, Any]]]
+
+
+class LazyJSON:
+    """
+    A JSON document kept as text until `.value` is first read.
+    """
+
+    __slots__ = ("raw", "_value", "_decoded")
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        self._decoded = False
+
+    @property
+    def value(self) -> Any:
+        if not self._decoded:
+            self._value = json.loads(self.raw)
+            self._decoded = True
+        return self._value
+
+    def __eq__(self, other):
+        return self.value == (other.value if isinstance(other, LazyJSON) else other)
+
+    def __repr__(self):
+        return f"LazyJSON({self.raw[:60]!r}{'...' if len(self.raw) > 60 else ''})"
+
+
+def _declared_type(declared: str):
+    declared = declared.upper()
+    if "INT" in declared:
+        return Integer()
+    if any(name in declared for name in ("FLOAT", "REAL", "DOUBLE", "NUMERIC")):
+        return Float()
+    if "DATETIME" in declared or "TIMESTAMP" in declared:
+        return DateTime()
+    if declared == "JSON":
+        return JSON()
+    return String()
+
+
+class FrameReader:
+    def __init__(self, engine):
+        """
+        Read tables and views into DataFrames with proper dtypes.
+
+        Args:
+            engine: SQLAlchemy engine used for reading.
+        """
+        self.engine = engine
+        self._views: Dict[str, Any] = {}
+
+    def _source(self, name: str, conn=None):
+        if name in Base.metadata.tables:
+            return Base.metadata.tables[name]
+        if name not in self._views:
+            with nullcontext(conn) if conn is not None else self.engine.connect() as conn:
+                info = conn.exec_driver_sql(f"PRAGMA table_info({name})").fetchall()
+            if not info:
+                raise ValueError(f"No table or view named '{name}'")
+            # Columns belong to exactly one TableClause, so the clause itself is cached.
+            self._views[name] = table(name, *(column(row[1], _declared_type(row[2] or "")) for row in info))
+        return self._views[name]
+
+    @staticmethod
+    def _conditions(source, filters: Optional[Filters]) -> list:
+        if not filters:
+            return []
+        if isinstance(filters, dict):
+            filters = [(name, "in" if isinstance(value, (list, tuple, set)) else "==", value) for name, value in filters.items()]
+        conditions = []
+        for name, op, value in filters:
+            if name not in source.c:
+                raise ValueError(f"Unknown filter column '{name}' for '{source.name}'")
+            if op not in _OPERATORS:
+                raise ValueError(f"Unknown filter operator '{op}'. Choose one of {list(_OPERATORS)}")
+            conditions.append(_OPERATORS[op](source.c[name], value))
+        return conditions
+
+    def read(
+        self,
+        name: str,
+        columns: Optional[Sequence[str]] = None,
+        filters: Optional[Filters] = None,
+        chunksize: Optional[int] = None,
+        dtype_backend: Optional[str] = None,
+        json_columns: str = "decode",
+        order_by: Optional[str] = None,
+    ) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+        """
+        Read a table or view into DataFrames with datetime, float, integer and categorical dtypes.
+
+        Args:
+            name (str): Table or view name.
+            columns (sequence, optional): Columns to select. Defaults to all.
+            filters: Either {column: value} (lists mean IN) or [(column, operator, value), ...] with
+                operators "==", "!=", "<", "<=", ">", ">=", "in", "not in", "between", "like",
+                "is null" and "is not null". Conditions are combined with AND.
+            chunksize (int, optional): Yield DataFrames of at most this many rows instead of one frame.
+            dtype_backend (str, optional): "pyarrow" for Arrow-backed columns (requires pyarrow).
+            json_columns (str): "decode" (default) parses JSON columns, "raw" keeps the text and "lazy"
+                wraps it in LazyJSON, parsed on first access to `.value`.
+            order_by (str, optional): Column to sort by.
+
+        Returns:
+            pd.DataFrame, or an iterator of DataFrames when `chunksize` is given.
+        """
+        statement, convert = self._plan(name, columns, filters, dtype_backend, json_columns, order_by)
+        if chunksize is None:
+            with self.engine.connect() as conn:
+                return convert(pd.read_sql(statement, conn))
+        return self._iter_chunks(statement, chunksize, convert)
+
+    def read_on(self, conn, name: str, **options) -> pd.DataFrame:
+        """
+        `read` into one DataFrame on an open connection, e.g. the sync side of an async one.
+        """
+        statement, convert = self._plan(name, conn=conn, **options)
+        return convert(pd.read_sql(statement, conn))
+
+    def _plan(
+        self,
+        name: str,
+        columns: Optional[Sequence[str]] = None,
+        filters: Optional[Filters] = None,
+        dtype_backend: Optional[str] = None,
+        json_columns: str = "decode",
+        order_by: Optional[str] = None,
+        conn=None,
+    ):
+        # The SELECT of `read` and the function converting its frames.
+        if json_columns not in ("lazy", "raw", "decode"):
+            raise ValueError("json_columns must be 'lazy', 'raw' or 'decode'")
+        source = self._source(name, conn)
+        names = list(columns) if columns else [c.name for c in source.c]
+        unknown = set(names) - set(source.c.keys())
+        if unknown:
+            raise ValueError(f"Unknown columns for '{name}': {sorted(unknown)}")
+
+        selected, json_names = [], []
+        for col_name in names:
+            col = source.c[col_name]
+            if isinstance(col.type, JSON) and json_columns != "decode":
+                selected.append(type_coerce(col, Text).label(col_name))  # skip the eager JSON result processor
+                json_names.append(col_name)
+            else:
+                selected.append(col)
+        statement = select(*selected)
+        conditions = self._conditions(source, filters)
+        if conditions:
+            statement = statement.where(*conditions)
+        if order_by is not None:
+            statement = statement.order_by(source.c[order_by])
+
+        convert = partial(
+            self._convert,
+            types={c.name: c.type for c in source.c},
+            lazy_json=json_names if json_columns == "lazy" else [],
+            dtype_backend=dtype_backend,
+        )
+        return statement, convert
+
+    def _iter_chunks(self, statement, chunksize: int, convert) -> Iterator[pd.DataFrame]:
+        with self.engine.connect() as conn:
+            for chunk in pd.read_sql(statement, conn, chunksize=chunksize):
+                if not chunk.empty:
+                    yield convert(chunk)
+
+    @staticmethod
+    def _convert(frame: pd.DataFrame, types: dict, lazy_json: Sequence[str], dtype_backend: Optional[str]) -> pd.DataFrame:
+        for name in frame.columns:
+            column_type = types.get(name)
+            if isinstance(column_type, DateTime):
+                frame[name] = pd.to_datetime(frame[name], format="ISO8601")
+            elif isinstance(column_type, Float):
+                frame[name] = pd.to_numeric(frame[name]).astype("float64")
+            elif isinstance(column_type, Integer):
+                frame[name] = pd.to_numeric(frame[name]).astype("Int64")
+            elif name in CATEGORICAL_COLUMNS:
+                frame[name] = frame[name].astype("category")
+        for name in lazy_json:
+            frame[name] = frame[name].map(LazyJSON, na_action="ignore")
+        if dtype_backend is not None:
+            # Keep float columns floating even when all values happen to be integral.
+            frame = frame.convert_dtypes(dtype_backend=dtype_backend, convert_integer=False)
+        return frame
@@ -0,0 +1,232 @@
+"""
+Catalogue search results cached in the database.
+
+`SearchCache.search(query, fetch)` takes the query dict of `QueryManager.record_query`
+(constellation, geometry_wkt, start_date, end_date, parameters) and only calls `fetch(query)`,
+the remote catalogue, when the database cannot answer it:
+
+- an unexpired search with the same normalized query returns its products unchanged;
+- an unexpired search with the same constellation and parameters whose geometry covers the AOI
+  (see database.util.footprints) and whose dates contain the window answers a narrower search:
+  its products are filtered to the window and AOI.
+
+Fetched results are stored with the `query_history` row recording the search and expire after
+the TTL. Products without an acquisition time or footprint are kept by narrower searches, as
+they cannot be ruled out.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from sqlalchemy import delete, insert, or_, select
+from sqlalchemy.dialects.sqlite import insert as upsert
+
+from database.util.footprints import _as_json, intersects, parse_footprint
+from database.util.managers import QueryManager
+from database.util.tables import CachedSearch, ProductQueryHistory
+
+
+def _utc(value: Any) -> Optional[datetime]:
+    # Naive UTC, as SQLAlchemy stores DateTime columns in SQLite.
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    elif not isinstance(value, datetime) and isinstance(value, date):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _parameters(parameters: Optional[Dict[str, Any]]) -> str:
+    return json.dumps(parameters or {}, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def normalize_query(query: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """
+    The parts of a search that decide its results, in canonical form.
+
+    Constellation names are upper-cased, geometries re-serialized from their parsed
+    coordinates (so WKT spacing or a coordinate list do not matter), dates converted to
+    naive UTC and parameters dumped with sorted keys.
+    """
+    geometry = parse_footprint(query.get("geometry_wkt"))
+    start, end = _utc(query.get("start_date")), _utc(query.get("end_date"))
+    return {
+        "constellation": str(query.get("constellation") or "").strip().upper(),
+        "geometry": _as_json(geometry) if geometry else str(query.get("geometry_wkt") or "").strip(),
+        "start_date": start.isoformat() if start else None,
+        "end_date": end.isoformat() if end else None,
+        "parameters": _parameters(query.get("parameters")),
+    }
+
+
+def query_key(query: Dict[str, Any]) -> str:
+    """
+    sha256 of the normalized query.
+    """
+    return hashlib.sha256(json.dumps(normalize_query(query), sort_keys=True).encode()).hexdigest()
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if hasattr(value, "item"):  # numpy scalars
+        return value.item()
+    return str(value)
+
+
+def _decode_object(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 1 and "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+def _dump_products(products: Sequence[Dict[str, Any]]) -> str:
+    return json.dumps(list(products), default=_encode_value, separators=(",", ":"))
+
+
+def _load_products(raw: str) -> List[Dict[str, Any]]:
+    return json.loads(raw, object_hook=_decode_object)
+
+
+class SearchCache:
+    # Product dict keys, as DownloadManager.download_row reads them.
+    time_field = "acqusition_time"
+    footprint_field = "coordinates"
+
+    def __init__(self, db_handler, ttl_s: float = 86_400.0):
+        """
+        Answer catalogue searches from earlier results stored in the database.
+
+        Args:
+            db_handler (DatabaseHandler): Handler of the database.
+            ttl_s (float): Seconds a stored result stays valid.
+        """
+        self.db_handler = db_handler
+        self.ttl = timedelta(seconds=ttl_s)
+        self.hits = 0
+        self.subsumed = 0
+        self.misses = 0
+
+    def search(self, query: Dict[str, Any], fetch: Callable[[Dict[str, Any]], Sequence[Dict[str, Any]]], refresh: bool = False) -> List[Dict[str, Any]]:
+        """
+        The products of a search, from the cache when possible and from `fetch` otherwise.
+
+        Args:
+            query (dict): See `QueryManager.record_query`.
+            fetch (callable): Runs the search against the catalogue; returns product dicts.
+            refresh (bool): Skip the cache lookup and store a fresh result.
+
+        Returns:
+            list: Product dicts.
+        """
+        products = None if refresh else self.get(query)
+        if products is not None:
+            return products
+        products = list(fetch(query))
+        if not self.db_handler.read_only:
+            self.put(query, products)
+        return products
+
+    def get(self, query: Dict[str, Any], now: Optional[datetime] = None) -> Optional[List[dict]]:
+        """
+        Cached products of a search, or None when no unexpired result answers it.
+        """
+        now = _utc(now) or datetime.utcnow()
+        normalized = normalize_query(query)
+        table = CachedSearch.__table__
+        with self.db_handler.read_engine.connect() as conn:
+            raw = conn.execute(select(table.c.products).where(table.c.key == query_key(query), table.c.expires_at > now)).scalar()
+            if raw is not None:
+                self.hits += 1
+                return _load_products(raw)
+
+            start, end = _utc(query.get("start_date")), _utc(query.get("end_date"))
+            # A missing date is an open window, which only a cached open window contains.
+            conditions = [
+                table.c.constellation == normalized["constellation"],
+                table.c.parameters == normalized["parameters"],
+                table.c.expires_at > now,
+                or_(table.c.start_date.is_(None), table.c.start_date <= start) if start else table.c.start_date.is_(None),
+                or_(table.c.end_date.is_(None), table.c.end_date >= end) if end else table.c.end_date.is_(None),
+            ]
+            candidates = conn.execute(select(table.c.key, table.c.query_id).where(*conditions).order_by(table.c.created_at.desc())).all()
+        aoi = parse_footprint(query.get("geometry_wkt"))
+        if candidates and aoi:
+            covering = set(self.db_handler.footprints.search("query", aoi, "covers"))
+            for key, query_id in candidates:
+                if query_id in covering:
+                    with self.db_handler.read_engine.connect() as conn:
+                        raw = conn.execute(select(table.c.products).where(table.c.key == key)).scalar()
+                    self.subsumed += 1
+                    return self._narrow(_load_products(raw), aoi, start, end)
+        self.misses += 1
+        return None
+
+    def _narrow(self, products: List[dict], aoi, start: Optional[datetime], end: Optional[datetime]) -> List[dict]:
+        kept = []
+        for product in products:
+            try:
+                acquired = _utc(product.get(self.time_field))
+            except (TypeError, ValueError):
+                acquired = None
+            if acquired is not None and ((start and acquired < start) or (end and acquired > end)):
+                continue
+            footprint = parse_footprint(product.get(self.footprint_field))
+            if footprint is not None and not intersects(aoi, footprint):
+                continue
+            kept.append(product)
+        return kept
+
+    def put(self, query: Dict[str, Any], products: Sequence[Dict[str, Any]], now: Optional[datetime] = None) -> str:
+        """
+        Record a search and store its products, replacing an earlier result of the same query.
+
+        Expired results are evicted in the same transaction.
+
+        Returns:
+            str: ID of the `query_history` row.
+        """
+        now = _utc(now) or datetime.utcnow()
+        normalized = normalize_query(query)
+        history = QueryManager.query_row(query)
+        row = {
+            "key": query_key(query),
+            "query_id": history["id"],
+            "constellation": normalized["constellation"],
+            "parameters": normalized["parameters"],
+            "start_date": _utc(query.get("start_date")),
+            "end_date": _utc(query.get("end_date")),
+            "created_at": now,
+            "expires_at": now + self.ttl,
+            "num_products": len(products),
+            "products": _dump_products(products),
+        }
+        table = CachedSearch.__table__
+        statement = upsert(table)
+        statement = statement.on_conflict_do_update(index_elements=["key"], set_={name: statement.excluded[name] for name in row if name != "key"})
+        with self.db_handler.engine.begin() as conn:
+            conn.execute(insert(ProductQueryHistory.__table__), history)
+            conn.execute(statement, row)
+            conn.execute(delete(table).where(table.c.expires_at <= now))
+        return history["id"]
+
+    def evict_expired(self, now: Optional[datetime] = None) -> int:
+        """
+        Delete expired results; their `query_history` rows stay.
+
+        Returns:
+            int: Number of results deleted.
+        """
+        table = CachedSearch.__table__
+        with self.db_handler.engine.begin() as conn:
+            return conn.execute(delete(table).where(table.c.expires_at <= (_utc(now) or datetime.utcnow()))).rowcount
+
+    def info(self) -> Dict[str, int]:
+        return {"hits": self.hits, "subsumed": self.subsumed, "misses": self.misses}
@@ -0,0 +1,118 @@
+"""
+Bulk serialization of query results for list APIs.
+
+Rows are converted with accessors computed once per result (or per model class) instead of
+reading the attributes one by one for every row as `BaseMixin.as_dict` does, and `list_rows` reads with
+Core, without building ORM instances at all. Heavy columns (see `database.util.base.heavy`)
+are only read when asked for.
+"""
+
+from __future__ import annotations
+
+from operator import attrgetter
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import inspect, select
+
+from database.util.base import column_keys
+from database.util.reader import Filters, FrameReader
+
+SHAPES = ("dicts", "tuples", "records")
+
+
+def heavy_columns(model) -> List[str]:
+    """
+    Table column names of the deferred (heavy) attributes of a model.
+    """
+    return [attr.columns[0].name for attr in inspect(model).column_attrs if attr.deferred]
+
+
+def serialize_rows(result, shape: str = "dicts"):
+    """
+    Convert a Core result (or rows with `keys`) in one pass.
+
+    Args:
+        result: A `Result`, e.g. from `conn.execute(select(...))`.
+        shape (str): "dicts" (list of dicts), "tuples" (list of tuples) or "records"
+            (a numpy record array with the column names as fields).
+
+    Returns:
+        The rows in the requested shape.
+    """
+    if shape not in SHAPES:
+        raise ValueError(f"Unknown shape '{shape}'. Choose one of {list(SHAPES)}")
+    keys = tuple(result.keys())
+    if shape == "dicts":
+        return [dict(zip(keys, row)) for row in result]
+    rows = [tuple(row) for row in result]
+    if shape == "tuples":
+        return rows
+    if not rows:
+        return np.rec.array(np.empty(0, dtype=[(key, object) for key in keys]))
+    return np.rec.fromrecords(rows, names=list(keys))
+
+
+def as_dicts(instances: Iterable[Any]) -> List[Dict[str, Any]]:
+    """
+    `as_dict` of many ORM instances of one model, with one attribute getter for all rows.
+
+    Unlike `as_dict`, heavy columns are not loaded row by row: they are included only when
+    loaded on the first instance (e.g. `undefer_heavy()`).
+    """
+    instances = list(instances)
+    if not instances:
+        return []
+    first = instances[0]
+    keys = tuple(key for key, is_deferred in column_keys(type(first)) if not is_deferred or key in first.__dict__)
+    getter = attrgetter(*keys)
+    if len(keys) == 1:
+        return [{keys[0]: getter(instance)} for instance in instances]
+    return [dict(zip(keys, getter(instance))) for instance in instances]
+
+
+def list_rows(
+    engine,
+    model,
+    filters: Optional[Filters] = None,
+    columns: Optional[Sequence[str]] = None,
+    heavy: bool = False,
+    order_by: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    shape: str = "dicts",
+):
+    """
+    Read rows of a model's table with Core and serialize them in bulk.
+
+    Args:
+        engine: Engine to read with.
+        model: Mapped class, e.g. ObjectRecord.
+        filters: See `FrameReader.read`.
+        columns (sequence, optional): Table columns to return. Defaults to all but the heavy ones.
+        heavy (bool): Also return the heavy columns when `columns` is not given.
+        order_by (str, optional): Column to sort by; give one for stable pages.
+        limit (int, optional): Most rows returned.
+        offset (int): Rows skipped first.
+        shape (str): See `serialize_rows`.
+    """
+    table = model.__table__
+    if columns is None:
+        skipped = set() if heavy else set(heavy_columns(model))
+        columns = [name for name in table.c.keys() if name not in skipped]
+    unknown = set(columns) - set(table.c.keys())
+    if unknown:
+        raise ValueError(f"Unknown columns for '{table.name}': {sorted(unknown)}")
+
+    statement = select(*(table.c[name] for name in columns))
+    conditions = FrameReader._conditions(table, filters)
+    if conditions:
+        statement = statement.where(*conditions)
+    if order_by is not None:
+        statement = statement.order_by(table.c[order_by])
+    if limit is not None:
+        statement = statement.limit(limit)
+    if offset:
+        statement = statement.offset(offset)
+    with engine.connect() as conn:
+        return serialize_rows(conn.execute(statement), shape)
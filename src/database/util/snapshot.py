@@ -0,0 +1,209 @@
+"""
+Consistent, read-optimised snapshots of the live database for serving (e.g. datasette).
+
+The live file is copied with SQLite's online backup API, which reads a consistent state
+without blocking writers in WAL mode. The copy is finished off-line (rollback journal,
+serving indexes, ANALYZE) and then swapped into the served path with `os.replace`, so a
+reader opens either the previous or the new snapshot, never a partial one. The chip pack of
+the database (see database.util.chips) is published next to the snapshot first.
+
+    python -m database.util.snapshot data/downloads.db /srv/datasette/downloads.db --every 300
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from database.util.chips import pack_path, publish_pack
+
+# Indexes for browsing/faceting that the writers do not need (and should not maintain).
+SERVING_INDEXES: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("images", ("constellation",)),
+    ("detections", ("timestamp",)),
+    ("objects", ("obj_class",)),
+    ("objects", ("is_dark",)),
+    ("ais", ("mmsi",)),
+    ("downloads", ("ingestion_time",)),
+    ("query_history", ("timestamp",)),
+)
+
+
+class _BackupRestartedError(Exception):
+    pass
+
+
+class SnapshotPublisher:
+    def __init__(
+        self,
+        db_path: Path,
+        target: Path,
+        pages_per_step: int = 4096,
+        step_sleep: float = 0.005,
+        max_restarts: int = 3,
+        serving_indexes: Sequence[Tuple[str, Tuple[str, ...]]] = SERVING_INDEXES,
+        chip_pack: Optional[Path] = None,
+    ):
+        """
+        Publish snapshots of `db_path` to `target`.
+
+        Args:
+            db_path (Path): The live database.
+            target (Path): The served file; replaced atomically on every publish.
+            pages_per_step (int): Pages copied per backup step with `incremental=True`.
+            step_sleep (float): Seconds between incremental steps, leaving room for checkpoints.
+            max_restarts (int): Incremental copies restarted by concurrent writes before
+                falling back to a single-step copy.
+            serving_indexes: (table, columns) indexes to add to the snapshot.
+            chip_pack (Path, optional): Chip pack of the live database. Defaults to `pack_path(db_path)`;
+                published to `pack_path(target)`.
+        """
+        self.db_path = Path(db_path)
+        self.target = Path(target)
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self.max_restarts = max_restarts
+        self.serving_indexes = tuple(serving_indexes)
+        self.chip_pack = Path(chip_pack) if chip_pack else pack_path(self.db_path)
+
+    @property
+    def staging(self) -> Path:
+        # Same directory as the target, so os.replace is an atomic rename.
+        return self.target.with_name(f".{self.target.name}.staging")
+
+    def publish(self, incremental: bool = False, vacuum: bool = False) -> Dict[str, float]:
+        """
+        Copy the live database, prepare the copy for serving and swap it into `target`.
+
+        Args:
+            incremental (bool): Copy `pages_per_step` pages per step instead of in one read
+                transaction. The live database's checkpoints can proceed between steps; a
+                write from another connection restarts the copy.
+            vacuum (bool): Also VACUUM the copy (smaller file, slower publish).
+
+        Returns:
+            dict: `pages`, `restarts`, `size_mb` and the `backup_s`, `prepare_s` and total `seconds`.
+        """
+        if not self.db_path.exists():
+            raise FileNotFoundError(self.db_path)
+        started = time.perf_counter()
+        self.target.parent.mkdir(parents=True, exist_ok=True)
+        self._remove_staging()
+
+        pages, restarts = self._backup(incremental)
+        backed_up = time.perf_counter()
+        self._prepare(vacuum)
+        prepared = time.perf_counter()
+
+        with open(self.staging, "rb") as handle:
+            os.fsync(handle.fileno())
+        publish_pack(self.chip_pack, pack_path(self.target))  # before the snapshot that references it
+        os.replace(self.staging, self.target)
+        return {
+            "pages": pages,
+            "restarts": restarts,
+            "size_mb": self.target.stat().st_size / 1024**2,
+            "backup_s": backed_up - started,
+            "prepare_s": prepared - backed_up,
+            "seconds": time.perf_counter() - started,
+        }
+
+    def _remove_staging(self):
+        for suffix in ("", "-journal", "-wal", "-shm"):
+            Path(f"{self.staging}{suffix}").unlink(missing_ok=True)
+
+    def _backup(self, incremental: bool) -> Tuple[int, int]:
+        source = sqlite3.connect(f"{self.db_path.resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            restarts = 0
+            if incremental:
+                progress = {"remaining": None}
+
+                def on_step(status, remaining, total):
+                    nonlocal restarts
+                    if progress["remaining"] is not None and remaining > progress["remaining"]:
+                        restarts += 1
+                        if restarts > self.max_restarts:
+                            raise _BackupRestartedError()
+                    progress["remaining"] = remaining
+
+                target = sqlite3.connect(self.staging)
+                try:
+                    source.backup(target, pages=self.pages_per_step, progress=on_step, sleep=self.step_sleep)
+                except _BackupRestartedError:
+                    incremental = False
+                finally:
+                    target.close()
+                if not incremental:
+                    self._remove_staging()
+            if not incremental:
+                target = sqlite3.connect(self.staging)
+                source.backup(target)  # one step: a single read transaction on the source
+                target.close()
+            pages = source.execute("PRAGMA page_count").fetchone()[0]
+        finally:
+            source.close()
+        return pages, restarts
+
+    def _prepare(self, vacuum: bool):
+        conn = sqlite3.connect(self.staging, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode = DELETE")  # served read-only/immutable: no -wal/-shm files
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for table, columns in self.serving_indexes:
+                existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")} if table in tables else set()
+                if set(columns) <= existing:
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS serve_{table}_{'_'.join(columns)} ON {table} ({', '.join(columns)})")
+            if vacuum:
+                conn.execute("VACUUM")
+            conn.execute("ANALYZE")
+        finally:
+            conn.close()
+
+    def run_forever(self, every: float, incremental: bool = False, vacuum: bool = False):
+        """
+        Publish every `every` seconds, skipping rounds in which the live database did not change.
+        """
+        last: Optional[Tuple[int, ...]] = None
+        while True:
+            state = self._source_state()
+            if state != last or not self.target.exists():
+                stats = self.publish(incremental=incremental, vacuum=vacuum)
+                print(f"published {self.target} ({stats['size_mb']:.1f} MB, {stats['seconds']:.1f} s)", flush=True)
+                last = state
+            time.sleep(every)
+
+    def _source_state(self) -> Tuple[int, ...]:
+        # The -wal file changes on every commit; the main file on checkpoints.
+        state: List[int] = []
+        for suffix in ("", "-wal"):
+            path = Path(f"{self.db_path}{suffix}")
+            stat = path.stat() if path.exists() else None
+            state += [stat.st_mtime_ns, stat.st_size] if stat else [0, 0]
+        return tuple(state)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Publish a consistent, indexed snapshot of a live database.")
+    parser.add_argument("source", type=Path, help="The live database.")
+    parser.add_argument("target", type=Path, help="The served snapshot, replaced atomically.")
+    parser.add_argument("--incremental", action="store_true", help="Copy in steps instead of one read transaction.")
+    parser.add_argument("--vacuum", action="store_true")
+    parser.add_argument("--every", type=float, help="Keep publishing every this many seconds.")
+    args = parser.parse_args(argv)
+
+    publisher = SnapshotPublisher(args.source, args.target)
+    if args.every:
+        publisher.run_forever(args.every, incremental=args.incremental, vacuum=args.vacuum)
+    stats = publisher.publish(incremental=args.incremental, vacuum=args.vacuum)
+    print(f"published {args.target} ({stats['size_mb']:.1f} MB, {stats['seconds']:.1f} s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+from datetime import datetime
+from typing import Optional, Sequence, Tuple
+
+import pandas as pd
+from sqlalchemy import DateTime, bindparam, text
+
+# Tables with point latitude/longitude columns and the column used for time filtering.
+# Objects carry no time of their own; they are filtered on the acquisition time of their image.
+SPATIAL_TABLES = {
+    "images": "acquisition_time",
+    "detections": "timestamp",
+    "ais": "timestamp",
+    "objects": None,
+    "downloads": "acqusition_time",
+}
+
+
+class SpatialIndex:
+    def __init__(self, engine, read_engine=None):
+        """
+        Keep SQLite R*Tree indexes over the point tables in sync and query them.
+
+        Every table in SPATIAL_TABLES gets a `<table>_rtree` virtual table keyed on the rowid of
+        the base table and maintained by insert/update/delete triggers. VACUUM may renumber the
+        rowids of tables without an INTEGER PRIMARY KEY, so run `rebuild()` after a VACUUM.
+
+        Args:
+            engine: SQLAlchemy engine for database connection.
+            read_engine: Engine used for queries; defaults to `engine`.
+        """
+        self.engine = engine
+        self.read_engine = read_engine or engine
+        self._views: dict = {}  # table -> whether it is a compact view over `<table>_data`
+
+    def _is_compact_view(self, conn, table: str) -> bool:
+        if table not in self._views:
+            kind = conn.execute(text("SELECT type FROM sqlite_master WHERE name = :name"), {"name": table}).scalar()
+            self._views[table] = kind == "view"
+        return self._views[table]
+
+    @staticmethod
+    def _statements(table: str, source: Optional[str] = None) -> list:
+        # `source` is the table holding the rows when `table` is a view over it (database.util.compact).
+        rtree = f"{table}_rtree"
+        source = source or table
+        return [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {rtree} USING rtree(id, min_lon, max_lon, min_lat, max_lat)",
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {rtree}_insert AFTER INSERT ON {source}
+            WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL
+            BEGIN
+                INSERT OR REPLACE INTO {rtree} VALUES (new.rowid, new.longitude, new.longitude, new.latitude, new.latitude);
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {rtree}_update AFTER UPDATE OF latitude, longitude ON {source}
+            BEGIN
+                DELETE FROM {rtree} WHERE id = old.rowid;
+                INSERT INTO {rtree}
+                SELECT new.rowid, new.longitude, new.longitude, new.latitude, new.latitude
+                WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+            END
+            """,
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {rtree}_delete AFTER DELETE ON {source}
+            BEGIN
+                DELETE FROM {rtree} WHERE id = old.rowid;
+            END
+            """,
+        ]
+
+    @classmethod
+    def _all_statements(cls) -> list:
+        return [statement for table in SPATIAL_TABLES for statement in cls._statements(table)]
+
+    def _create_spatial_index(self):
+        with self.engine.begin() as conn:
+            existing = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+            for table in SPATIAL_TABLES:
+                for statement in self._statements(table):
+                    conn.execute(text(statement))
+                if f"{table}_rtree" not in existing:
+                    # Index rows written before the R*Tree existed.
+                    self._fill(conn, table)
+
+    @staticmethod
+    def _fill(conn, table: str, source: Optional[str] = None):
+        conn.execute(
+            text(
+                f"""
+            INSERT INTO {table}_rtree
+            SELECT rowid, longitude, longitude, latitude, latitude FROM {source or table}
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        """
+            )
+        )
+
+    def rebuild(self, tables: Optional[Sequence[str]] = None):
+        """
+        Repopulate the R*Tree indexes from their base tables, e.g. after a VACUUM.
+
+        Args:
+            tables (sequence, optional): Tables to rebuild. Defaults to all spatial tables.
+        """
+        with self.engine.begin() as conn:
+            for table in tables or SPATIAL_TABLES:
+                self._check_table(table)
+                conn.execute(text(f"DELETE FROM {table}_rtree"))
+                self._fill(conn, table, source=f"{table}_data" if self._is_compact_view(conn, table) else None)
+
+    @staticmethod
+    def _check_table(table: str):
+        if table not in SPATIAL_TABLES:
+            raise ValueError(f"Table '{table}' has no spatial index. Choose one of {list(SPATIAL_TABLES)}")
+
+    def query_bbox(
+        self,
+        table: str,
+        bbox: Tuple[float, float, float, float],
+        time_range: Optional[Tuple[Optional[datetime], Optional[datetime]]] = None,
+    ) -> pd.DataFrame:
+        """
+        Return the rows of `table` whose point lies inside `bbox`.
+
+        Args:
+            table (str): One of SPATIAL_TABLES.
+            bbox (tuple): (min_lon, min_lat, max_lon, max_lat) in degrees, inclusive.
+            time_range (tuple, optional): (start, end) datetimes, inclusive; either may be None.
+
+        Returns:
+            pd.DataFrame: Matching rows with all columns of `table`.
+        """
+        self._check_table(table)
+        min_lon, min_lat, max_lon, max_lat = bbox
+        if min_lon > max_lon or min_lat > max_lat:
+            raise ValueError("bbox must be (min_lon, min_lat, max_lon, max_lat)")
+
+        with self.read_engine.connect() as conn:
+            # Compact views expose the key of their `_data` table, which the R*Tree holds, as `id`.
+            key = "id" if self._is_compact_view(conn, table) else "rowid"
+
+        # The R*Tree stores 32-bit floats with outward rounding, so re-check the exact coordinates.
+        sql = f"""
+            SELECT t.* FROM {table}_rtree r
+            JOIN {table} t ON t.{key} = r.id
+        """
+        time_column = SPATIAL_TABLES[table]
+        if time_range is not None and time_column is None:
+            sql += " JOIN images i ON i.id = t.image_id"
+            time_column = "i.acquisition_time"
+        elif time_column is not None:
+            time_column = f"t.{time_column}"
+        sql += """
+            WHERE r.min_lon <= :max_lon AND r.max_lon >= :min_lon
+              AND r.min_lat <= :max_lat AND r.max_lat >= :min_lat
+              AND t.longitude BETWEEN :min_lon AND :max_lon
+              AND t.latitude BETWEEN :min_lat AND :max_lat
+        """
+        params = {"min_lon": min_lon, "min_lat": min_lat, "max_lon": max_lon, "max_lat": max_lat}
+
+        statement = text(sql)
+        if time_range is not None:
+            start, end = time_range
+            if start is not None:
+                sql += f" AND {time_column} >= :start"
+                params["start"] = start
+            if end is not None:
+                sql += f" AND {time_column} <= :end"
+                params["end"] = end
+            statement = text(sql).bindparams(*(bindparam(k, type_=DateTime) for k in ("start", "end") if k in params))
+
+        with self.read_engine.connect() as conn:
+            return pd.read_sql(statement, conn, params=params)
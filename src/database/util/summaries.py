@@ -0,0 +1,373 @@
+"""
+Trigger-maintained summary tables behind the aggregate views.
+
+With `Settings.summary_tables` enabled, the views `detection_summary_<constellation>`,
+`object_summary_<constellation>`, `ais_summary_by_image`, `image_counts_by_constellation` and
+`download_summary_by_status` read from small summary tables instead of aggregating the base
+tables on every query. Triggers on the base tables keep the summaries current on every
+insert, update and delete; `SummaryTables.rebuild()` recomputes them from scratch.
+
+Averages are stored as running sums plus non-null counts. Grouping keys that may be NULL are
+stored as '' and turned back into NULL by the views.
+"""
+
+from sqlalchemy import text
+
+# Object columns averaged by object_summary_<constellation>.
+OBJECT_COLUMNS = ("length_min", "length_max", "speed_min", "speed_max", "distance_to_shore")
+
+SUMMARY_TABLES = (
+    "summary_detections",
+    "summary_detections_by_image",
+    "summary_objects",
+    "summary_objects_by_image",
+    "summary_ais_by_image",
+    "summary_image_counts",
+    "summary_downloads",
+)
+
+_OBJECT_SUMS = ", ".join(f"s_{c} REAL NOT NULL DEFAULT 0, c_{c} INTEGER NOT NULL DEFAULT 0" for c in OBJECT_COLUMNS)
+
+_TABLE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS summary_detections (
+        constellation TEXT PRIMARY KEY,
+        num_detections INTEGER NOT NULL DEFAULT 0,
+        num_images INTEGER NOT NULL DEFAULT 0,
+        sum_ship REAL NOT NULL DEFAULT 0,
+        cnt_ship INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS summary_detections_by_image (
+        constellation TEXT NOT NULL,
+        image_id TEXT NOT NULL,
+        num_detections INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (constellation, image_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_summary_detections_by_image_image_id ON summary_detections_by_image (image_id)",
+    f"""
+    CREATE TABLE IF NOT EXISTS summary_objects (
+        constellation TEXT PRIMARY KEY,
+        num_objects INTEGER NOT NULL DEFAULT 0,
+        {_OBJECT_SUMS}
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS summary_objects_by_image (
+        image_id TEXT PRIMARY KEY,
+        num_objects INTEGER NOT NULL DEFAULT 0,
+        {_OBJECT_SUMS}
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS summary_ais_by_image (
+        image_id TEXT PRIMARY KEY,
+        num_ais_records INTEGER NOT NULL DEFAULT 0,
+        earliest_ais_time DATETIME,
+        latest_ais_time DATETIME,
+        sum_speed REAL NOT NULL DEFAULT 0,
+        cnt_speed INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS summary_image_counts (
+        constellation TEXT PRIMARY KEY,
+        num_images INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS summary_downloads (
+        constellation TEXT NOT NULL,
+        status TEXT NOT NULL,
+        num_downloads INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (constellation, status)
+    )
+    """,
+]
+
+
+def _detection_delta(ref: str, sign: str) -> str:
+    # The per-image count is updated first, so a first (last) detection of an image is seen as 1 (0).
+    first = "1" if sign == "+" else "0"
+    object_sums = ",\n            ".join(
+        f"s_{c} = summary_objects.s_{c} {sign} a.s_{c}, c_{c} = summary_objects.c_{c} {sign} a.c_{c}" for c in OBJECT_COLUMNS
+    )
+    return f"""
+        INSERT INTO summary_detections (constellation) SELECT {ref}.constellation WHERE {ref}.constellation IS NOT NULL
+        ON CONFLICT (constellation) DO NOTHING;
+        INSERT INTO summary_objects (constellation) SELECT {ref}.constellation WHERE {ref}.constellation IS NOT NULL
+        ON CONFLICT (constellation) DO NOTHING;
+        INSERT INTO summary_detections_by_image (constellation, image_id)
+        SELECT {ref}.constellation, {ref}.image_id WHERE {ref}.constellation IS NOT NULL AND {ref}.image_id IS NOT NULL
+        ON CONFLICT (constellation, image_id) DO NOTHING;
+        UPDATE summary_detections_by_image SET num_detections = num_detections {sign} 1
+        WHERE constellation = {ref}.constellation AND image_id = {ref}.image_id;
+        UPDATE summary_detections SET
+            num_detections = num_detections {sign} 1,
+            num_images = num_images {sign} (
+                SELECT COUNT(*) FROM summary_detections_by_image
+                WHERE constellation = {ref}.constellation AND image_id = {ref}.image_id AND num_detections = {first}
+            ),
+            sum_ship = sum_ship {sign} IFNULL({ref}.num_ship_detections, 0),
+            cnt_ship = cnt_ship {sign} ({ref}.num_ship_detections IS NOT NULL)
+        WHERE constellation = {ref}.constellation;
+        UPDATE summary_objects SET
+            num_objects = summary_objects.num_objects {sign} a.num_objects,
+            {object_sums}
+        FROM summary_objects_by_image a
+        WHERE summary_objects.constellation = {ref}.constellation AND a.image_id = {ref}.image_id;
+        DELETE FROM summary_detections_by_image WHERE num_detections = 0;
+    """
+
+
+def _object_delta(ref: str, sign: str) -> str:
+    image_sums = ",\n            ".join(f"s_{c} = s_{c} {sign} IFNULL({ref}.{c}, 0), c_{c} = c_{c} {sign} ({ref}.{c} IS NOT NULL)" for c in OBJECT_COLUMNS)
+    pair_sums = ",\n            ".join(
+        f"s_{c} = summary_objects.s_{c} {sign} d.num_detections * IFNULL({ref}.{c}, 0), "
+        f"c_{c} = summary_objects.c_{c} {sign} d.num_detections * ({ref}.{c} IS NOT NULL)"
+        for c in OBJECT_COLUMNS
+    )
+    return f"""
+        INSERT INTO summary_objects_by_image (image_id) SELECT {ref}.image_id WHERE {ref}.image_id IS NOT NULL
+        ON CONFLICT (image_id) DO NOTHING;
+        UPDATE summary_objects_by_image SET
+            num_objects = num_objects {sign} 1,
+            {image_sums}
+        WHERE image_id = {ref}.image_id;
+        UPDATE summary_objects SET
+            num_objects = summary_objects.num_objects {sign} d.num_detections,
+            {pair_sums}
+        FROM summary_detections_by_image d
+        WHERE d.image_id = {ref}.image_id AND summary_objects.constellation = d.constellation;
+    """
+
+
+def _ais_insert(ref: str) -> str:
+    return f"""
+        INSERT INTO summary_ais_by_image (image_id) VALUES ({ref}.image_id) ON CONFLICT (image_id) DO NOTHING;
+        UPDATE summary_ais_by_image SET
+            num_ais_records = num_ais_records + 1,
+            earliest_ais_time = CASE WHEN {ref}.timestamp < earliest_ais_time OR earliest_ais_time IS NULL
+                THEN {ref}.timestamp ELSE earliest_ais_time END,
+            latest_ais_time = CASE WHEN {ref}.timestamp > latest_ais_time OR latest_ais_time IS NULL
+                THEN {ref}.timestamp ELSE latest_ais_time END,
+            sum_speed = sum_speed + IFNULL({ref}.speed, 0),
+            cnt_speed = cnt_speed + ({ref}.speed IS NOT NULL)
+        WHERE image_id = {ref}.image_id;
+    """
+
+
+def _ais_delete(ref: str) -> str:
+    # MIN/MAX cannot be decremented; look them up again (ix_ais_image_id_timestamp) only when the bound leaves.
+    return f"""
+        UPDATE summary_ais_by_image SET
+            num_ais_records = num_ais_records - 1,
+            earliest_ais_time = CASE WHEN {ref}.timestamp = earliest_ais_time
+                THEN (SELECT MIN(timestamp) FROM ais WHERE image_id = {ref}.image_id) ELSE earliest_ais_time END,
+            latest_ais_time = CASE WHEN {ref}.timestamp = latest_ais_time
+                THEN (SELECT MAX(timestamp) FROM ais WHERE image_id = {ref}.image_id) ELSE latest_ais_time END,
+            sum_speed = sum_speed - IFNULL({ref}.speed, 0),
+            cnt_speed = cnt_speed - ({ref}.speed IS NOT NULL)
+        WHERE image_id = {ref}.image_id;
+        DELETE FROM summary_ais_by_image WHERE image_id = {ref}.image_id AND num_ais_records = 0;
+    """
+
+
+def _image_delta(ref: str, sign: str) -> str:
+    return f"""
+        INSERT INTO summary_image_counts (constellation) VALUES (IFNULL({ref}.constellation, ''))
+        ON CONFLICT (constellation) DO NOTHING;
+        UPDATE summary_image_counts SET num_images = num_images {sign} 1 WHERE constellation = IFNULL({ref}.constellation, '');
+    """
+
+
+def _download_delta(ref: str, sign: str) -> str:
+    return f"""
+        INSERT INTO summary_downloads (constellation, status) VALUES (IFNULL({ref}.constellation, ''), IFNULL({ref}.status, ''))
+        ON CONFLICT (constellation, status) DO NOTHING;
+        UPDATE summary_downloads SET num_downloads = num_downloads {sign} 1
+        WHERE constellation = IFNULL({ref}.constellation, '') AND status = IFNULL({ref}.status, '');
+    """
+
+
+# table -> (columns whose update changes the summaries, insert body(ref), delete body(ref))
+_MAINTAINED = {
+    "detections": ("constellation, image_id, num_ship_detections", lambda r: _detection_delta(r, "+"), lambda r: _detection_delta(r, "-")),
+    "objects": ("image_id, " + ", ".join(OBJECT_COLUMNS), lambda r: _object_delta(r, "+"), lambda r: _object_delta(r, "-")),
+    "ais": ("image_id, timestamp, speed", _ais_insert, _ais_delete),
+    "images": ("constellation", lambda r: _image_delta(r, "+"), lambda r: _image_delta(r, "-")),
+    "downloads": ("constellation, status", lambda r: _download_delta(r, "+"), lambda r: _download_delta(r, "-")),
+}
+
+
+class SummaryTables:
+    def __init__(self, engine, satellite_config):
+        """
+        Create, maintain and rebuild the summary tables.
+
+        Args:
+            engine: SQLAlchemy engine for database connection.
+            satellite_config: Configuration dictionary for satellite constellations.
+        """
+        self.engine = engine
+        self.satellite_config = satellite_config
+
+    @staticmethod
+    def _trigger_statements() -> list:
+        statements = []
+        for table, (columns, on_insert, on_delete) in _MAINTAINED.items():
+            statements.append(f"CREATE TRIGGER IF NOT EXISTS {table}_summary_insert AFTER INSERT ON {table} BEGIN {on_insert('new')} END")
+            statements.append(f"CREATE TRIGGER IF NOT EXISTS {table}_summary_delete AFTER DELETE ON {table} BEGIN {on_delete('old')} END")
+            statements.append(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_summary_update AFTER UPDATE OF {columns} ON {table} "
+                f"BEGIN {on_delete('old')} {on_insert('new')} END"
+            )
+        return statements
+
+    @staticmethod
+    def _drop_trigger_statements() -> list:
+        return [f"DROP TRIGGER IF EXISTS {table}_summary_{event}" for table in _MAINTAINED for event in ("insert", "delete", "update")]
+
+    def _view_statements(self) -> list:
+        """
+        DROP/CREATE statements replacing the aggregate views with summary-table readers.
+        """
+        object_averages = ",\n                ".join(f"ROUND(s_{c} / NULLIF(c_{c}, 0), 2) AS avg_{c}" for c in OBJECT_COLUMNS)
+        statements = []
+        for name in self.satellite_config:
+            safe_name = name.lower().replace("-", "_")
+            statements += [
+                f"DROP VIEW IF EXISTS detection_summary_{safe_name}",
+                f"""
+                CREATE VIEW detection_summary_{safe_name} AS
+                SELECT
+                    constellation,
+                    num_detections,
+                    num_images,
+                    ROUND(sum_ship / NULLIF(cnt_ship, 0), 2) AS avg_detections_per_image
+                FROM summary_detections
+                WHERE constellation = '{name}' AND num_detections > 0
+                """,
+                f"DROP VIEW IF EXISTS object_summary_{safe_name}",
+                f"""
+                CREATE VIEW object_summary_{safe_name} AS
+                SELECT
+                    constellation,
+                    num_objects,
+                    {object_averages}
+                FROM summary_objects
+                WHERE constellation = '{name}' AND num_objects > 0
+                """,
+            ]
+        statements += [
+            "DROP VIEW IF EXISTS image_counts_by_constellation",
+            """
+            CREATE VIEW image_counts_by_constellation AS
+            SELECT NULLIF(constellation, '') AS constellation, num_images
+            FROM summary_image_counts
+            WHERE num_images > 0
+            """,
+            "DROP VIEW IF EXISTS download_summary_by_status",
+            """
+            CREATE VIEW download_summary_by_status AS
+            SELECT NULLIF(constellation, '') AS constellation, NULLIF(status, '') AS status, num_downloads
+            FROM summary_downloads
+            WHERE num_downloads > 0
+            """,
+            "DROP VIEW IF EXISTS ais_summary_by_image",
+            """
+            CREATE VIEW ais_summary_by_image AS
+            SELECT
+                i.id AS image_id,
+                i.constellation,
+                IFNULL(s.num_ais_records, 0) AS num_ais_records,
+                s.earliest_ais_time,
+                s.latest_ais_time,
+                s.sum_speed / NULLIF(s.cnt_speed, 0) AS avg_speed
+            FROM images i
+            LEFT JOIN summary_ais_by_image s ON s.image_id = i.id
+            """,
+        ]
+        return statements
+
+    def _statements(self) -> list:
+        return _TABLE_DDL + self._trigger_statements() + self._view_statements()
+
+    def _create_summaries(self):
+        """
+        Create the summary tables, triggers and views; fill the tables if they are new.
+        """
+        with self.engine.begin() as conn:
+            existing = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+            for statement in self._statements():
+                conn.execute(text(statement))
+            if not set(SUMMARY_TABLES) <= existing:
+                self._fill(conn)
+
+    def _drop_triggers(self):
+        """
+        Stop maintaining the summaries (the tables are kept and can be rebuilt later).
+        """
+        with self.engine.begin() as conn:
+            for statement in self._drop_trigger_statements():
+                conn.execute(text(statement))
+
+    def rebuild(self):
+        """
+        Recompute every summary table from the base tables, e.g. to repair drift after
+        rows were written with the triggers disabled.
+        """
+        with self.engine.begin() as conn:
+            self._fill(conn)
+
+    @staticmethod
+    def _fill(conn):
+        for table in SUMMARY_TABLES:
+            conn.execute(text(f"DELETE FROM {table}"))
+
+        object_sums = ", ".join(f"IFNULL(SUM({c}), 0), COUNT({c})" for c in OBJECT_COLUMNS)
+        object_columns = ", ".join(f"s_{c}, c_{c}" for c in OBJECT_COLUMNS)
+        pair_sums = ", ".join(f"SUM(d.num_detections * a.s_{c}), SUM(d.num_detections * a.c_{c})" for c in OBJECT_COLUMNS)
+        statements = [
+            """
+            INSERT INTO summary_detections (constellation, num_detections, num_images, sum_ship, cnt_ship)
+            SELECT constellation, COUNT(*), COUNT(DISTINCT image_id), IFNULL(SUM(num_ship_detections), 0), COUNT(num_ship_detections)
+            FROM detections WHERE constellation IS NOT NULL GROUP BY constellation
+            """,
+            """
+            INSERT INTO summary_detections_by_image (constellation, image_id, num_detections)
+            SELECT constellation, image_id, COUNT(*)
+            FROM detections WHERE constellation IS NOT NULL AND image_id IS NOT NULL GROUP BY constellation, image_id
+            """,
+            f"""
+            INSERT INTO summary_objects_by_image (image_id, num_objects, {object_columns})
+            SELECT image_id, COUNT(*), {object_sums}
+            FROM objects WHERE image_id IS NOT NULL GROUP BY image_id
+            """,
+            f"""
+            INSERT INTO summary_objects (constellation, num_objects, {object_columns})
+            SELECT d.constellation, SUM(d.num_detections * a.num_objects), {pair_sums}
+            FROM summary_detections_by_image d
+            JOIN summary_objects_by_image a ON a.image_id = d.image_id
+            GROUP BY d.constellation
+            """,
+            "INSERT OR IGNORE INTO summary_objects (constellation) SELECT constellation FROM summary_detections",
+            """
+            INSERT INTO summary_ais_by_image (image_id, num_ais_records, earliest_ais_time, latest_ais_time, sum_speed, cnt_speed)
+            SELECT image_id, COUNT(*), MIN(timestamp), MAX(timestamp), IFNULL(SUM(speed), 0), COUNT(speed)
+            FROM ais GROUP BY image_id
+            """,
+            """
+            INSERT INTO summary_image_counts (constellation, num_images)
+            SELECT IFNULL(constellation, ''), COUNT(*) FROM images GROUP BY IFNULL(constellation, '')
+            """,
+            """
+            INSERT INTO summary_downloads (constellation, status, num_downloads)
+            SELECT IFNULL(constellation, ''), IFNULL(status, ''), COUNT(*)
+            FROM downloads GROUP BY IFNULL(constellation, ''), IFNULL(status, '')
+            """,
+        ]
+        for statement in statements:
+            conn.execute(text(statement))
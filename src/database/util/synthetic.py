@@ -0,0 +1,236 @@
+"""
+Deterministic synthetic data for benchmarks and scale tests.
+
+The same `rows`, `seed` and chunk size always produce the same frames, so benchmark runs of
+different releases ingest identical data.
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+from datetime import datetime
+from functools import cached_property
+from typing import Dict, Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+from database.CONFIG import SATELLITE_CONFIG
+
+# Share of the total row count per table, roughly the mix of the production database.
+ROW_SHARES = {
+    "downloads": 0.05,
+    "images": 0.02,
+    "detections": 0.02,
+    "objects": 0.11,
+    "ais": 0.80,
+}
+
+AIS_TRACK_POINTS = 20  # positions per vessel track around each image
+_TABLE_SEEDS = {name: number for number, name in enumerate(ROW_SHARES)}
+_STATUSES = np.array(["completed"] * 18 + ["failed", "in_progress"])
+_OBJECT_CLASSES = np.array(["ship"] * 8 + ["wind_turbine", "platform"])
+
+
+def _ids(prefix: str, index: np.ndarray) -> pd.Series:
+    return prefix + pd.Series(index).astype(str).str.zfill(9)
+
+
+class SyntheticData:
+    def __init__(
+        self,
+        rows: int = 10_000,
+        seed: int = 0,
+        start: datetime = datetime(2024, 1, 1),
+        days: int = 365,
+        chip_bytes: int = 2048,
+        region: Tuple[float, float, float, float] = (7.0, 54.0, 16.0, 58.0),
+    ):
+        """
+        Generate images, detections, objects, AIS tracks and downloads that reference each other.
+
+        Args:
+            rows (int): Total number of rows over all tables, split by ROW_SHARES.
+            seed (int): Random seed.
+            start (datetime): Acquisition time of the first image.
+            days (int): Period the acquisitions are spread over.
+            chip_bytes (int): Size of the random image chip behind each `encoded_image` (base64 encoded).
+            region (tuple): (min_lon, min_lat, max_lon, max_lat) of the image centres.
+        """
+        self.seed = seed
+        self.start = np.datetime64(start, "us")
+        self.days = days
+        self.chip_bytes = chip_bytes
+        self.region = region
+        self.counts = self.plan(rows)
+        self.constellations = np.array(list(SATELLITE_CONFIG))
+
+    @staticmethod
+    def plan(rows: int) -> Dict[str, int]:
+        """
+        Rows per table for a total of `rows` (at least one image, and whole AIS tracks per image).
+        """
+        counts = {name: int(rows * share) for name, share in ROW_SHARES.items()}
+        counts["images"] = max(counts["images"], 1)
+        counts["ais"] -= counts["ais"] % (AIS_TRACK_POINTS * counts["images"])
+        return counts
+
+    def frames(self, table: str, chunk_size: int = 100_000) -> Iterator[pd.DataFrame]:
+        """
+        Yield the rows of `table` as DataFrames of at most `chunk_size` rows.
+
+        Args:
+            table (str): One of ROW_SHARES.
+            chunk_size (int): Rows per DataFrame.
+        """
+        if table not in ROW_SHARES:
+            raise ValueError(f"No synthetic data for table '{table}'. Choose one of {list(ROW_SHARES)}")
+        generate = getattr(self, f"_{table}")
+        for start in range(0, self.counts[table], chunk_size):
+            index = np.arange(start, min(start + chunk_size, self.counts[table]))
+            yield generate(index, np.random.default_rng([self.seed, _TABLE_SEEDS[table], start]))
+
+    # Per-image attributes are pure functions of the image index, so every table can derive
+    # the image a row belongs to without generating the images first.
+    def _image_times(self, image_index: np.ndarray) -> np.ndarray:
+        step = np.int64(self.days * 86_400_000_000 // self.counts["images"])
+        return self.start + (image_index * step).astype("timedelta64[us]")
+
+    @cached_property
+    def _centres(self) -> Tuple[np.ndarray, np.ndarray]:
+        rng = np.random.default_rng([self.seed, 99])
+        min_lon, min_lat, max_lon, max_lat = self.region
+        return rng.uniform(min_lat, max_lat, self.counts["images"]), rng.uniform(min_lon, max_lon, self.counts["images"])
+
+    @cached_property
+    def _tracks(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        rng = np.random.default_rng([self.seed, 98])
+        tracks = self.counts["ais"] // AIS_TRACK_POINTS
+        return rng.normal(0.0, 0.25, (tracks, 2)), rng.uniform(0.0, 20.0, tracks), rng.uniform(0.0, 360.0, tracks)
+
+    def _image_centres(self, image_index: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        lat, lon = self._centres
+        return lat[image_index], lon[image_index]
+
+    def _image_constellations(self, image_index: np.ndarray) -> np.ndarray:
+        return self.constellations[image_index % len(self.constellations)]
+
+    def _images(self, index: np.ndarray, rng: np.random.Generator) -> pd.DataFrame:
+        lat, lon = self._image_centres(index)
+        ids = _ids("SYN_IMG_", index)
+        return pd.DataFrame(
+            {
+                "id": ids,
+                "constellation": self._image_constellations(index),
+                "acquisition_time": self._image_times(index),
+                "file_path": "/data/synthetic/" + ids + ".tif",
+                "latitude": lat,
+                "longitude": lon,
+            }
+        )
+
+    def _downloads(self, index: np.ndarray, rng: np.random.Generator) -> pd.DataFrame:
+        image_index = index % self.counts["images"]
+        lat, lon = self._image_centres(image_index)
+        constellation = self._image_constellations(image_index)
+        acquisition = self._image_times(image_index)
+        latency = rng.gamma(2.0, 3.0, len(index))  # hours
+        config = {name: SATELLITE_CONFIG[name] for name in self.constellations}
+        ids = _ids("SYN_PRD_", index)
+        return pd.DataFrame(
+            {
+                "product_id": ids,
+                "constellation": constellation,
+                "sensor_mode": [config[c]["sensor_modes"][0] for c in constellation],
+                "product_type": [config[c]["product_types"][0] for c in constellation],
+                "processing_level": [config[c]["processing_levels"][0] for c in constellation],
+                "status": rng.choice(_STATUSES, len(index)),
+                "acqusition_time": acquisition,
+                "publication_time": acquisition + (latency * 3_600_000_000).astype("timedelta64[us]"),
+                "latency": latency,
+                "latitude": lat,
+                "longitude": lon,
+                "name": ids + ".SAFE",
+                "file_path": "/data/synthetic/" + ids + ".zip",
+                "file_size_mb": rng.uniform(800.0, 1800.0, len(index)).round(1),
+            }
+        )
+
+    def _detections(self, index: np.ndarray, rng: np.random.Generator) -> pd.DataFrame:
+        image_index = index % self.counts["images"]
+        lat, lon = self._image_centres(image_index)
+        ships = rng.poisson(12, len(index)).astype(float)
+        return pd.DataFrame(
+            {
+                "constellation": self._image_constellations(image_index),
+                "image_id": _ids("SYN_IMG_", image_index),
+                "detection_file": "/data/synthetic/detections/" + _ids("SYN_DET_", index) + ".json",
+                "timestamp": self._image_times(image_index) + np.timedelta64(1, "h"),
+                "num_ship_detections": ships,
+                "num_dark_ship_detections": rng.binomial(ships.astype(int), 0.15).astype(float),
+                "latitude": lat,
+                "longitude": lon,
+            }
+        )
+
+    def _objects(self, index: np.ndarray, rng: np.random.Generator) -> pd.DataFrame:
+        count = len(index)
+        image_index = index * self.counts["images"] // max(self.counts["objects"], 1)
+        lat, lon = self._image_centres(image_index)
+        probability = rng.uniform(0.5, 1.0, count)
+        length = rng.uniform(10.0, 300.0, count)
+        chips = rng.bytes(self.chip_bytes * count)
+        return pd.DataFrame(
+            {
+                "image_id": _ids("SYN_IMG_", image_index),
+                "obj_class": rng.choice(_OBJECT_CLASSES, count),
+                "latitude": lat + rng.normal(0.0, 0.2, count),
+                "longitude": lon + rng.normal(0.0, 0.3, count),
+                "distance_to_shore": rng.exponential(15_000.0, count),
+                "class_index": rng.integers(0, 3, count).astype(str),
+                "probability": probability,
+                "probabilities": [json.dumps([round(p, 3), round(1 - p, 3)]) for p in probability],
+                "length_min": length * 0.9,
+                "length_max": length * 1.1,
+                "breadth_min": length * 0.14,
+                "breadth_max": length * 0.18,
+                "orientation_min": rng.uniform(0.0, 170.0, count),
+                "orientation_max": rng.uniform(10.0, 180.0, count),
+                "speed_min": rng.uniform(0.0, 10.0, count),
+                "speed_max": rng.uniform(10.0, 20.0, count),
+                "bbox_width": rng.uniform(8.0, 64.0, count),
+                "bbox_height": rng.uniform(8.0, 64.0, count),
+                "bbox_x": rng.uniform(0.0, 25_000.0, count),
+                "bbox_y": rng.uniform(0.0, 16_000.0, count),
+                "encoded_image": [
+                    base64.b64encode(chips[i * self.chip_bytes : (i + 1) * self.chip_bytes]).decode("ascii") for i in range(count)
+                ],
+            }
+        )
+
+    def _ais(self, index: np.ndarray, rng: np.random.Generator) -> pd.DataFrame:
+        # Straight tracks of AIS_TRACK_POINTS positions, 30 s apart, centred on the acquisition.
+        per_image = self.counts["ais"] // self.counts["images"]
+        image_index = index // per_image
+        track = index // AIS_TRACK_POINTS
+        point = index % AIS_TRACK_POINTS
+        lat, lon = self._image_centres(image_index)
+
+        offsets, speeds, headings = self._tracks  # speeds in knots
+
+        seconds = (point - AIS_TRACK_POINTS // 2) * 30.0
+        distance = speeds[track] * 0.514 * seconds / 111_320.0  # degrees
+        radians = np.radians(headings[track])
+        return pd.DataFrame(
+            {
+                "image_id": _ids("SYN_IMG_", image_index),
+                "mmsi": (219_000_000 + track % 1_000_000).astype(str),
+                "timestamp": self._image_times(image_index) + (seconds * 1_000_000).astype("timedelta64[us]"),
+                "latitude": lat + offsets[track, 0] + distance * np.cos(radians) + rng.normal(0.0, 1e-5, len(index)),
+                "longitude": lon + offsets[track, 1] + distance * np.sin(radians) / np.cos(np.radians(lat)),
+                "speed": speeds[track],
+                "heading": headings[track],
+                "type": np.where(track % 5 == 0, "Fishing", "Cargo"),
+            }
+        )
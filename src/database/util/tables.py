@@ -6,9 +6,9 @@ from __future__ import annotations
 
 
 from datetime import datetime
-from sqlalchemy import Column, String, DateTime, Float, ForeignKey, JSON
+from sqlalchemy import Boolean, Column, String, DateTime, Float, ForeignKey, JSON, Index, Integer, UniqueConstraint
 from sqlalchemy.orm import relationship
-from database.util.base import Base, BaseMixin
+from database.util.base import Base, BaseMixin, heavy
 
 
 class Constellation(Base, BaseMixin):
@@ -38,6 +38,11 @@ class DownloadRecord(Base, BaseMixin):
     """
 
     __tablename__ = "downloads"
+    __table_args__ = (
+        Index("ix_downloads_download_time", "download_time"),
+        Index("ix_downloads_status", "status"),
+        Index("ix_downloads_constellation_status", "constellation", "status"),
+    )
     product_id = Column(String(255), primary_key=True)
     query_id = Column(String(36), ForeignKey("query_history.id"))
     constellation = Column(String(50), ForeignKey("constellations.name"))
@@ -58,7 +63,7 @@ class DownloadRecord(Base, BaseMixin):
     file_path = Column(String(255))
     file_size_mb = Column(Float)
     checksum = Column(String(64))
-    product_metadata = Column(JSON, name="metadata")
+    product_metadata = heavy(Column(JSON, name="metadata"))
 
     latency = Column(Float, nullable=True)
     download_time = Column(Float, nullable=True)  # TODO: should probabilitt add some latency
@@ -74,6 +79,10 @@ class ImageRecord(Base, BaseMixin):
     """
 
     __tablename__ = "images"
+    __table_args__ = (
+        Index("ix_images_constellation_acquisition_time", "constellation", "acquisition_time"),
+        Index("ix_images_acquisition_time", "acquisition_time"),
+    )
     id = Column(String(255), primary_key=True)
     constellation = Column(String(50), ForeignKey("constellations.name"))
     acquisition_time = Column(DateTime)
@@ -92,6 +101,10 @@ class DetectionRecord(Base, BaseMixin):
     """
 
     __tablename__ = "detections"
+    __table_args__ = (
+        Index("ix_detections_image_id", "image_id"),
+        Index("ix_detections_constellation_image_id", "constellation", "image_id"),
+    )
     id = Column(String(36), primary_key=True)
     constellation = Column(String(50), ForeignKey("constellations.name"))
     image_id = Column(String(255), ForeignKey("images.id"))
@@ -116,6 +129,10 @@ class AISRecord(Base, BaseMixin):
     """
 
     __tablename__ = "ais"
+    __table_args__ = (
+        Index("ix_ais_image_id_timestamp", "image_id", "timestamp"),
+        Index("ix_ais_timestamp", "timestamp"),
+    )
 
     id = Column(String(36), primary_key=True)
     image_id = Column(String(255), ForeignKey("images.id"), nullable=False)
@@ -135,6 +152,7 @@ class AISRecord(Base, BaseMixin):
 
 class ObjectRecord(Base, BaseMixin):
     __tablename__ = "objects"
+    __table_args__ = (Index("ix_objects_image_id", "image_id"),)
 
     id = Column(String, primary_key=True)
     image_id = Column(String, ForeignKey("images.id"))
@@ -144,7 +162,7 @@ class ObjectRecord(Base, BaseMixin):
     distance_to_shore = Column(Float)
     class_index = Column(String)
     probability = Column(Float)
-    probabilities = Column(String)  # JSON-encoded list
+    probabilities = heavy(Column(String))  # JSON-encoded list
     length_min = Column(Float)
     length_max = Column(Float)
     breadth_min = Column(Float)
@@ -157,4 +175,121 @@ class ObjectRecord(Base, BaseMixin):
     bbox_height = Column(Float)
     bbox_x = Column(Float)
     bbox_y = Column(Float)
-    encoded_image = Column(String)
+    encoded_image = heavy(Column(String))  # NULL once the chip is in the pack file, see database.util.chips
+    chip_hash = Column(String(64), nullable=True)
+    chip_offset = Column(Integer, nullable=True)
+    chip_length = Column(Integer, nullable=True)
+
+    # Filled in by database.util.matching: the AIS vessel matched to the object, if any.
+    matched_mmsi = Column(String(50), nullable=True)
+    match_distance_m = Column(Float, nullable=True)
+    is_dark = Column(Boolean, nullable=True)
+
+
+class ChipBlob(Base, BaseMixin):
+    """
+    Image chips in the pack file, by content hash (see database.util.chips).
+    """
+
+    __tablename__ = "chips"
+    hash = Column(String(64), primary_key=True)
+    offset = Column(Integer, nullable=False)
+    length = Column(Integer, nullable=False)
+
+
+class Footprint(Base, BaseMixin):
+    """
+    Parsed footprint of a query or download, indexed by `footprints_rtree` (see database.util.footprints).
+    """
+
+    __tablename__ = "footprints"
+    __table_args__ = (UniqueConstraint("source", "key"),)
+    id = Column(Integer, primary_key=True)  # key of the R*Tree
+    source = Column(String(16), nullable=False)  # "query" or "download"
+    key = Column(String(255), nullable=False)  # query_history.id or downloads.product_id
+    geometry = Column(String)  # JSON parts; NULL until parsed, "[]" when unparseable
+    min_lon = Column(Float)
+    min_lat = Column(Float)
+    max_lon = Column(Float)
+    max_lat = Column(Float)
+
+
+class CachedSearch(Base, BaseMixin):
+    """
+    Catalogue search results by normalized query, until they expire (see database.util.searches).
+    """
+
+    __tablename__ = "search_results"
+    __table_args__ = (
+        Index("ix_search_results_lookup", "constellation", "parameters", "expires_at"),
+        Index("ix_search_results_expires_at", "expires_at"),
+    )
+    key = Column(String(64), primary_key=True)  # sha256 of the normalized query
+    query_id = Column(String(36), ForeignKey("query_history.id"), nullable=False)
+    constellation = Column(String(50))
+    parameters = Column(String)  # canonical JSON, compared as text
+    start_date = Column(DateTime)
+    end_date = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    num_products = Column(Integer)
+    products = heavy(Column(String))  # JSON list of the catalogue's product dicts
+
+
+class SchemaVersion(Base, BaseMixin):
+    """
+    Applied schema migrations, see database.util.migrations.
+    """
+
+    __tablename__ = "schema_version"
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String(255))
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DatabaseMetadata(Base, BaseMixin):
+    """
+    Key/value facts about the database itself, e.g. the schema fingerprint.
+    """
+
+    __tablename__ = "db_metadata"
+    key = Column(String(64), primary_key=True)
+    value = Column(String)
+
+
+class AISPartition(Base, BaseMixin):
+    """
+    A monthly AIS partition: a separate SQLite file holding the `ais` rows of one month.
+    """
+
+    __tablename__ = "ais_partitions"
+    schema_name = Column(String(20), primary_key=True)  # e.g. "ais_2024_05", also the ATTACH name
+    month_start = Column(DateTime, nullable=False)
+    month_end = Column(DateTime, nullable=False)  # exclusive
+    path = Column(String(255), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class TableGeneration(Base, BaseMixin):
+    """
+    Write generation per table, bumped by every committed write (see database.util.cache).
+    """
+
+    __tablename__ = "table_generations"
+    table_name = Column(String(64), primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+
+
+class IngestedFile(Base, BaseMixin):
+    """
+    Detection files already ingested, with the mtime and size they had (see database.util.ingest).
+    """
+
+    __tablename__ = "ingested_files"
+    path = Column(String, primary_key=True)
+    mtime_ns = Column(Integer, nullable=False)
+    size = Column(Integer, nullable=False)
+    image_id = Column(String(255))
+    detection_id = Column(String(36))
+    num_objects = Column(Integer)
+    ingested_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,166 @@
+"""
+Write-behind queue: group commit for high-frequency single-row writes.
+
+With `Settings.write_behind`, `record_download`, `record_detection` and `register_image`
+queue their row and return a `Future` instead of writing. A single writer thread drains the
+queue and writes everything pending, from all managers, in one transaction: one lock
+acquisition and one fsync per batch instead of per call, and no worker thread ever waits on
+SQLite's write lock. A caller that needs durability waits on its future (or `flush()`);
+queued rows are not visible to readers before their batch commits.
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+# Control items share the (manager, row, options, future) shape of the queued operations.
+_FLUSH = object()
+_STOP = object()
+
+
+def _is_control(item: Tuple[Any, ...]) -> bool:
+    return item[0] is _FLUSH or item[0] is _STOP
+
+
+class WriteBehindQueue:
+    def __init__(self, engine, flush_interval: float = 0.05, batch_size: int = 1000, max_pending: int = 10_000):
+        """
+        Queue single-row upserts and commit them in group transactions on a background thread.
+
+        Args:
+            engine: Writer engine.
+            flush_interval (float): Seconds the writer waits for more rows after the first of a batch.
+            batch_size (int): Most operations written per transaction.
+            max_pending (int): Queue bound; `submit` blocks while the queue is full.
+        """
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.batches = 0
+        self.operations = 0
+        self.failed = 0
+        self._queue: "queue.Queue[Tuple[Any, ...]]" = queue.Queue(maxsize=max_pending)
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def start(self) -> "WriteBehindQueue":
+        self._thread = threading.Thread(target=self._run, name="database-write-behind", daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, manager, row: Dict[str, Any], **options) -> Future:
+        """
+        Queue one row for `manager.upsert_many`.
+
+        Args:
+            manager: A FrameInsertMixin manager.
+            row (dict): Table columns of the row.
+            **options: `upsert_many` options, e.g. `default_policy="keep"`.
+
+        Returns:
+            Future: Resolves once the row is committed; holds the exception if it could not be written.
+        """
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The write-behind queue is closed")
+            # Under the lock, so nothing is queued behind the stop item. A full queue blocks here:
+            # back-pressure on the producers; the writer thread drains it without the lock.
+            self._queue.put((manager, row, options, future))
+        return future
+
+    def flush(self, timeout: Optional[float] = None):
+        """
+        Wait until everything queued before this call is committed (or failed).
+
+        After `close()` there is nothing left to flush: this waits for the writer thread to finish.
+        """
+        future: Future = Future()
+        with self._lock:
+            closed = self._closed
+            if not closed:  # a later stop item is queued behind this one, so it still resolves
+                self._queue.put((_FLUSH, None, None, future))
+        if closed:
+            if self._thread is not None:
+                self._thread.join(timeout)
+            return
+        future.result(timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Write everything still queued and stop the writer thread. Safe to call twice.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._thread is not None:
+                self._queue.put((_STOP, None, None, None))
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def info(self) -> Dict[str, int]:
+        return {"batches": self.batches, "operations": self.operations, "failed": self.failed, "pending": self._queue.qsize()}
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            # Collect until the batch is full or the interval is over; a flush or stop ends it early.
+            while len(batch) < self.batch_size and not _is_control(batch[-1]):
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write([item for item in batch if not _is_control(item)])
+            for item in batch:
+                if item[0] is _FLUSH:
+                    item[3].set_result(None)
+            if batch[-1][0] is _STOP:
+                return
+
+    def _write(self, operations: List[Tuple[Any, Dict[str, Any], Dict[str, Any], Future]]):
+        if not operations:
+            return
+        try:
+            self._commit(operations)
+        except Exception as error:
+            if len(operations) == 1:
+                self.failed += 1
+                operations[0][3].set_exception(error)
+                return
+            # Find the bad rows: write the operations one by one, each failure only fails its own future.
+            for operation in operations:
+                self._write([operation])
+            return
+        self.batches += 1
+        self.operations += len(operations)
+        for operation in operations:
+            operation[3].set_result(None)
+
+    def _commit(self, operations: List[Tuple[Any, Dict[str, Any], Dict[str, Any], Future]]):
+        # One executemany per (manager, options), in the order the groups were first queued.
+        groups: Dict[Tuple[int, Tuple], Tuple[Any, Dict[str, Any], List[Dict[str, Any]]]] = {}
+        for manager, row, options, _ in operations:
+            key = (id(manager), tuple(sorted(options.items())))
+            groups.setdefault(key, (manager, options, []))[2].append(row)
+
+        written = []
+        with self.engine.begin() as conn:
+            for manager, options, rows in groups.values():
+                frame = pd.DataFrame.from_records(rows)
+                plan = manager._upsert_plan(frame, **options)
+                if plan is not None:
+                    statement, prepared = plan
+                    conn.execute(statement, manager._before_write(conn, prepared.to_dict("records")))
+                    written.append((manager, frame))
+        for manager, frame in written:
+            manager._after_upsert(frame)
@@ -1,12 +1,18 @@
+import gc
+import json
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 import shutil
+import pandas as pd
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
 import pytest
 from database.database_handler import DatabaseHandler
-from database.util.tables import ImageRecord, DetectionRecord, AISRecord
+from database.util.tables import ImageRecord, DetectionRecord, AISRecord, ObjectRecord
 from database.util.base import Settings
 import uuid
+import weakref
 
 from database.util.tables import (
     ProductQueryHistory,
@@ -129,3 +135,704 @@ def test_insert_download_record(temp_db):
 
     with temp_db.session_scope() as s:
         assert s.query(DownloadRecord).filter_by(product_id=product_id).first() is not None
+
+
+def test_stream_ais_records_from_generator(temp_db):
+    insert_test_product(temp_db, "TEST_STREAM_001", "SENTINEL-1")
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    entries = ({"mmsi": str(219000000 + idx), "timestamp": start + timedelta(seconds=idx), "latitude": 55.0, "longitude": 11.0} for idx in range(25))
+    chunks = []
+
+    stats = temp_db.ais_manager.stream_ais_records(entries, image_id="TEST_STREAM_001", chunk_size=10, progress=chunks.append)
+
+    assert stats["rows"] == 25
+    assert stats["chunks"] == 3
+    assert [c["rows"] for c in chunks] == [10, 20, 25]
+    with temp_db.session_scope() as s:
+        assert s.query(AISRecord).filter_by(image_id="TEST_STREAM_001").count() == 25
+
+
+def test_stream_ais_records_from_csv(temp_db, tmp_path):
+    insert_test_product(temp_db, "TEST_STREAM_CSV", "SENTINEL-1")
+    csv_file = tmp_path / "aisdk.csv"
+    csv_file.write_text(
+        "# Timestamp,Type of mobile,MMSI,Latitude,Longitude,SOG,Heading,IMO,Name,Ship type,Length\n"
+        "01/01/2024 00:00:01,Class A,219000001,55.1,11.2,12.5,90,Unknown,VESSEL A,Cargo,120\n"
+        "01/01/2024 00:00:02,Class A,219000002,55.2,11.3,,,Unknown,VESSEL B,Tanker,\n"
+    )
+
+    stats = temp_db.ais_manager.stream_ais_records(csv_file, image_id="TEST_STREAM_CSV")
+
+    assert stats["rows"] == 2
+    with temp_db.session_scope() as s:
+        record = s.query(AISRecord).filter_by(image_id="TEST_STREAM_CSV", mmsi="219000001").one()
+        assert record.speed == 12.5
+        assert record.timestamp == datetime(2024, 1, 1, 0, 0, 1)
+        assert record.type == "Cargo"
+
+
+def _object_frame(count: int) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "obj_class": ["ship"] * count,
+            "latitude": [55.0 + idx * 0.001 for idx in range(count)],
+            "longitude": [11.0] * count,
+            "probability": [0.9] * count,
+            "length_min": [10] * count,
+            "encoded_image": ["aGVsbG8="] * count,
+        }
+    )
+
+
+def test_insert_dataframe_objects(temp_db):
+    insert_test_product(temp_db, "TEST_FRAME_001", "SENTINEL-1")
+
+    inserted = temp_db.object_manager.insert_dataframe(_object_frame(250), batch_size=100, image_id="TEST_FRAME_001")
+
+    assert inserted == 250
+    with temp_db.session_scope() as s:
+        objects = s.query(ObjectRecord).filter_by(image_id="TEST_FRAME_001").all()
+        assert len(objects) == 250
+        assert len({o.id for o in objects}) == 250
+        assert objects[0].length_min == 10.0
+
+
+def test_insert_dataframe_rejects_unknown_and_missing_columns(temp_db):
+    with pytest.raises(ValueError, match="Unknown columns"):
+        temp_db.object_manager.insert_dataframe(_object_frame(1).assign(colour="red"), image_id="TEST_FRAME_001")
+    with pytest.raises(ValueError, match="Missing required columns"):
+        temp_db.detection_manager.insert_dataframe(pd.DataFrame({"image_id": ["TEST_FRAME_001"]}))
+
+
+def test_insert_dataframe_downloads_and_images(temp_db):
+    frame = pd.DataFrame(
+        {
+            "product_id": ["DF_DL_1", "DF_DL_2"],
+            "constellation": ["SENTINEL-1", "SENTINEL-1"],
+            "acqusition_time": ["2024-01-01T10:00:00", None],
+            "product_metadata": [{"a": 1}, None],
+        }
+    )
+    temp_db.download_manager.insert_dataframe(frame)
+    temp_db.image_manager.insert_dataframe(pd.DataFrame({"id": ["DF_IMG_1"], "file_path": [Path("/tmp/x.tif")]}), constellation="RCM")
+
+    with temp_db.session_scope() as s:
+        first = s.get(DownloadRecord, "DF_DL_1")
+        assert first.status == "unknown"
+        assert first.acqusition_time == datetime(2024, 1, 1, 10)
+        assert first.product_metadata == {"a": 1}
+        assert s.get(DownloadRecord, "DF_DL_2").acqusition_time is None
+        image = s.get(ImageRecord, "DF_IMG_1")
+        assert (image.constellation, image.file_path) == ("RCM", "/tmp/x.tif")
+
+
+def test_insert_arrow_detections(temp_db):
+    pa = pytest.importorskip("pyarrow")
+    table = pa.table({"image_id": ["TEST_FRAME_001"] * 3, "constellation": ["SENTINEL-1"] * 3, "detection_file": ["a.json", "b.json", "c.json"]})
+
+    assert temp_db.detection_manager.insert_arrow(table, batch_size=2) == 3
+    with temp_db.session_scope() as s:
+        assert s.query(DetectionRecord).filter(DetectionRecord.detection_file.in_(["a.json", "b.json", "c.json"])).count() == 3
+
+
+def test_migrations_add_indexes_to_existing_db(tmp_path):
+    db_file = tmp_path / "legacy.db"
+    db = DatabaseHandler(db_file=db_file)
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_ais_image_id_timestamp"))
+        conn.execute(text("DELETE FROM schema_version"))
+        conn.execute(text("DROP TABLE db_metadata"))
+
+    reopened = DatabaseHandler(db_file=db_file)
+
+    with reopened.engine.connect() as conn:
+        indexes = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+        assert "ix_ais_image_id_timestamp" in indexes
+        assert conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() == reopened.migrator.latest_version
+        plan = " ".join(str(row) for row in conn.execute(text("EXPLAIN QUERY PLAN SELECT * FROM downloads WHERE download_time >= 0")))
+        assert "ix_downloads_download_time" in plan
+    assert reopened.migrator.migrate() == []
+
+
+def test_filter_not_downloaded(temp_db):
+    temp_db.download_manager.record_download({"product_id": "FILTER_DL_1", "constellation": "SENTINEL-1"}, status="DOWNLOADED")
+
+    candidates = ["FILTER_NEW_1", "FILTER_DL_1", "FILTER_NEW_2"]
+    assert temp_db.filter_not_downloaded(candidates) == ["FILTER_NEW_1", "FILTER_NEW_2"]
+    assert temp_db.is_downloaded("FILTER_DL_1")
+    assert not temp_db.is_downloaded("FILTER_NEW_1")
+
+
+def test_download_membership_cache(tmp_path):
+    db = DatabaseHandler(db_file=tmp_path / "cache.db", cache_downloads=True)
+    db.download_manager.record_download({"product_id": "CACHE_1"})
+    db.download_manager.insert_dataframe(pd.DataFrame({"product_id": ["CACHE_2"]}))
+    assert {"CACHE_1", "CACHE_2"} <= db.download_manager.downloaded_ids
+
+    # A write from another handler is not in the cache yet but is still found in the DB.
+    DatabaseHandler(db_file=tmp_path / "cache.db").download_manager.record_download({"product_id": "CACHE_3"})
+    assert db.filter_not_downloaded(["CACHE_1", "CACHE_3", "CACHE_4"]) == ["CACHE_4"]
+    assert "CACHE_3" in db.download_manager.downloaded_ids
+
+
+def test_record_download_is_idempotent(tmp_path):
+    db = DatabaseHandler(db_file=tmp_path / "upsert.db")
+    manager = db.download_manager
+    manager.record_download({"product_id": "UP_1", "checksum": "abc", "ingestion_time": datetime(2024, 1, 2)}, status="completed")
+    # A replayed, older record neither fails nor downgrades the status or erases the checksum.
+    manager.record_download({"product_id": "UP_1", "ingestion_time": datetime(2024, 1, 1)}, status="failed")
+
+    row = db.read_frame("downloads", columns=["status", "checksum", "ingestion_time"], filters={"product_id": "UP_1"})
+    assert row.iloc[0].tolist() == ["completed", "abc", pd.Timestamp(2024, 1, 2)]
+
+    manager.record_download({"product_id": "UP_1", "ingestion_time": datetime(2024, 1, 3)}, status="archived")
+    assert db.read_frame("downloads", columns=["status"], filters={"product_id": "UP_1"})["status"].tolist() == ["archived"]
+
+
+def test_status_only_update_keeps_file_path_and_coordinates(tmp_path):
+    db = DatabaseHandler(db_file=tmp_path / "status.db")
+    db.download_manager.record_download({"product_id": "ST_1", "file_path": "/data/a.zip", "coordinates": [[1, 2], [3, 4]]})
+    db.download_manager.record_download({"product_id": "ST_1"}, status="failed")
+
+    row = db.read_frame("downloads", columns=["status", "file_path", "coordinates"], filters={"product_id": "ST_1"})
+    assert row.iloc[0].tolist() == ["failed", "/data/a.zip", "[[1, 2], [3, 4]]"]
+
+
+def test_upsert_many_policies(tmp_path):
+    db = DatabaseHandler(db_file=tmp_path / "upsert.db")
+    images = [{"id": f"UP_IMG_{i}", "constellation": "SENTINEL-1", "file_path": f"{i}.tif", "latitude": 1.0} for i in range(3)]
+    assert db.image_manager.upsert_many(images) == 3
+
+    replay = pd.DataFrame({"id": ["UP_IMG_0", "UP_IMG_1", "UP_IMG_9"], "file_path": ["new.tif", None, "9.tif"], "latitude": [5.0, 0.5, 2.0]})
+    db.image_manager.upsert_many(replay, policies={"latitude": "min"}, constellation="RCM")
+
+    frame = db.reader.read("images", columns=["id", "constellation", "file_path", "latitude"], order_by="id").astype(object)
+    assert frame.values.tolist() == [
+        ["UP_IMG_0", "RCM", "new.tif", 1.0],
+        ["UP_IMG_1", "RCM", "1.tif", 0.5],
+        ["UP_IMG_2", "SENTINEL-1", "2.tif", 1.0],
+        ["UP_IMG_9", "RCM", "9.tif", 2.0],
+    ]
+
+    db.image_manager.register_image({"id": "UP_IMG_2", "constellation": "RCM", "file_path": "other.tif"})
+    assert db.read_frame("images", columns=["file_path"], filters={"id": "UP_IMG_2"})["file_path"].tolist() == ["2.tif"]
+
+    with pytest.raises(ValueError):
+        db.image_manager.upsert_many(images, policies={"latitude": "largest"})
+    with pytest.raises(ValueError):
+        db.image_manager.upsert_many(images, policies={"missing": "keep"})
+
+
+def test_startup_skips_ddl_when_fingerprint_matches(tmp_path):
+    db_file = tmp_path / "fingerprint.db"
+    DatabaseHandler(db_file=db_file)
+    statements = []
+
+    reopened = DatabaseHandler(db_file=db_file)
+    event.listen(reopened.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    reopened._init_db()
+
+    assert len(statements) == 1 and statements[0].lstrip().startswith("SELECT")
+
+
+def test_read_only_handler(tmp_path):
+    db_file = tmp_path / "readonly.db"
+    DatabaseHandler(db_file=db_file).download_manager.record_download({"product_id": "RO_1"})
+
+    reader = DatabaseHandler(db_file=db_file, read_only=True)
+
+    assert reader.is_downloaded("RO_1")
+    with pytest.raises(OperationalError, match="readonly"):
+        reader.download_manager.record_download({"product_id": "RO_2"})
+
+
+def test_performance_profile_pragmas(tmp_path):
+    settings = Settings(base_path=tmp_path, sqlite_profile="balanced", sqlite_cache_size=-2000)
+    db = DatabaseHandler(config=settings)
+
+    with db.engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+        assert conn.exec_driver_sql("PRAGMA cache_size").scalar() == -2000
+    with db.read_engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA query_only").scalar() == 1
+        with pytest.raises(OperationalError):
+            conn.exec_driver_sql("DELETE FROM downloads")
+
+
+def test_wal_reader_does_not_block_writer(tmp_path):
+    db = DatabaseHandler(config=Settings(base_path=tmp_path, sqlite_profile="balanced", sqlite_busy_timeout=100))
+    db.download_manager.record_download({"product_id": "WAL_1"})
+
+    with db.read_engine.connect() as reader:
+        reader.exec_driver_sql("BEGIN")
+        assert reader.exec_driver_sql("SELECT COUNT(*) FROM downloads").scalar() == 1
+        db.download_manager.record_download({"product_id": "WAL_2"})
+        assert reader.exec_driver_sql("SELECT COUNT(*) FROM downloads").scalar() == 1  # snapshot isolation
+        reader.exec_driver_sql("COMMIT")
+
+    assert db.filter_not_downloaded(["WAL_1", "WAL_2"]) == []
+
+
+def test_unknown_performance_profile(tmp_path):
+    with pytest.raises(ValueError, match="sqlite_profile"):
+        DatabaseHandler(config=Settings(base_path=tmp_path, sqlite_profile="turbo"))
+
+
+def test_synthetic_data_is_deterministic_and_ingests(tmp_path):
+    from database.util.synthetic import SyntheticData
+
+    data = SyntheticData(rows=2_000, seed=7, chip_bytes=64)
+    first = pd.concat(data.frames("ais", chunk_size=500))
+    second = pd.concat(SyntheticData(rows=2_000, seed=7, chip_bytes=64).frames("ais", chunk_size=500))
+    pd.testing.assert_frame_equal(first, second)
+
+    db = DatabaseHandler(db_file=tmp_path / "synthetic.db")
+    for table, manager in (("images", db.image_manager), ("downloads", db.download_manager), ("objects", db.object_manager), ("ais", db.ais_manager)):
+        inserted = sum(manager.insert_dataframe(frame) for frame in data.frames(table, chunk_size=300))
+        assert inserted == data.counts[table]
+    with db.engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(DISTINCT image_id) FROM objects WHERE image_id NOT IN (SELECT id FROM images)")).scalar() == 0
+
+
+def test_query_instrumentation(tmp_path):
+    log = tmp_path / "slow.jsonl"
+    db = DatabaseHandler(db_file=tmp_path / "metrics.db", config=Settings(instrumentation=True, slow_query_ms=0, slow_query_log=log))
+    db.instrumentation.reset()
+
+    db.download_manager.record_download({"product_id": "M_1"}, status="completed")
+    assert db.filter_not_downloaded(["M_1", "M_2", "M_3"]) == ["M_2", "M_3"]
+
+    metrics = db.query_metrics()
+    assert metrics["operations"]["download_manager.record_download"]["count"] == 1
+    # Only methods are wrapped, not callable attributes.
+    assert db.object_manager.model is ObjectRecord and db.object_manager.session_factory is db.session_factory
+    upsert = [s for s in metrics["statements"] if s["sql"].startswith("INSERT INTO downloads")]
+    assert upsert and upsert[0]["rows"] == 1 and upsert[0]["engine"] == "writer"
+    lookup = [s for s in metrics["statements"] if s["operation"] == "download_manager.filter_not_downloaded"]
+    assert lookup[0]["engine"] == "reader" and "IN (?, ...)" in lookup[0]["sql"]
+    assert metrics["transactions"]["writer"]["count"] >= 1 and metrics["lock_waits"]["writer"]["count"] == 1
+
+    slow = [json.loads(line) for line in log.read_text().splitlines()]
+    select_plan = next(entry["plan"] for entry in slow if entry["sql"].startswith("SELECT downloads.product_id"))
+    assert any("sqlite_autoindex_downloads_1" in step or "PRIMARY KEY" in step for step in select_plan)
+
+    text_file = db.write_metrics(tmp_path / "metrics.prom").read_text()
+    assert "# TYPE satdb_statement_duration_seconds histogram" in text_file
+    assert 'satdb_operation_duration_seconds_count{operation="download_manager.record_download"} 1' in text_file
+
+    with pytest.raises(ValueError):
+        DatabaseHandler(db_file=tmp_path / "metrics.db").query_metrics()
+
+
+def test_result_cache_invalidated_by_writes(tmp_path):
+    config = Settings(result_cache_size=8, result_cache_path=tmp_path / "cache.pkl")
+    db = DatabaseHandler(db_file=tmp_path / "cache.db", config=config)
+    db.download_manager.upsert_many([{"product_id": "C_1"}])
+
+    assert len(db.read_frame("downloads")) == 1
+    assert len(db.read_frame("downloads")) == 1
+    counts = db.read_frame("image_counts_by_constellation")
+    assert db.result_cache.info()["hits"] == 1
+    assert set(db.result_cache.dependencies("image_counts_by_constellation")) >= {"images"}
+
+    # A write through any manager, or from another handle on the same file, invalidates the entry.
+    db.download_manager.upsert_many([{"product_id": "C_2"}])
+    assert len(db.read_frame("downloads")) == 2
+    DatabaseHandler(db_file=tmp_path / "cache.db").download_manager.upsert_many([{"product_id": "C_3"}])
+    assert len(db.read_frame("downloads")) == 3
+    insert_test_product(db, "C_IMG_1", "SENTINEL-1")
+    assert db.read_frame("image_counts_by_constellation")["num_images"].sum() == counts["num_images"].sum() + 1
+    assert db.result_cache.info()["hits"] == 1
+
+    # Saved entries are reused by the next process, but only while still current.
+    db.result_cache.save()
+    reopened = DatabaseHandler(db_file=tmp_path / "cache.db", config=config)
+    assert len(reopened.read_frame("downloads")) == 3 and reopened.result_cache.info()["hits"] == 1
+    other = DatabaseHandler(db_file=tmp_path / "other.db", config=config)
+    assert other.result_cache.info()["entries"] == 0
+
+
+def _write_scene(path: Path, image_id: str, objects: int):
+    scene = {
+        "image_id": image_id,
+        "constellation": "SENTINEL-1",
+        "objects": [{"obj_class": "ship", "latitude": 55.0 + i, "longitude": 10.0, "probabilities": [0.9, 0.1]} for i in range(objects)],
+    }
+    path.write_text(json.dumps(scene))
+
+
+def test_ingest_detections_skips_unchanged_files(tmp_path):
+    db = DatabaseHandler(db_file=tmp_path / "ingest.db", config=Settings(base_path=tmp_path))
+    directory = db.config.detections_dir
+    directory.mkdir(parents=True)
+    for i in range(6):
+        _write_scene(directory / f"ING_{i}.json", f"ING_{i}", objects=i)
+    (directory / "broken.json").write_text("{not json")
+    (directory / "no_class.json").write_text(json.dumps({"constellation": "SENTINEL-1", "objects": [{"latitude": 1.0, "longitude": 2.0}]}))
+
+    stats = db.ingest_detections(workers=2)
+    assert (stats["files"], stats["detections"], stats["objects"]) == (6, 6, 15)
+    assert sorted(stats["errors"]) == [str(directory / "broken.json"), str(directory / "no_class.json")]
+    assert db.ingest_detections()["skipped"] == 6  # failed files are retried
+
+    # A changed file replaces its scene's rows instead of adding to them.
+    _write_scene(directory / "ING_5.json", "ING_5", objects=2)
+    stats = db.ingest_detections(workers=1)
+    assert (stats["files"], stats["skipped"]) == (1, 5)
+    objects = db.read_frame("objects", columns=["image_id", "probabilities"], json_columns="raw")
+    assert len(objects) == 12 and (objects["image_id"] == "ING_5").sum() == 2
+    assert json.loads(objects["probabilities"].iloc[0]) == [0.9, 0.1]
+    assert len(db.read_frame("detections", filters={"image_id": "ING_5"})) == 1
+
+
+def test_ingest_keeps_optional_object_keys_of_every_file(tmp_path):
+    db = DatabaseHandler(db_file=tmp_path / "ingest.db", config=Settings(base_path=tmp_path))
+    directory = db.config.detections_dir
+    directory.mkdir(parents=True)
+    first = {"obj_class": "ship", "latitude": 55.0, "longitude": 10.0, "speed_max": 4.0}
+    second = {"obj_class": "ship", "latitude": 56.0, "longitude": 10.0, "speed_max": 6.0, "length_min": 12.5, "encoded_image": "aGVsbG8="}
+    for image_id, obj in (("OPT_1", first), ("OPT_2", second)):
+        (directory / f"{image_id}.json").write_text(json.dumps({"image_id": image_id, "constellation": "SENTINEL-1", "objects": [obj]}))
+
+    # One file per parse chunk: the two chunks' rows have different keys.
+    db.ingestor.parse_chunk = 1
+    assert db.ingest_detections(workers=1)["objects"] == 2
+
+    objects = db.read_frame("objects", columns=["id", "image_id", "speed_max", "length_min", "chip_length"]).set_index("image_id")
+    assert objects.loc["OPT_1", "speed_max"] == 4.0 and pd.isna(objects.loc["OPT_1", "length_min"])
+    assert objects.loc["OPT_2", "length_min"] == 12.5 and objects.loc["OPT_2", "speed_max"] == 6.0
+    assert bytes(db.get_chips([objects.loc["OPT_2", "id"]])[objects.loc["OPT_2", "id"]]) == b"hello"
+
+
+def test_reingest_replaces_detection_on_compact_database(tmp_path):
+    DatabaseHandler(db_file=tmp_path / "wide.db").convert_to_compact(tmp_path / "compact.db")
+    db = DatabaseHandler(db_file=tmp_path / "compact.db", config=Settings(base_path=tmp_path))
+    directory = db.config.detections_dir
+    directory.mkdir(parents=True)
+    _write_scene(directory / "CRI_1.json", "CRI_1", objects=3)
+    db.ingest_detections(workers=1)
+
+    _write_scene(directory / "CRI_1.json", "CRI_1", objects=1)
+    assert db.ingest_detections(workers=1)["files"] == 1
+    assert len(db.read_frame("detections", filters={"image_id": "CRI_1"})) == 1
+    assert len(db.read_frame("objects", filters={"image_id": "CRI_1"})) == 1
+
+
+def test_publish_snapshot(tmp_path):
+    db = DatabaseHandler(db_file=tmp_path / "live.db")
+    insert_test_product(db, "SNAP_1", "SENTINEL-1", ais_count=3)
+    target = tmp_path / "serve" / "downloads.db"
+
+    stats = db.publish_snapshot(target)
+    assert stats["pages"] > 0 and not target.with_name(".downloads.db.staging").exists()
+    served = DatabaseHandler(db_file=target, read_only=True)
+    assert served.read_frame("images")["id"].tolist() == ["SNAP_1"]
+    with served.read_engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "delete"
+        assert conn.exec_driver_sql("SELECT count(*) FROM sqlite_stat1").scalar() > 0
+        assert "serve_ais_mmsi" in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'").scalars().all()
+    served.read_engine.dispose()
+
+    # Republishing replaces the served file while the live database keeps changing.
+    insert_test_product(db, "SNAP_2", "SENTINEL-1")
+    db.publish_snapshot(target, incremental=True)
+    assert sorted(DatabaseHandler(db_file=target, read_only=True).read_frame("images")["id"]) == ["SNAP_1", "SNAP_2"]
+
+
+def test_convert_to_compact(tmp_path):
+    db = DatabaseHandler(db_file=tmp_path / "wide.db")
+    insert_test_product(db, "CMP_1", "SENTINEL-1", ais_count=5)
+    db.object_manager.insert_dataframe(_object_frame(3), image_id="CMP_1")
+    # Leading zeros and trailing decimals are data: these stay text.
+    db.ais_manager.insert_dataframe(pd.DataFrame([{"image_id": "CMP_1", "mmsi": "002190001", "length": "120.50"}]))
+
+    stats = db.convert_to_compact(tmp_path / "compact.db")
+    assert stats["rows"]["ais"] == 6 and stats["rows"]["objects"] == 3
+    # Ready to be served read-only: rollback journal, no -wal/-shm sidecars.
+    assert not (tmp_path / "compact.db-wal").exists() and not (tmp_path / "compact.db-shm").exists()
+    assert (tmp_path / "compact.db").read_bytes()[18:20] == b"\x01\x01"  # file format versions 1: not WAL
+    compact = DatabaseHandler(db_file=tmp_path / "compact.db")
+
+    columns = ["image_id", "mmsi", "timestamp", "latitude", "speed"]
+    wide_ais, compact_ais = (h.read_frame("ais", columns=columns).sort_values("mmsi", ignore_index=True) for h in (db, compact))
+    wide_ais["timestamp"] = wide_ais["timestamp"].dt.floor("s")  # stored with second resolution
+    pd.testing.assert_frame_equal(wide_ais, compact_ais)
+    assert compact.read_frame("ais")["id"].tolist() == [1, 2, 3, 4, 5, 6]
+    assert compact.read_frame("ais", columns=["mmsi", "length"], filters={"id": 1}).iloc[0].tolist() == ["002190001", "120.50"]
+    with compact.engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT typeof(mmsi), typeof(timestamp), typeof(image_key) FROM ais_data WHERE id = 2").one() == ("integer",) * 3
+
+    # The handler writes through the compatibility views.
+    insert_test_product(compact, "CMP_2", "RCM", ais_count=2)
+    assert len(compact.read_frame("ais", filters={"image_id": "CMP_2"})) == 2
+    with compact.engine.begin() as conn:
+        conn.execute(text("UPDATE objects SET matched_mmsi = '219000001' WHERE id = 1"))
+        conn.execute(text("DELETE FROM ais WHERE image_id = 'CMP_2'"))
+        conn.execute(text("UPDATE ais SET mmsi = '007' WHERE id = 2"))
+    assert compact.read_frame("objects", filters={"id": 1})["matched_mmsi"].tolist() == ["219000001"]
+    assert compact.read_frame("ais", columns=["mmsi"], filters={"id": 2})["mmsi"].tolist() == ["007"]
+    assert len(compact.query_bbox("ais", (12.0, 57.0, 13.0, 58.0))) == 5
+    assert compact.read_frame("image_counts_by_constellation")["num_images"].sum() == 2
+
+    with pytest.raises(RuntimeError, match="compact layout"):
+        DatabaseHandler(db_file=tmp_path / "compact.db", config=Settings(summary_tables=True))
+
+
+def test_compact_database_accepts_manager_upserts(tmp_path):
+    db = DatabaseHandler(db_file=tmp_path / "wide.db")
+    insert_test_product(db, "CUP_1", "SENTINEL-1")
+    db.convert_to_compact(tmp_path / "compact.db")
+    compact = DatabaseHandler(db_file=tmp_path / "compact.db", config=Settings(write_behind=True))
+
+    compact.ais_manager.upsert_many([{"image_id": "CUP_1", "mmsi": "219000001"}])
+    compact.object_manager.upsert_many(_object_frame(2), image_id="CUP_1")
+    compact.detection_manager.record_detection({"constellation": "SENTINEL-1", "image_id": "CUP_1", "detection_file": "d.json"}).result(10)
+    assert [len(compact.read_frame(name, filters={"image_id": "CUP_1"})) for name in ("ais", "objects", "detections")] == [1, 2, 2]
+    with pytest.raises(RuntimeError, match="compact layout"):
+        compact.object_manager.upsert_many([{"id": 1, "image_id": "CUP_1", "obj_class": "ship", "latitude": 1.0, "longitude": 2.0}])
+    compact.close()
+
+
+def test_async_handler_shares_rows_with_sync_handler(tmp_path):
+    pytest.importorskip("aiosqlite")
+    import asyncio
+
+    from database.async_handler import AsyncDatabaseHandler
+
+    settings = Settings(base_path=tmp_path)
+
+    async def run():
+        async with AsyncDatabaseHandler(config=settings, cache_downloads=True) as db:
+            query_id = await db.record_query(
+                {"constellation": "SENTINEL-1", "geometry_wkt": "POINT (10 55)", "start_date": datetime(2024, 1, 1), "end_date": datetime(2024, 1, 2)}
+            )
+            products = [{"product_id": f"P{i}", "query_id": query_id, "constellation": "SENTINEL-1"} for i in range(10)]
+            await asyncio.gather(*(db.record_download(product, "downloaded") for product in products))
+            await db.register_image({"id": "IMG", "constellation": "SENTINEL-1", "file_path": "img.tif"})
+            await db.record_detection({"constellation": "SENTINEL-1", "image_id": "IMG", "detection_file": "img.json", "num_ship_detections": 1})
+            await db.insert_ais_records("IMG", [{"mmsi": "219000001", "timestamp": datetime(2024, 1, 1), "speed": "12.5"}])
+            obj = dict.fromkeys(ObjectRecord.__table__.columns.keys()) | {"obj_class": "ship", "latitude": 55.0, "longitude": 11.0, "encoded_image": "aGVsbG8="}
+            await db.insert_objects("IMG", [obj])
+            objects = await db.read_frame("objects", columns=["obj_class", "chip_length"])
+            return await db.filter_not_downloaded(["P3", "NEW", "P9"]), await db.is_downloaded("P0"), objects
+
+    remaining, downloaded, objects = asyncio.run(run())
+    assert remaining == ["NEW"] and downloaded
+    assert objects["obj_class"].tolist() == ["ship"] and objects["chip_length"].tolist() == [5]
+
+    db = DatabaseHandler(config=settings)
+    assert db.filter_not_downloaded([f"P{i}" for i in range(10)]) == []
+    assert len(db.read_frame("images")) == 1
+    assert len(db.read_frame("detections")) == 1
+    assert db.read_frame("ais")["speed"].tolist() == [12.5]
+    assert bytes(db.get_chips(db.read_frame("objects")["id"])[db.read_frame("objects")["id"][0]]) == b"hello"
+
+
+def test_async_handler_schema_setup_leaves_no_thread_behind(tmp_path):
+    pytest.importorskip("aiosqlite")
+    import asyncio
+    import threading
+
+    from database.async_handler import AsyncDatabaseHandler
+
+    settings = Settings(base_path=tmp_path, write_behind=True, result_cache_size=8, result_cache_path=tmp_path / "results.pkl")
+
+    async def run():
+        async with AsyncDatabaseHandler(config=settings):
+            return [thread.name for thread in threading.enumerate()]
+
+    assert "database-write-behind" not in asyncio.run(run())
+
+
+def test_write_behind_group_commit(tmp_path):
+    db = DatabaseHandler(config=Settings(base_path=tmp_path, write_behind=True, write_behind_interval_ms=200))
+    futures = [db.download_manager.record_download({"product_id": f"P{i}", "constellation": "SENTINEL-1"}, "downloaded") for i in range(20)]
+    bad = db.image_manager.register_image({"id": None, "constellation": "SENTINEL-1", "file_path": "x.tif"})
+    good = db.image_manager.register_image({"id": "IMG", "constellation": "SENTINEL-1", "file_path": "img.tif"})
+
+    for future in futures + [good]:
+        future.result(timeout=10)
+    with pytest.raises(ValueError):
+        bad.result(timeout=10)
+    assert db.filter_not_downloaded(["P0", "P19", "NEW"]) == ["NEW"]
+
+    late = db.download_manager.record_download({"product_id": "LATE", "constellation": "SENTINEL-1"}, "downloaded")
+    db.close()  # flushes what is still queued
+    assert late.done() and late.exception() is None
+    assert db.write_queue.info()["failed"] == 1
+    with pytest.raises(RuntimeError):
+        db.download_manager.record_download({"product_id": "AFTER", "constellation": "SENTINEL-1"})
+    db.flush_writes(timeout=5)  # returns at once: nothing is left to flush
+
+    other = DatabaseHandler(db_file=tmp_path / "other.db", config=Settings(base_path=tmp_path, write_behind=True))
+    other.close()
+    write_queue = weakref.ref(other.write_queue)
+    del other
+    gc.collect()
+    assert write_queue() is None  # close() released the exit hook
+
+
+def test_chips_are_deduplicated_into_the_pack(tmp_path):
+    db = DatabaseHandler(config=Settings(base_path=tmp_path))
+    insert_test_product(db, "CHIP_IMG", "SENTINEL-1")
+    frame = _object_frame(3).assign(encoded_image=["aGVsbG8=", "aGVsbG8=", "not base64!"])
+    db.object_manager.insert_dataframe(frame, image_id="CHIP_IMG")
+
+    objects = db.read_frame("objects").sort_values("encoded_image", na_position="first")
+    assert objects["chip_hash"].notna().tolist() == [True, True, False]
+    assert objects["encoded_image"].tolist()[:2] == [None, None]
+    assert (tmp_path / "downloads.chips").stat().st_size == len(b"hello")
+
+    chips = db.get_chips(objects["id"])
+    assert [bytes(chips[object_id]) for object_id in objects["id"]] == [b"hello", b"hello", b"not base64!"]
+
+    # Copies of the database take the pack along.
+    db.publish_snapshot(tmp_path / "serve" / "served.db")
+    served = DatabaseHandler(db_file=tmp_path / "serve" / "served.db", read_only=True)
+    assert bytes(served.get_chips(objects["id"][:1])[objects["id"].iloc[0]]) == b"hello"
+    db.convert_to_compact(tmp_path / "compact.db")
+    compact = DatabaseHandler(db_file=tmp_path / "compact.db", read_only=True)
+    assert [bytes(chip) for chip in compact.get_chips([1, 2, 3]).values()].count(b"hello") == 2
+
+    pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    db.export_parquet("objects", tmp_path / "exports", inline_chips=True)
+    exported = pq.read_table(tmp_path / "exports" / "objects").to_pandas()
+    assert sorted(exported["encoded_image"]) == ["aGVsbG8=", "aGVsbG8=", "not base64!"]
+
+
+def test_chips_of_rows_after_a_row_without_chip_are_externalized(tmp_path):
+    db = DatabaseHandler(config=Settings(base_path=tmp_path))
+    rows = [{"id": "NO_CHIP"}, {"id": "CHIP", "encoded_image": "aGVsbG8="}]
+    with db.engine.begin() as conn:
+        rows = db.chips.externalize(conn, rows)
+    assert [sorted(row) for row in rows] == [sorted(["id", "encoded_image", "chip_hash", "chip_offset", "chip_length"])] * 2
+    assert rows[0]["chip_hash"] is None and rows[1]["encoded_image"] is None
+    assert bytes(db.chips.read(rows[1]["chip_offset"], rows[1]["chip_length"])) == b"hello"
+
+
+def test_heavy_columns_are_deferred_and_lists_skip_them(tmp_path):
+    from database.util.base import undefer_heavy
+    from database.util.serialize import as_dicts
+
+    db = DatabaseHandler(config=Settings(base_path=tmp_path))
+    insert_test_product(db, "LIST_IMG", "SENTINEL-1")
+    db.object_manager.insert_dataframe(_object_frame(5).assign(probabilities='[0.9, 0.1]'), image_id="LIST_IMG")
+
+    with db.session_scope() as s:
+        light = s.query(ObjectRecord).first()
+        assert "probabilities" not in light.__dict__ and "probabilities" not in as_dicts([light])[0]
+        assert light.as_dict()["probabilities"] == "[0.9, 0.1]" and light.as_dict()["obj_class"] == "ship"
+        loaded = s.query(ObjectRecord).options(undefer_heavy()).all()
+        assert as_dicts(loaded)[0]["probabilities"] == "[0.9, 0.1]"
+
+    rows = db.list_objects(filters={"image_id": "LIST_IMG"}, order_by="latitude", limit=2, offset=1)
+    assert [row["latitude"] for row in rows] == [55.001, 55.002]
+    assert "encoded_image" not in rows[0] and "chip_hash" in rows[0]
+    assert db.list_objects(heavy=True, limit=1)[0]["probabilities"] == "[0.9, 0.1]"
+    records = db.list_objects(columns=["id", "latitude"], shape="records")
+    assert len(records) == 5 and records.latitude.max() == pytest.approx(55.004)
+    db.download_manager.record_download({"product_id": "LIST_DL", "metadata": {"size": 1}})
+    assert "metadata" not in db.list_downloads()[0] and db.list_downloads(heavy=True)[0]["metadata"] == {"size": 1}
+
+
+def test_footprint_index_finds_covering_downloads_and_queries(tmp_path):
+    from database.util.footprints import covers, intersects, parse_footprint
+
+    square = parse_footprint("POLYGON ((0 0, 10 0, 10 10, 0 10, 0 0), (4 4, 6 4, 6 6, 4 6, 4 4))")
+    assert intersects(square, parse_footprint("POINT (2 2)")) and not intersects(square, parse_footprint("POINT (5 5)"))
+    assert covers(square, parse_footprint([[1, 1], [3, 1], [3, 3]])) and not covers(square, parse_footprint("POLYGON ((3 3, 7 3, 7 7, 3 7, 3 3))"))
+    assert parse_footprint("None") is None and parse_footprint("not a footprint") is None
+
+    db = DatabaseHandler(config=Settings(base_path=tmp_path))
+    db.download_manager.record_download({"product_id": "FP_WEST", "coordinates": [[0, 0], [10, 0], [10, 10], [0, 10]]})
+    db.download_manager.record_download({"product_id": "FP_EAST", "coordinates": {"type": "Polygon", "coordinates": [[[20, 0], [30, 0], [25, 10], [20, 0]]]}})
+    db.download_manager.record_download({"product_id": "FP_NONE"})
+    start = datetime(2024, 1, 1)
+    query_id = db.query_manager.record_query(
+        {"constellation": "SENTINEL-1", "geometry_wkt": "POLYGON ((0 0, 30 0, 30 10, 0 10, 0 0))", "start_date": start, "end_date": start + timedelta(days=10)}
+    )
+
+    assert set(db.find_downloads("POLYGON ((8 2, 22 2, 22 3, 8 3, 8 2))").product_id) == {"FP_WEST", "FP_EAST"}
+    assert list(db.find_downloads("POLYGON ((2 2, 3 2, 3 3, 2 3, 2 2))", predicate="covers").product_id) == ["FP_WEST"]
+    # Inside the box of FP_EAST but outside the triangle.
+    assert db.find_downloads("POINT (29 9)").empty
+    aoi = "POLYGON ((5 5, 6 5, 6 6, 5 5))"
+    assert list(db.find_queries(aoi, start + timedelta(days=2), start + timedelta(days=3), predicate="covers").id) == [query_id]
+    assert db.find_queries(aoi, start + timedelta(days=5), start + timedelta(days=20), predicate="covers").empty
+    assert list(db.find_queries(aoi, start + timedelta(days=5), start + timedelta(days=20)).id) == [query_id]
+
+    db.download_manager.record_download({"product_id": "FP_WEST", "coordinates": "POINT (50 50)"})
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM downloads WHERE product_id = 'FP_EAST'")
+    assert db.find_downloads("POLYGON ((0 0, 30 0, 30 10, 0 10, 0 0))").empty
+    assert list(DatabaseHandler(db_file=db.db_path, read_only=True).find_downloads("POINT (50 50)").product_id) == ["FP_WEST"]
+
+
+def test_footprints_crossing_the_antimeridian_are_split(tmp_path):
+    from database.util.footprints import covers, intersects, parse_footprint
+
+    pacific = parse_footprint("POLYGON ((170 0, -170 0, -170 10, 170 10, 170 0))")
+    assert len(pacific) == 2 and all(-180 <= lon <= 180 for _, rings in pacific for lon, _ in rings[0])
+    assert intersects(pacific, parse_footprint("POINT (175 5)")) and intersects(pacific, parse_footprint("POINT (-175 5)"))
+    assert not intersects(pacific, parse_footprint("POINT (0 5)"))
+    assert covers(pacific, parse_footprint("POLYGON ((175 2, -175 2, -175 4, 175 4, 175 2))"))
+
+    db = DatabaseHandler(config=Settings(base_path=tmp_path))
+    db.download_manager.record_download({"product_id": "FP_PACIFIC", "coordinates": [[170, 0], [-170, 0], [-170, 10], [170, 10]]})
+    assert list(db.find_downloads("POINT (-175 5)").product_id) == ["FP_PACIFIC"]
+    assert db.find_downloads("POLYGON ((-10 2, 10 2, 10 4, -10 4, -10 2))").empty
+
+
+def test_search_cache_answers_repeated_and_narrower_searches(tmp_path):
+    catalogue = [
+        {"product_id": "S_WEST", "acqusition_time": datetime(2024, 1, 2), "coordinates": [[0, 0], [4, 0], [4, 4], [0, 4]]},
+        {"product_id": "S_EAST", "acqusition_time": datetime(2024, 1, 8), "coordinates": [[6, 0], [10, 0], [10, 4], [6, 4]]},
+    ]
+    calls = []
+
+    def fetch(query):  # stands in for the remote catalogue
+        calls.append(query)
+        return catalogue
+
+    db = DatabaseHandler(config=Settings(base_path=tmp_path, search_cache_ttl_s=3600))
+    query = {
+        "constellation": "SENTINEL-1",
+        "geometry_wkt": "POLYGON ((0 0, 10 0, 10 4, 0 4, 0 0))",
+        "start_date": datetime(2024, 1, 1),
+        "end_date": datetime(2024, 1, 10),
+        "parameters": {"product_type": "GRD", "orbit": "ASC"},
+    }
+    assert db.search_catalogue(query, fetch) == catalogue and len(calls) == 1
+    assert db.find_queries(query["geometry_wkt"]).shape[0] == 1
+
+    same = dict(query, constellation="sentinel-1", geometry_wkt="POLYGON((0 0,10 0,10 4,0 4,0 0))", parameters={"orbit": "ASC", "product_type": "GRD"})
+    assert db.search_catalogue(same, fetch)[1]["acqusition_time"] == datetime(2024, 1, 8)
+    narrower = dict(query, geometry_wkt="POLYGON ((1 1, 3 1, 3 3, 1 3, 1 1))", end_date=datetime(2024, 1, 5))
+    assert [p["product_id"] for p in db.search_catalogue(narrower, fetch)] == ["S_WEST"]
+    assert [p["product_id"] for p in db.search_catalogue(dict(query, start_date=datetime(2024, 1, 5)), fetch)] == ["S_EAST"]
+    assert len(calls) == 1 and db.search_cache.info() == {"hits": 1, "subsumed": 2, "misses": 1}
+
+    # Wider windows, other parameters and expired results go to the catalogue.
+    db.search_catalogue(dict(query, end_date=datetime(2024, 2, 1)), fetch)
+    db.search_catalogue(dict(query, parameters={"product_type": "SLC"}), fetch)
+    assert len(calls) == 3
+    assert db.search_cache.get(query, now=datetime.utcnow() + timedelta(hours=2)) is None
+    assert db.search_cache.evict_expired(now=datetime.utcnow() + timedelta(hours=2)) == 3
+
+
+def test_status_only_update_keeps_download_footprint(tmp_path):
+    db = DatabaseHandler(db_file=tmp_path / "footprint_status.db")
+    db.download_manager.record_download({"product_id": "FS_1", "coordinates": [[0, 0], [2, 0], [2, 2], [0, 2]]})
+    assert list(db.find_downloads("POINT (1 1)").product_id) == ["FS_1"]
+
+    db.download_manager.record_download({"product_id": "FS_1"}, status="completed")
+    with db.engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM footprints WHERE geometry IS NULL").scalar() == 0  # not re-parsed
+    assert list(db.find_downloads("POINT (1 1)").product_id) == ["FS_1"]
+
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("UPDATE downloads SET coordinates = NULL WHERE product_id = 'FS_1'")
+    assert db.find_downloads("POINT (1 1)").empty
+
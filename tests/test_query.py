@@ -0,0 +1,393 @@
+import math
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from database.database_handler import DatabaseHandler
+from database.util.base import Settings
+from database.util.matching import AISMatcher
+
+
+@pytest.fixture
+def db(tmp_path):
+    return DatabaseHandler(db_file=tmp_path / "downloads.db")
+
+
+def add_image(db, image_id: str, latitude: float, longitude: float, acquisition_time: datetime):
+    db.image_manager.register_image(
+        {
+            "id": image_id,
+            "constellation": "SENTINEL-1",
+            "acquisition_time": acquisition_time,
+            "file_path": f"{image_id}.tif",
+            "latitude": latitude,
+            "longitude": longitude,
+        }
+    )
+
+
+def test_query_bbox_ais(db):
+    add_image(db, "IMG_1", 56.0, 11.0, datetime(2024, 1, 1))
+    ais = [
+        {"mmsi": "1", "latitude": 55.5, "longitude": 10.5, "timestamp": datetime(2024, 1, 1, 10)},
+        {"mmsi": "2", "latitude": 57.5, "longitude": 10.5, "timestamp": datetime(2024, 1, 1, 10)},
+        {"mmsi": "3", "latitude": 55.6, "longitude": 10.6, "timestamp": datetime(2024, 1, 2, 10)},
+    ]
+    db.ais_manager.insert_ais_records("IMG_1", ais)
+
+    inside = db.query_bbox("ais", (10.0, 55.0, 11.0, 56.0))
+    assert sorted(inside["mmsi"]) == ["1", "3"]
+
+    first_day = db.query_bbox("ais", (10.0, 55.0, 11.0, 56.0), time_range=(datetime(2024, 1, 1), datetime(2024, 1, 1, 23)))
+    assert list(first_day["mmsi"]) == ["1"]
+
+
+def test_query_bbox_objects_filter_on_image_time(db):
+    add_image(db, "IMG_OLD", 56.0, 11.0, datetime(2023, 1, 1))
+    add_image(db, "IMG_NEW", 56.0, 11.0, datetime(2024, 1, 1))
+    for image_id in ("IMG_OLD", "IMG_NEW"):
+        db.object_manager.insert_dataframe(
+            pd.DataFrame({"obj_class": ["ship"], "latitude": [56.0], "longitude": [11.0]}),
+            image_id=image_id,
+        )
+
+    result = db.query_bbox("objects", (10.0, 55.0, 12.0, 57.0), time_range=(datetime(2023, 6, 1), None))
+    assert list(result["image_id"]) == ["IMG_NEW"]
+
+
+def test_spatial_index_tracks_updates_and_deletes(db):
+    add_image(db, "IMG_MOVE", 56.0, 11.0, datetime(2024, 1, 1))
+    with db.engine.begin() as conn:
+        conn.execute(text("UPDATE images SET latitude = 60.0 WHERE id = 'IMG_MOVE'"))
+    assert db.query_bbox("images", (10.0, 55.0, 12.0, 57.0)).empty
+    assert list(db.query_bbox("images", (10.0, 59.0, 12.0, 61.0))["id"]) == ["IMG_MOVE"]
+
+    with db.engine.begin() as conn:
+        conn.execute(text("DELETE FROM images WHERE id = 'IMG_MOVE'"))
+        assert conn.execute(text("SELECT COUNT(*) FROM images_rtree")).scalar() == 0
+
+
+def test_spatial_index_backfills_existing_rows(db, tmp_path):
+    add_image(db, "IMG_OLD_ROW", 56.0, 11.0, datetime(2024, 1, 1))
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP TABLE images_rtree"))
+        conn.execute(text("DELETE FROM db_metadata"))
+
+    reopened = DatabaseHandler(db_file=tmp_path / "downloads.db")
+    assert list(reopened.query_bbox("images", (10.0, 55.0, 12.0, 57.0))["id"]) == ["IMG_OLD_ROW"]
+
+
+def test_query_bbox_rejects_unknown_table(db):
+    with pytest.raises(ValueError):
+        db.query_bbox("constellations", (0, 0, 1, 1))
+
+
+def _original_view_sql(name: str) -> str:
+    from database.CONFIG import SATELLITE_CONFIG
+    from database.util.views import DatabaseViews
+
+    for statement in DatabaseViews(None, SATELLITE_CONFIG)._view_statements():
+        if f"CREATE VIEW {name} AS" in statement:
+            return statement.split(" AS", 1)[1].strip().rstrip(";")
+    raise KeyError(name)
+
+
+def test_summary_tables_match_aggregate_views(tmp_path):
+    db = DatabaseHandler(config=Settings(base_path=tmp_path, summary_tables=True))
+    add_image(db, "SUM_1", 56.0, 11.0, datetime(2024, 1, 1))
+    add_image(db, "SUM_2", 56.0, 11.0, datetime(2024, 1, 2))
+    add_image(db, "SUM_3", 56.0, 11.0, datetime(2024, 1, 3))
+    for image_id, ships in (("SUM_1", 3), ("SUM_1", None), ("SUM_2", 7)):
+        db.detection_manager.record_detection(
+            {"constellation": "SENTINEL-1", "image_id": image_id, "detection_file": "d.json", "num_ship_detections": ships}
+        )
+    ships = pd.DataFrame({"obj_class": ["ship"] * 3, "latitude": [1.0] * 3, "longitude": [1.0] * 3, "length_min": [10, None, 30]})
+    db.object_manager.insert_dataframe(ships, image_id="SUM_1")
+    db.object_manager.insert_dataframe(pd.DataFrame({"obj_class": ["ship"], "latitude": [1.0], "longitude": [1.0], "speed_max": [4.0]}), image_id="SUM_2")
+    db.ais_manager.insert_ais_records(
+        "SUM_1", [{"mmsi": str(i), "timestamp": datetime(2024, 1, 1, i), "speed": float(i), "latitude": 1.0, "longitude": 1.0} for i in range(5)]
+    )
+    for product_id, status in (("P1", "DOWNLOADED"), ("P2", "FAILED"), ("P3", None)):
+        db.download_manager.record_download({"product_id": product_id, "constellation": "SENTINEL-1"}, status=status)
+
+    with db.engine.begin() as conn:
+        conn.execute(text("DELETE FROM ais WHERE mmsi IN ('0', '4')"))
+        conn.execute(text("UPDATE downloads SET status = 'DOWNLOADED' WHERE product_id = 'P2'"))
+        conn.execute(text("UPDATE detections SET image_id = 'SUM_3' WHERE num_ship_detections = 7"))
+        conn.execute(text("DELETE FROM objects WHERE length_min = 30"))
+
+    views = [
+        "detection_summary_sentinel_1",
+        "object_summary_sentinel_1",
+        "ais_summary_by_image",
+        "image_counts_by_constellation",
+        "download_summary_by_status",
+    ]
+    with db.read_engine.connect() as conn:
+        for view in views:
+            maintained = pd.read_sql(text(f"SELECT * FROM {view}"), conn)
+            recomputed = pd.read_sql(text(_original_view_sql(view)), conn)
+            sort_by = list(recomputed.columns[:2])
+            pd.testing.assert_frame_equal(
+                maintained.sort_values(sort_by, ignore_index=True),
+                recomputed.sort_values(sort_by, ignore_index=True),
+                check_dtype=False,
+                obj=view,
+            )
+
+    db.rebuild_summaries()
+    with db.read_engine.connect() as conn:
+        assert conn.execute(text("SELECT num_images FROM detection_summary_sentinel_1")).scalar() == 2
+
+
+def test_export_parquet_partitioned_and_incremental(db, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    add_image(db, "EXP_1", 56.0, 11.0, datetime(2024, 1, 1, 12))
+    add_image(db, "EXP_2", 56.0, 11.0, datetime(2024, 1, 2, 12))
+    for image_id in ("EXP_1", "EXP_2"):
+        db.ais_manager.insert_ais_records(image_id, [{"mmsi": str(i), "timestamp": datetime(2024, 1, 1, i), "speed": 1.0} for i in range(5)])
+
+    out_dir = tmp_path / "exports"
+    stats = db.export_parquet("ais", out_dir, chunksize=3)
+
+    assert stats["rows"] == 10
+    assert sorted(p.name for p in (out_dir / "ais" / "constellation=SENTINEL-1").iterdir()) == [
+        "acquisition_date=2024-01-01",
+        "acquisition_date=2024-01-02",
+    ]
+    exported = pq.read_table(out_dir / "ais").to_pandas()
+    assert len(exported) == 10
+    assert str(exported["timestamp"].dtype).startswith("datetime64")
+
+    db.ais_manager.insert_ais_records("EXP_2", [{"mmsi": "99", "timestamp": datetime(2024, 1, 2)}])
+    assert db.export_parquet("ais", out_dir, incremental=True)["rows"] == 1
+    assert db.export_parquet("ais", out_dir, incremental=True)["rows"] == 0
+    assert len(pq.read_table(out_dir / "ais").to_pandas()) == 11
+
+
+def test_export_parquet_falls_back_to_full_after_vacuum_and_keeps_dataset_on_failure(db, tmp_path, monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    add_image(db, "EXP_VAC", 56.0, 11.0, datetime(2024, 1, 1, 12))
+    db.ais_manager.insert_ais_records("EXP_VAC", [{"mmsi": str(i), "timestamp": datetime(2024, 1, 1, i)} for i in range(5)])
+    out_dir = tmp_path / "exports"
+    assert db.export_parquet("ais", out_dir)["rows"] == 5
+
+    # VACUUM may renumber the rowids of `ais` (no INTEGER PRIMARY KEY); done by hand here, as it
+    # depends on the SQLite build. New rows then get rowids below the watermark.
+    with db.engine.begin() as conn:
+        conn.execute(text("DELETE FROM ais WHERE mmsi IN ('0', '1')"))
+        conn.execute(text("UPDATE ais SET rowid = rowid - 2"))
+    db.ais_manager.insert_ais_records("EXP_VAC", [{"mmsi": "99", "timestamp": datetime(2024, 1, 1)}])
+    stats = db.export_parquet("ais", out_dir, incremental=True)
+    assert stats["full"] and stats["rows"] == 4
+    assert sorted(pq.read_table(out_dir / "ais").to_pandas()["mmsi"]) == ["2", "3", "4", "99"]
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(pq, "write_to_dataset", fail)
+    with pytest.raises(OSError):
+        db.export_parquet("ais", out_dir)
+    assert len(pq.read_table(out_dir / "ais").to_pandas()) == 4
+    assert sorted(p.name for p in out_dir.iterdir()) == ["ais"]
+
+
+def test_export_parquet_view(db, tmp_path):
+    pytest.importorskip("pyarrow")
+    add_image(db, "EXP_VIEW", 56.0, 11.0, datetime(2024, 1, 1))
+
+    assert db.export_parquet("image_counts_by_constellation", tmp_path)["rows"] == 1
+    with pytest.raises(ValueError):
+        db.export_parquet("image_counts_by_constellation", tmp_path, incremental=True)
+
+
+def test_read_frame_typed_projection_and_filters(db):
+    for idx, status in enumerate(["DOWNLOADED", "FAILED", "DOWNLOADED"]):
+        db.download_manager.record_download(
+            {
+                "product_id": f"READ_{idx}",
+                "constellation": "SENTINEL-1",
+                "acqusition_time": datetime(2024, 1, 1 + idx),
+                "file_size_mb": 10 * idx,
+                "metadata": {"orbit": idx},
+            },
+            status=status,
+        )
+
+    frame = db.read_frame(
+        "downloads",
+        columns=["product_id", "status", "acqusition_time", "file_size_mb", "metadata"],
+        filters=[("status", "==", "DOWNLOADED"), ("acqusition_time", ">=", datetime(2024, 1, 2))],
+    )
+
+    assert list(frame["product_id"]) == ["READ_2"]
+    assert str(frame["acqusition_time"].dtype) == "datetime64[ns]"
+    assert frame["file_size_mb"].dtype == "float64"
+    assert frame["status"].dtype == "category"
+    assert frame["metadata"].iloc[0]["orbit"] == 2
+    lazy = db.read_frame("downloads", columns=["metadata"], filters={"product_id": "READ_2"}, json_columns="lazy")
+    assert lazy["metadata"].iloc[0].value == {"orbit": 2}
+
+
+def test_read_frame_chunks_and_views(db):
+    for idx in range(5):
+        add_image(db, f"READ_IMG_{idx}", 56.0, 11.0, datetime(2024, 1, 1))
+
+    chunks = list(db.read_frame("images", columns=["id"], filters={"constellation": ["SENTINEL-1"]}, chunksize=2))
+    assert [len(c) for c in chunks] == [2, 2, 1]
+
+    counts = db.read_frame("image_counts_by_constellation")
+    assert counts.set_index("constellation")["num_images"].to_dict() == {"SENTINEL-1": 5}
+
+    with pytest.raises(ValueError):
+        db.read_frame("images", columns=["nope"])
+
+
+def test_read_frame_arrow_backend(db):
+    pytest.importorskip("pyarrow")
+    add_image(db, "READ_ARROW", 56.0, 11.0, datetime(2024, 1, 1))
+
+    frame = db.read_frame("images", columns=["id", "latitude"], dtype_backend="pyarrow")
+    assert str(frame["latitude"].dtype) == "double[pyarrow]"
+
+
+@pytest.fixture
+def partitioned_db(tmp_path):
+    return DatabaseHandler(db_file=tmp_path / "downloads.db", config=Settings(ais_partitioning=True, ais_partitions_attached=2))
+
+
+def test_ais_partitions_route_by_month(partitioned_db, tmp_path):
+    db = partitioned_db
+    add_image(db, "IMG_1", 56.0, 11.0, datetime(2024, 3, 1))
+    ais = [
+        {"mmsi": str(month), "latitude": 55.5, "longitude": 10.5, "speed": float(month), "timestamp": datetime(2024, month, 15)}
+        for month in (2, 3)
+    ] + [{"mmsi": "none", "latitude": 55.5, "longitude": 10.5}]
+    db.ais_manager.insert_ais_records("IMG_1", ais)
+
+    assert sorted(p.name for p in (tmp_path / "ais_partitions").glob("*.db")) == ["ais_2024_02.db", "ais_2024_03.db"]
+    with db.engine.connect() as conn:
+        assert conn.execute(text("SELECT mmsi FROM main.ais")).scalars().all() == ["none"]
+        assert sorted(conn.execute(text("SELECT mmsi FROM ais_all")).scalars()) == ["2", "3", "none"]
+        assert conn.execute(text("SELECT num_ais_records FROM ais_summary_by_image")).scalar() == 3
+        assert conn.execute(text("SELECT COUNT(*) FROM ais_records_with_image_info")).scalar() == 3
+
+    # A third month does not fit in the two attached partitions: the batch fails as a whole.
+    with pytest.raises(ValueError, match="AIS partitions"):
+        db.ais_manager.insert_ais_records("IMG_1", [{"mmsi": "9", "timestamp": datetime(2024, 3, 2)}, {"mmsi": "1", "timestamp": datetime(2024, 1, 15)}])
+    assert not (tmp_path / "ais_partitions" / "ais_2024_01.db").exists()
+
+    february = db.query_ais(datetime(2024, 2, 1), datetime(2024, 3, 1))
+    assert february["mmsi"].tolist() == ["2"]
+    assert sorted(db.query_ais()["mmsi"]) == ["2", "3"]
+
+    with db.read_engine.connect() as conn:
+        assert sorted(conn.execute(text("SELECT mmsi FROM ais_all")).scalars()) == ["2", "3", "none"]
+
+    # Copies and indexes of the main file would miss the partitioned rows.
+    with pytest.raises(ValueError, match="partitioned"):
+        db.publish_snapshot(tmp_path / "served.db")
+    with pytest.raises(ValueError, match="partitioned"):
+        db.query_bbox("ais", (10.0, 55.0, 11.0, 56.0))
+
+    # A registry with more months than can be attached is refused instead of read in part.
+    with pytest.raises(ValueError, match="AIS partitions"):
+        DatabaseHandler(db_file=tmp_path / "downloads.db", config=Settings(ais_partitioning=True, ais_partitions_attached=1))
+
+    pytest.importorskip("pyarrow")
+    with pytest.raises(ValueError, match="ais_all"):
+        db.export_parquet("ais", tmp_path / "exports")
+    assert db.export_parquet("ais_all", tmp_path / "exports")["rows"] == 3
+
+
+def test_ais_partitions_dataframe_and_detach(partitioned_db, tmp_path):
+    db = partitioned_db
+    add_image(db, "IMG_1", 56.0, 11.0, datetime(2024, 3, 1))
+    frame = pd.DataFrame({"mmsi": ["a", "b"], "timestamp": [datetime(2024, 2, 1), datetime(2024, 3, 31, 23)]})
+    db.ais_manager.insert_dataframe(frame, image_id="IMG_1")
+    assert db.ais_partitions.partitions()["schema_name"].tolist() == ["ais_2024_03", "ais_2024_02"]
+
+    archived = db.detach_ais_partition("2024-02", compress=True)
+    assert archived == tmp_path / "ais_partitions" / "archive" / "ais_2024_02.db.gz"
+    assert archived.exists() and not (tmp_path / "ais_partitions" / "ais_2024_02.db").exists()
+    assert db.query_ais()["mmsi"].tolist() == ["b"]
+    with db.engine.connect() as conn:
+        assert conn.execute(text("SELECT mmsi FROM ais_all")).scalars().all() == ["b"]
+
+    # A fresh handler finds the remaining partition in the registry.
+    reopened = DatabaseHandler(db_file=tmp_path / "downloads.db", config=Settings(ais_partitioning=True))
+    assert reopened.query_ais()["mmsi"].tolist() == ["b"]
+    with pytest.raises(ValueError):
+        reopened.detach_ais_partition("2024-02")
+
+
+def _scene(db, image_id: str, acquisition_time: datetime):
+    add_image(db, image_id, 55.0, 11.0, acquisition_time)
+    db.detection_manager.insert_dataframe(pd.DataFrame({"constellation": ["SENTINEL-1"], "image_id": [image_id], "detection_file": ["d.json"]}))
+    # Vessel 1 sails north through the first object; vessel 2 only reported before the scene, heading east.
+    ais = [
+        {"mmsi": "1", "latitude": 55.000, "longitude": 11.0, "timestamp": acquisition_time - timedelta(seconds=60)},
+        {"mmsi": "1", "latitude": 55.002, "longitude": 11.0, "timestamp": acquisition_time + timedelta(seconds=60)},
+        {"mmsi": "2", "latitude": 55.1, "longitude": 11.0, "speed": 10.0, "heading": 90.0, "timestamp": acquisition_time - timedelta(seconds=120)},
+        {"mmsi": "3", "latitude": 55.2, "longitude": 11.0, "timestamp": acquisition_time - timedelta(hours=2)},
+    ]
+    db.ais_manager.insert_ais_records(image_id, ais)
+    east = 10.0 * 0.514444 * 120 / (6_371_000 * math.cos(math.radians(55.1))) * 180 / math.pi
+    objects = pd.DataFrame(
+        {
+            "obj_class": ["ship", "ship", "ship", "platform"],
+            "latitude": [55.001, 55.1, 55.2, 55.3],
+            "longitude": [11.0, 11.0 + east, 11.0, 11.0],
+        }
+    )
+    db.object_manager.insert_dataframe(objects, image_id=image_id)
+
+
+def test_match_ais_labels_dark_ships(db):
+    _scene(db, "IMG_M", datetime(2024, 1, 1, 12))
+    result = db.matcher.match("IMG_M")
+    assert result["matched_mmsi"].tolist() == ["1", "2", None, None]
+    assert result["is_dark"].tolist() == [False, False, True, True]
+    assert result["match_distance_m"].iloc[:2].max() < 1.0
+
+    stored = db.read_frame("objects", columns=["obj_class", "matched_mmsi", "is_dark"], json_columns="raw")
+    assert stored.sort_values("obj_class")["is_dark"].tolist() == [True, False, False, True]
+    assert db.read_frame("detections", columns=["num_dark_ship_detections"])["num_dark_ship_detections"].tolist() == [2.0]
+
+    # Only ships can be dark; the platform is not labelled.
+    ships_only = AISMatcher(db, vessel_classes=["ship"]).match("IMG_M", write=False)
+    assert ships_only["is_dark"].tolist() == [False, False, True, None]
+
+
+def test_match_ais_closes_its_connections(db, monkeypatch):
+    import sqlite3
+
+    from database.util import matching
+
+    opened = []
+
+    def connect(*args, **kwargs):
+        opened.append(sqlite3.connect(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(matching, "sqlite3", SimpleNamespace(connect=connect))
+    for day in (1, 2):
+        _scene(db, f"IMG_C{day}", datetime(2024, 1, day, 12))
+    db.matcher.match("IMG_C1", write=False)
+    assert db.match_ais(workers=1)["images"] == 2
+
+    assert len(opened) == 2  # one per match() call, one shared by the whole archive run
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+def test_match_ais_archive_in_parallel(db):
+    for day in (1, 2, 3):
+        _scene(db, f"IMG_P{day}", datetime(2024, 1, day, 12))
+    stats = db.match_ais(workers=2)
+    assert stats["images"] == 3 and stats["objects"] == 12 and stats["dark"] == 6
+    assert db.read_frame("objects", filters={"is_dark": True}, columns=["id"]).shape[0] == 6